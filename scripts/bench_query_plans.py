@@ -0,0 +1,223 @@
+"""Query plans and timings for the backend's hot queries, before and after
+the schema migrations' indexes.
+
+Seeds a throwaway database at the baseline schema (version 1), prints
+``EXPLAIN QUERY PLAN`` and the median run time for each query, applies the
+remaining migrations and prints the same again. Queries rewritten to use a
+migration's tables (``REWRITTEN``) run in their new form after migrating.
+
+    python scripts/bench_query_plans.py --messages 1000000
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.backend import migrations  # noqa: E402
+
+EVENT_TYPES = [
+    "user_prompt",
+    "assistant_response",
+    "llm_response",
+    "preference_proposed",
+    "tool_run",
+    "conversation_summary",
+]
+
+QUERIES: dict[str, tuple[str, tuple]] = {
+    "chat history (conversation_messages by conversation)": (
+        """
+        SELECT m.id, m.content, m.role, m.timestamp, m.corrects_message_id
+        FROM messages m
+        JOIN conversation_messages cm ON cm.message_id = m.id
+        WHERE cm.conversation_id = ?
+        ORDER BY cm.message_id
+        """,
+        ("conversation",),
+    ),
+    "search join (conversation of a message)": (
+        """
+        SELECT m.id, cm.conversation_id
+        FROM messages m
+        LEFT JOIN conversation_messages cm ON cm.message_id = m.id
+        WHERE m.id = ?
+        """,
+        ("message",),
+    ),
+    "/events?event_type=": (
+        """
+        SELECT id, type, payload_json, created_at, conversation_id, causality_message_id
+        FROM events WHERE type = ? ORDER BY id DESC LIMIT 200
+        """,
+        ("rare_type",),
+    ),
+    "/events?conversation_id=": (
+        """
+        SELECT id, type, payload_json, created_at, conversation_id, causality_message_id
+        FROM events WHERE conversation_id = ? ORDER BY id DESC LIMIT 200
+        """,
+        ("conversation",),
+    ),
+    "/events?event_type=&conversation_id=": (
+        """
+        SELECT id, type, payload_json, created_at, conversation_id, causality_message_id
+        FROM events WHERE type = ? AND conversation_id = ? ORDER BY id DESC LIMIT 200
+        """,
+        ("common_type", "conversation"),
+    ),
+    "_get_pending_proposal": (
+        """
+        SELECT id, key, value FROM preference_proposals
+        WHERE conversation_id = ? AND status = 'pending'
+        ORDER BY id DESC LIMIT 1
+        """,
+        ("conversation",),
+    ),
+    "_latest_summary": (
+        """
+        SELECT id, content FROM conversation_summaries
+        WHERE conversation_id = ? ORDER BY id DESC LIMIT 1
+        """,
+        ("conversation",),
+    ),
+}
+
+
+SIDEBAR_BEFORE = """
+    SELECT c.id, c.title, c.created_at, COUNT(cm.message_id) AS message_count
+    FROM conversations c
+    LEFT JOIN conversation_messages cm ON cm.conversation_id = c.id
+    GROUP BY c.id
+    ORDER BY c.id DESC
+"""
+
+QUERIES["/conversations (sidebar)"] = (SIDEBAR_BEFORE, ())
+QUERIES["/conversations?sort=activity&limit=50"] = (SIDEBAR_BEFORE, ())
+
+REWRITTEN: dict[str, str] = {
+    "/conversations (sidebar)": """
+        SELECT c.id, c.title, c.created_at, s.message_count, s.last_message_id
+        FROM conversations c JOIN conversation_stats s ON s.conversation_id = c.id
+        ORDER BY c.id DESC
+    """,
+    "/conversations?sort=activity&limit=50": """
+        SELECT c.id, c.title, c.created_at, s.message_count, s.last_message_id
+        FROM conversation_stats s JOIN conversations c ON c.id = s.conversation_id
+        ORDER BY s.last_message_id DESC, s.conversation_id DESC
+        LIMIT 51
+    """,
+}
+
+
+def seed(conn: sqlite3.Connection, messages: int, conversations: int, rng: random.Random) -> None:
+    conn.executemany(
+        "INSERT INTO conversations (id, title) VALUES (?, ?)",
+        ((i, f"Conversation {i}") for i in range(1, conversations + 1)),
+    )
+    batch = 50000
+    for start in range(1, messages + 1, batch):
+        ids = range(start, min(start + batch, messages + 1))
+        conv = [rng.randint(1, conversations) for _ in ids]
+        conn.executemany(
+            "INSERT INTO messages (id, content, role) VALUES (?, ?, ?)",
+            ((i, f"message {i} about topic {i % 997}", "user" if i % 2 else "assistant") for i in ids),
+        )
+        conn.executemany(
+            "INSERT INTO conversation_messages (conversation_id, message_id) VALUES (?, ?)",
+            zip(conv, ids),
+        )
+        conn.executemany(
+            """
+            INSERT INTO events (type, payload_json, conversation_id, causality_message_id)
+            VALUES (?, '{}', ?, ?)
+            """,
+            (
+                (EVENT_TYPES[0 if i % 100 else 5] if i % 2 else EVENT_TYPES[1 + i % 3], c, i)
+                for i, c in zip(ids, conv)
+            ),
+        )
+        conn.executemany(
+            """
+            INSERT INTO preference_proposals
+              (conversation_id, key, value, proposal_text, status, causality_message_id)
+            VALUES (?, 'tone', 'brief', 'Keep answers brief?', ?, ?)
+            """,
+            ((c, "pending" if i % 7 == 0 else "rejected", i) for i, c in zip(ids, conv) if i % 20 == 0),
+        )
+        conn.executemany(
+            """
+            INSERT INTO conversation_summaries
+              (conversation_id, covers_through_message_id, covered_count, content)
+            VALUES (?, ?, 10, 'summary')
+            """,
+            ((c, i) for i, c in zip(ids, conv) if i % 50 == 0),
+        )
+        conn.commit()
+    conn.execute("ANALYZE")
+    conn.commit()
+
+
+def run(
+    conn: sqlite3.Connection, args: dict, repeat: int, migrated: bool = False
+) -> list[tuple[str, list[str], float]]:
+    results = []
+    for name, (sql, params) in QUERIES.items():
+        if migrated:
+            sql = REWRITTEN.get(name, sql)
+        bound = tuple(args[p] for p in params)
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", bound)]
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            conn.execute(sql, bound).fetchall()
+            timings.append((time.perf_counter() - started) * 1000.0)
+        results.append((name, plan, statistics.median(timings)))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--conversations", type=int, default=5_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--db", type=Path, help="Database path (default: a temp file)")
+    opts = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = opts.db or Path(tmp) / "bench.db"
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode = WAL")
+        migrations.migrate(conn, target=1)
+        started = time.perf_counter()
+        seed(conn, opts.messages, opts.conversations, random.Random(0))
+        print(f"seeded {opts.messages} messages/events in {time.perf_counter() - started:.1f}s")
+
+        args = {
+            "conversation": opts.conversations // 2,
+            "message": opts.messages // 2,
+            "rare_type": EVENT_TYPES[5],
+            "common_type": EVENT_TYPES[0],
+        }
+        before = run(conn, args, opts.repeat)
+        migrations.migrate(conn)
+        conn.execute("ANALYZE")
+        after = run(conn, args, opts.repeat, migrated=True)
+        conn.close()
+
+    for (name, plan_before, ms_before), (_, plan_after, ms_after) in zip(before, after):
+        print(f"\n## {name}: {ms_before:.2f} ms -> {ms_after:.2f} ms")
+        print("  before: " + " | ".join(plan_before))
+        print("  after:  " + " | ".join(plan_after))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,10 +6,10 @@ import sqlite3
 import uuid
 import hashlib
 import logging
-from logging.handlers import RotatingFileHandler
+import threading
 import time
 from pathlib import Path
-from typing import AsyncIterator, Literal
+from typing import AsyncIterator, Callable, Literal, TypeVar
 
 import asyncio
 from fastapi import FastAPI, HTTPException, Query, Request
@@ -19,19 +19,61 @@ from pydantic import BaseModel, Field
 from contextlib import asynccontextmanager
 
 from .model_gateway import build_prompt as model_build_prompt
+from .model_gateway import check_health as model_check_health
+from .model_gateway import configure_slots as model_configure_slots
+from .model_gateway import endpoint_metrics, parse_model_urls
+from .model_gateway import fit_context as model_fit_context
+from .model_gateway import generation_params as model_generation_params
+from .model_gateway import sampling_is_deterministic as model_sampling_is_deterministic
+from .model_gateway import GenerationInfo, GenerationInterrupted, OutputFilter, RepetitionDetector
+from .model_gateway import embed as model_embed
+from .model_gateway import filter_output as model_filter_output
+from .model_gateway import embedding_metrics, embedding_model_tag, set_embedding_store
 from .model_gateway import generate as model_generate
+from .model_gateway import get_model_client, slot_metrics, start_model_client, stop_model_client
+from .model_gateway import invalidate_prompt_cache, prompt_cache_metrics
+from .model_gateway import record_repetition_stop, repetition_metrics
+from .model_gateway import verify_base_system_prompt
+from .model_gateway import summarize as model_summarize
+from . import completion_cache, db, migrations, search
+from .embedding_cache import EmbeddingStore
+from .history_cache import HistoryCache, HistoryMessage, load_history
+from .preference_cache import PreferenceSnapshots
 from .response_policy import evaluate_clarifying_question
-from .tools import build_tool_context, get_tool_definitions, run_tool
+from .scheduler import GenerationScheduler, QueueTimeout
+from .semantic_cache import SemanticCache
+from .token_stream import DisconnectWatcher, FlushPolicy, StreamStats, coalesce_tokens
+from .vector_index import VectorIndex
 
 REPO_ROOT = Path(__file__).resolve().parents[2]
 DATA_DIR = Path(os.getenv("MYGPT_DATA_DIR", str(REPO_ROOT / "data")))
 DB_PATH = Path(os.getenv("MYGPT_DB_PATH", str(DATA_DIR / "chat.db")))
-SCHEMA_PATH = Path(__file__).resolve().parent / "schema.sql"
+
+T = TypeVar("T")
+
+
 @asynccontextmanager
 async def lifespan(_: FastAPI):
+    # Only what must hold before serving: logging and the prompt hash check.
+    # Schema migrations warm up in the background; requests that need the
+    # database wait for them on first use.
+    _setup_logging()
+    verify_base_system_prompt()
+    db_warmup = asyncio.create_task(asyncio.to_thread(_ensure_db))
     _log_startup_marker("backend_startup")
     logger.info("backend_startup timestamp logged")
-    yield
+    parallel = _llama_parallel(_load_model_options())
+    model_configure_slots(parallel)
+    generation_scheduler.configure(_generation_concurrency(parallel))
+    await start_model_client(_get_model_url())
+    try:
+        yield
+    finally:
+        await stop_model_client()
+        await asyncio.gather(db_warmup, return_exceptions=True)
+        # Let queued writes finish before the pooled connections close.
+        await asyncio.to_thread(db.shutdown_executors)
+        db.close_pools()
 
 
 app = FastAPI(title="Logical Low-Friction AI Chat Backend", lifespan=lifespan)
@@ -43,6 +85,8 @@ def _log_dir() -> Path:
 
 
 def _setup_logging() -> None:
+    from logging.handlers import RotatingFileHandler
+
     log_dir = _log_dir()
     log_dir.mkdir(parents=True, exist_ok=True)
     level_name = os.getenv("MYGPT_LOG_LEVEL", "INFO").upper()
@@ -73,8 +117,6 @@ def _setup_logging() -> None:
         logger.addHandler(err_handler)
 
 
-_setup_logging()
-
 cors_origins = [
     origin.strip()
     for origin in os.getenv("MYGPT_CORS_ORIGINS", "http://localhost:1420").split(",")
@@ -110,10 +152,62 @@ async def log_requests(request: Request, call_next):
 
 
 def _connect() -> sqlite3.Connection:
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    # Pooled: close() returns the connection (rolling back anything uncommitted).
+    _ensure_db()
+    return db.pool_for(DB_PATH).acquire()
+
+
+def _connect_read() -> sqlite3.Connection:
+    """Read-only pooled connection for GET endpoints (``query_only``)."""
+    _ensure_db()
+    return db.pool_for(DB_PATH, readonly=True).acquire()
+
+
+async def _db_write(fn: Callable[[sqlite3.Connection], T]) -> T:
+    """Run ``fn(conn)`` on the database writer thread."""
+
+    def _run() -> T:
+        conn = _connect()
+        try:
+            return fn(conn)
+        finally:
+            conn.close()
+
+    return await db.run_write(_run)
+
+
+async def _db_read(fn: Callable[[sqlite3.Connection], T]) -> T:
+    """Run ``fn(conn)`` on a database reader thread with a read-only connection."""
+
+    def _run() -> T:
+        conn = _connect_read()
+        try:
+            return fn(conn)
+        finally:
+            conn.close()
+
+    return await db.run_read(_run)
+
+
+# Message and event inserts go through one group-commit writer so that
+# concurrent turns share a transaction (and an fsync) instead of one each.
+db_writer = db.GroupCommitWriter(
+    _connect,
+    window_s=float(os.getenv("MYGPT_DB_GROUP_COMMIT_MS", "0")) / 1000.0,
+    max_batch=int(os.getenv("MYGPT_DB_GROUP_COMMIT_MAX_OPS", "64")),
+)
+
+
+async def _db_commit(fn: Callable[[sqlite3.Connection], T]) -> T:
+    """Run ``fn(conn)`` in the next group commit; returns once it is committed.
+
+    ``fn`` must not call ``conn.commit()``. An exception raised by ``fn``
+    rolls back only its own writes and is re-raised here.
+    """
+    return await db_writer.submit(fn)
+
+
+set_embedding_store(EmbeddingStore(_connect, _connect_read))
 
 
 def _llm_logging_enabled() -> bool:
@@ -137,13 +231,28 @@ def _log_startup_marker(event: str) -> None:
 CURRENT_MODEL_URL = os.getenv("MYGPT_MODEL_URL", "http://127.0.0.1:8080")
 
 
+CURRENT_MODEL_KEY = os.getenv("MYGPT_MODEL_KEY", "").strip()
+
+
 def _get_model_url() -> str:
     return CURRENT_MODEL_URL
 
 
-def _set_model_url(value: str) -> None:
+def _model_identity() -> str:
+    return f"{CURRENT_MODEL_KEY or 'default'}@{CURRENT_MODEL_URL}"
+
+
+async def _set_model_url(value: str) -> None:
     global CURRENT_MODEL_URL
     CURRENT_MODEL_URL = value.strip()
+    client = get_model_client()
+    if client is not None:
+        await client.retarget(CURRENT_MODEL_URL)
+
+
+def _set_model_key(value: str) -> None:
+    global CURRENT_MODEL_KEY
+    CURRENT_MODEL_KEY = value.strip()
 
 
 MODEL_SWITCH_CONFIG = REPO_ROOT / "model-switch" / "models.json"
@@ -158,6 +267,25 @@ def _load_model_options() -> dict:
         return {"models": [], "model_url": _get_model_url()}
 
 
+def _llama_parallel(options: dict) -> int:
+    value = os.getenv("MYGPT_LLAMA_PARALLEL", "").strip() or options.get("parallel") or 2
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return 2
+
+
+def _generation_concurrency(parallel: int) -> int:
+    value = os.getenv("MYGPT_GEN_CONCURRENCY", "").strip()
+    return int(value) if value else max(1, parallel)
+
+
+generation_scheduler = GenerationScheduler(
+    max_concurrent=_generation_concurrency(_llama_parallel({})),
+    queue_timeout_s=float(os.getenv("MYGPT_GEN_QUEUE_TIMEOUT_S", "120")),
+)
+
+
 def _read_tail(path: Path, limit: int) -> list[str]:
     if not path.exists():
         return []
@@ -179,76 +307,213 @@ def _write_text(path: Path, text: str) -> None:
     path.write_text(text, encoding="utf-8")
 
 
-def _strip_ansi(text: str) -> str:
-    import re
+def _completion_cache_key(
+    prompt_sha256: str, *, opted_in: bool, regenerate: bool
+) -> tuple[str, dict] | None:
+    """Cache key for a completion, or None when the cache must be bypassed.
 
-    return re.sub(r"\x1b\[[0-9;]*[A-Za-z]", "", text)
+    Regenerate asks for a different answer and stochastic sampling would
+    replay one arbitrary sample, so both bypass the cache unless the caller
+    opts in explicitly.
+    """
 
+    if os.getenv("MYGPT_COMPLETION_CACHE", "1").strip() == "0":
+        return None
+    params = model_generation_params()
+    if not opted_in and (regenerate or not model_sampling_is_deterministic(params)):
+        return None
+    return completion_cache.cache_key(prompt_sha256, _model_identity(), params), params
 
-def _strip_think_blocks(text: str) -> str:
-    wrappers = [
-        ("<think>", "</think>"),
-        ("〈thinking〉", "〈/thinking〉"),
-        ("＜thinking＞", "＜/thinking＞"),
-    ]
 
-    for _, close in wrappers:
-        idx = text.rfind(close)
-        if idx != -1:
-            return text[idx + len(close) :]
+async def _completion_cache_get(key: str) -> str | None:
+    def _lookup(conn: sqlite3.Connection) -> str | None:
+        response = completion_cache.lookup(conn, key)
+        conn.commit()
+        return response
 
-    cleaned = text
-    for open_tag, _ in wrappers:
-        cleaned = cleaned.replace(open_tag, "")
-    return cleaned
+    return await _db_write(_lookup)
 
 
-def _truncate_at_role_markers(text: str) -> str:
-    import re
+async def _completion_cache_put(key: str, params: dict, prompt_sha256: str, response: str) -> None:
+    def _store(conn: sqlite3.Connection) -> None:
+        completion_cache.store(
+            conn,
+            key=key,
+            prompt_sha256=prompt_sha256,
+            model=_model_identity(),
+            params=params,
+            response=response,
+            max_entries=int(os.getenv("MYGPT_COMPLETION_CACHE_MAX_ENTRIES", "2000")),
+            max_bytes=int(os.getenv("MYGPT_COMPLETION_CACHE_MAX_BYTES", "20000000")),
+        )
+        conn.commit()
 
-    cleaned = text.strip()
-    cleaned = re.sub(r"^\s*Assistant:\s*", "", cleaned)
-    match = re.search(r"(?m)^(User:|System:|Assistant:)\s*", cleaned)
-    if match and match.start() > 0:
-        return cleaned[: match.start()].rstrip()
-    return cleaned
+    await _db_write(_store)
 
 
-def init_db() -> None:
-    conn = _connect()
-    conn.executescript(SCHEMA_PATH.read_text(encoding="utf-8"))
+semantic_cache = SemanticCache(
+    max_entries=int(os.getenv("MYGPT_SEMANTIC_CACHE_MAX_ENTRIES", "512")),
+    threshold=float(os.getenv("MYGPT_SEMANTIC_CACHE_THRESHOLD", "0.92")),
+)
+history_cache = HistoryCache(int(os.getenv("MYGPT_HISTORY_CACHE_CONVERSATIONS", "64")))
+stream_stats = StreamStats()
 
-    row = conn.execute("SELECT id FROM conversations ORDER BY id LIMIT 1").fetchone()
-    if row is None:
-        cursor = conn.execute(
-            "INSERT INTO conversations (title) VALUES (?)", ("Legacy",)
-        )
-        conversation_id = int(cursor.lastrowid)
-        conn.execute(
-            """
-            INSERT OR IGNORE INTO conversation_messages (conversation_id, message_id)
-            SELECT ?, id FROM messages
-            """,
-            (conversation_id,),
-        )
-    else:
-        conversation_id = int(row["id"])
-        conn.execute(
-            """
-            INSERT OR IGNORE INTO conversation_messages (conversation_id, message_id)
-            SELECT ?, m.id
-            FROM messages m
-            LEFT JOIN conversation_messages cm ON cm.message_id = m.id
-            WHERE cm.message_id IS NULL
-            """,
-            (conversation_id,),
+
+def _flush_policy(flush_ms: float | None, flush_bytes: int | None) -> FlushPolicy:
+    """Per-request SSE framing, falling back to the server defaults."""
+    if flush_ms is None:
+        flush_ms = float(os.getenv("MYGPT_SSE_FLUSH_MS", "16"))
+    if flush_bytes is None:
+        flush_bytes = int(os.getenv("MYGPT_SSE_FLUSH_BYTES", "1024"))
+    return FlushPolicy(window_ms=flush_ms, max_bytes=flush_bytes)
+
+
+_SEMANTIC_EMBED_RETRY_AT = 0.0
+
+
+def _semantic_cache_applies(history: list[dict]) -> bool:
+    """Semantic answers are only safe for standalone questions.
+
+    A follow-up ("why?") means different things in different conversations,
+    so by default only the first turn of a conversation is looked up/stored.
+    """
+
+    if os.getenv("MYGPT_SEMANTIC_CACHE", "0").strip() != "1":
+        return False
+    if os.getenv("MYGPT_SEMANTIC_CACHE_FIRST_TURN_ONLY", "1").strip() == "0":
+        return True
+    return len(history) <= 1
+
+
+async def _semantic_embed(text: str) -> list[float] | None:
+    global _SEMANTIC_EMBED_RETRY_AT
+    if time.monotonic() < _SEMANTIC_EMBED_RETRY_AT:
+        return None
+    try:
+        vectors = await model_embed([text], _get_model_url(), model=_model_identity())
+        return vectors[0]
+    except Exception as exc:
+        # Usually llama-server running without --embeddings; back off.
+        _SEMANTIC_EMBED_RETRY_AT = time.monotonic() + 60.0
+        logger.warning("semantic_cache_embed_failed error=%s", exc)
+        return None
+
+
+_VECTOR_INDEX: VectorIndex | None = None
+_VECTOR_INDEX_TASK: asyncio.Task | None = None
+
+
+def _vector_index_enabled() -> bool:
+    return os.getenv("MYGPT_VECTOR_INDEX", "0").strip() == "1"
+
+
+async def _vector_index() -> VectorIndex:
+    global _VECTOR_INDEX
+    if _VECTOR_INDEX is None:
+        base = os.getenv("MYGPT_VECTOR_INDEX_PATH", "").strip()
+        path = Path(base) if base else DB_PATH.with_name(f"{DB_PATH.stem}.vectors")
+        # Opening reads the sidecar files (and IVF centroids); not on the loop.
+        index = await asyncio.to_thread(VectorIndex, path)
+        if _VECTOR_INDEX is None:
+            _VECTOR_INDEX = index
+    return _VECTOR_INDEX
+
+
+def _schedule_vector_index() -> asyncio.Task | None:
+    """Embed and append messages the index has not seen yet.
+
+    One catch-up task at a time; it keeps reading until no newer messages
+    remain, so inserts made while it runs are picked up too.
+    """
+
+    global _VECTOR_INDEX_TASK
+    if not _vector_index_enabled():
+        return None
+    if _VECTOR_INDEX_TASK is None or _VECTOR_INDEX_TASK.done():
+        _VECTOR_INDEX_TASK = asyncio.create_task(_vector_index_catch_up())
+    return _VECTOR_INDEX_TASK
+
+
+async def _vector_index_catch_up() -> None:
+    index = await _vector_index()
+    model_url = _get_model_url()
+    tag = embedding_model_tag(model_url, _model_identity())
+    batch = int(os.getenv("MYGPT_VECTOR_INDEX_BATCH", "64"))
+    max_chars = int(os.getenv("MYGPT_VECTOR_INDEX_MAX_CHARS", "2000"))
+    after = index.last_message_id if index.model == tag else 0
+    try:
+        while True:
+            rows = await _db_read(
+                lambda conn: conn.execute(
+                    """
+                    SELECT m.id, m.content, cm.conversation_id
+                    FROM messages m
+                    LEFT JOIN conversation_messages cm ON cm.message_id = m.id
+                    WHERE m.id > ?
+                    ORDER BY m.id
+                    LIMIT ?
+                    """,
+                    (after, batch),
+                ).fetchall()
+            )
+            if not rows:
+                break
+            vectors = await model_embed(
+                [r["content"][:max_chars] for r in rows], model_url, model=_model_identity()
+            )
+            await asyncio.to_thread(
+                index.append,
+                [r["id"] for r in rows],
+                [r["conversation_id"] for r in rows],
+                vectors,
+                tag,
+            )
+            after = int(rows[-1]["id"])
+
+        ivf_min_rows = int(os.getenv("MYGPT_VECTOR_IVF_MIN_ROWS", "0"))
+        if ivf_min_rows and index.count >= ivf_min_rows and index.metrics()["mode"] == "flat":
+            cells = await asyncio.to_thread(index.build_ivf)
+            logger.info("vector_index_ivf_built rows=%s cells=%s", index.count, cells)
+    except Exception as exc:
+        logger.warning(
+            "vector_index_catch_up_failed after_message_id=%s error=%s", after, exc
         )
 
-    conn.commit()
-    conn.close()
 
+def init_db() -> None:
+    """Bring the database to the latest schema version.
+
+    A warm start costs one ``PRAGMA user_version`` read; migrations, and the
+    one-time backfills they carry, only run when the version is behind.
+    """
+    conn = db.pool_for(DB_PATH).acquire()
+    try:
+        if migrations.current_version(conn) == migrations.LATEST_VERSION:
+            return
+        existing = {
+            r["name"] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        }
+        migrations.migrate(conn)
+        search.rebuild_missing_indexes(conn, {"messages_fts", "events_fts"} - existing)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+_DB_READY = False
+_DB_INIT_LOCK = threading.Lock()
 
-init_db()
+
+def _ensure_db() -> None:
+    # Nothing touches the database at import; the first connection (or the
+    # warm-up started by lifespan) runs init_db() exactly once.
+    global _DB_READY
+    if _DB_READY:
+        return
+    with _DB_INIT_LOCK:
+        if not _DB_READY:
+            init_db()
+            _DB_READY = True
 
 
 class ConversationCreate(BaseModel):
@@ -265,11 +530,19 @@ class MessageCreate(BaseModel):
 class ChatRequest(BaseModel):
     content: str = Field(min_length=1)
     conversation_id: int | None = None
+    use_cache: bool = False
+    # SSE framing: coalesce tokens into at most one frame per flush_ms
+    # (0 = one frame per token), or sooner once flush_bytes are buffered.
+    flush_ms: float | None = Field(default=None, ge=0, le=1000)
+    flush_bytes: int | None = Field(default=None, ge=0)
 
 
 class RegenerateRequest(BaseModel):
     target_message_id: int
     conversation_id: int | None = None
+    use_cache: bool = False
+    flush_ms: float | None = Field(default=None, ge=0, le=1000)
+    flush_bytes: int | None = Field(default=None, ge=0)
 
 
 class ToolRunRequest(BaseModel):
@@ -340,6 +613,10 @@ def _load_active_preferences(
     return prefs
 
 
+# Reloaded only when a preference or reset is appended (by any process).
+preference_snapshots = PreferenceSnapshots(_load_active_preferences)
+
+
 def _infer_preference_proposal(
     history: list[dict], approved_preferences: dict[str, str]
 ) -> dict[str, str] | None:
@@ -405,6 +682,131 @@ def _get_pending_proposal(
     return dict(row) if row else None
 
 
+def _summaries_enabled() -> bool:
+    return os.getenv("MYGPT_SUMMARIZE", "0").strip() == "1"
+
+
+def _latest_summary(conn: sqlite3.Connection, conversation_id: int) -> dict | None:
+    if not _summaries_enabled():
+        return None
+    row = conn.execute(
+        """
+        SELECT id, covers_through_message_id, covered_count, content
+        FROM conversation_summaries
+        WHERE conversation_id = ?
+        ORDER BY id DESC
+        LIMIT 1
+        """,
+        (conversation_id,),
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def _unsummarized(history: list[dict], summary: dict | None) -> list[dict]:
+    if summary is None:
+        return history
+    through = int(summary["covers_through_message_id"])
+    return [m for m in history if int(m["id"]) > through]
+
+
+_SUMMARY_TASKS: dict[int, asyncio.Task] = {}
+
+
+def _schedule_summary_refresh(
+    conversation_id: int, history: list[dict], summary: dict | None
+) -> None:
+    """Summarize turns that fell out of the recent window, once per step.
+
+    Runs after the answer has streamed so TTFT is unaffected; the next turn
+    picks up whatever summary is stored by then.
+    """
+
+    if not _summaries_enabled() or conversation_id in _SUMMARY_TASKS:
+        return
+    keep = int(os.getenv("MYGPT_SUMMARY_KEEP_MESSAGES", "24"))
+    step = int(os.getenv("MYGPT_SUMMARY_STEP", "16"))
+    pending = _unsummarized(history, summary)
+    pending = pending[: max(0, len(pending) - keep)]
+    if len(pending) < step:
+        return
+    task = asyncio.create_task(_refresh_summary(conversation_id, pending, summary))
+    _SUMMARY_TASKS[conversation_id] = task
+    task.add_done_callback(lambda _: _SUMMARY_TASKS.pop(conversation_id, None))
+
+
+async def _refresh_summary(
+    conversation_id: int, pending: list[dict], summary: dict | None
+) -> None:
+    max_batch = max(1, int(os.getenv("MYGPT_SUMMARY_MAX_BATCH", "32")))
+    previous = summary
+    for start in range(0, len(pending), max_batch):
+        batch = pending[start : start + max_batch]
+        ticket = generation_scheduler.submit(conversation_id, priority="batch")
+        try:
+            async for _ in ticket.positions():
+                pass
+            content = await model_summarize(
+                batch,
+                previous_summary=previous["content"] if previous else None,
+                model_url=_get_model_url(),
+            )
+        except Exception as exc:
+            logger.warning(
+                "conversation_summary_failed conversation_id=%s error=%s", conversation_id, exc
+            )
+            return
+        finally:
+            ticket.release()
+
+        covers_through = int(batch[-1]["id"])
+        covered_count = (int(previous["covered_count"]) if previous else 0) + len(batch)
+
+        def _save_summary(conn: sqlite3.Connection) -> int:
+            cursor = conn.execute(
+                """
+                INSERT INTO conversation_summaries (
+                  conversation_id, covers_through_message_id, covered_count,
+                  content, previous_summary_id
+                )
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (
+                    conversation_id,
+                    covers_through,
+                    covered_count,
+                    content,
+                    previous["id"] if previous else None,
+                ),
+            )
+            summary_id = int(cursor.lastrowid)
+            _insert_event(
+                conn,
+                event_type="conversation_summary",
+                payload={
+                    "summary_id": summary_id,
+                    "covers_through_message_id": covers_through,
+                    "covered_count": covered_count,
+                },
+                conversation_id=conversation_id,
+                causality_message_id=covers_through,
+            )
+            return summary_id
+
+        summary_id = await _db_commit(_save_summary)
+        logger.info(
+            "conversation_summary_saved conversation_id=%s summary_id=%s covered_count=%s",
+            conversation_id,
+            summary_id,
+            covered_count,
+        )
+        previous = {
+            "id": summary_id,
+            "covers_through_message_id": covers_through,
+            "covered_count": covered_count,
+            "content": content,
+        }
+
+
 def _insert_event(
     conn: sqlite3.Connection,
     *,
@@ -428,6 +830,28 @@ def _insert_event(
     return int(cursor.lastrowid)
 
 
+async def _log_event(
+    *,
+    event_type: str,
+    payload: dict,
+    conversation_id: int | None = None,
+    causality_message_id: int | None = None,
+) -> int:
+    """Insert a single event through the group-commit writer."""
+
+    def _write(conn: sqlite3.Connection) -> int:
+        event_id = _insert_event(
+            conn,
+            event_type=event_type,
+            payload=payload,
+            conversation_id=conversation_id,
+            causality_message_id=causality_message_id,
+        )
+        return event_id
+
+    return await _db_commit(_write)
+
+
 @app.get("/health")
 async def health() -> dict[str, str]:
     return {"status": "ok"}
@@ -443,19 +867,13 @@ async def set_model(body: ModelConfigRequest) -> dict[str, str]:
     model_url = body.model_url.strip()
     if not model_url:
         raise HTTPException(status_code=400, detail="model_url is required")
-    _set_model_url(model_url)
-    conn = _connect()
-    try:
-        _insert_event(
-            conn,
-            event_type="model_switch",
-            payload={"model_url": model_url},
-            conversation_id=None,
-            causality_message_id=None,
-        )
-        conn.commit()
-    finally:
-        conn.close()
+    await _set_model_url(model_url)
+    await _log_event(
+        event_type="model_switch",
+        payload={"model_url": model_url},
+        conversation_id=None,
+        causality_message_id=None,
+    )
     return {"model_url": _get_model_url()}
 
 
@@ -488,7 +906,7 @@ async def switch_model(body: ModelSwitchRequest) -> dict:
     env.setdefault("LLAMA_PORT", os.getenv("MYGPT_LLAMA_PORT", "8081"))
     env.setdefault("LLAMA_CTX_SIZE", os.getenv("MYGPT_LLAMA_CTX_SIZE", "4096"))
     env.setdefault("LLAMA_THREADS", os.getenv("MYGPT_LLAMA_THREADS", "8"))
-    env.setdefault("LLAMA_PARALLEL", os.getenv("MYGPT_LLAMA_PARALLEL", "2"))
+    env.setdefault("LLAMA_PARALLEL", str(_llama_parallel(options)))
     env.setdefault("LLAMA_CONT_BATCHING", os.getenv("MYGPT_LLAMA_CONT_BATCHING", "1"))
     env.setdefault("LLAMA_MAX_WAIT_SECONDS", os.getenv("MYGPT_LLAMA_MAX_WAIT_SECONDS", "120"))
 
@@ -507,24 +925,21 @@ async def switch_model(body: ModelSwitchRequest) -> dict:
         "success": res["success"],
     }
 
-    conn = _connect()
-    try:
-        _insert_event(
-            conn,
-            event_type="model_switch",
-            payload=payload,
-            conversation_id=None,
-            causality_message_id=None,
-        )
-        conn.commit()
-    finally:
-        conn.close()
+    await _log_event(
+        event_type="model_switch",
+        payload=payload,
+        conversation_id=None,
+        causality_message_id=None,
+    )
 
     if error:
         raise HTTPException(status_code=500, detail=error)
 
-    model_url = options.get("model_url") or _get_model_url()
-    _set_model_url(model_url)
+    model_url = ",".join(parse_model_urls(options.get("model_url"))) or _get_model_url()
+    await _set_model_url(model_url)
+    _set_model_key(body.model_key)
+    model_configure_slots(_llama_parallel(options))
+    generation_scheduler.configure(_generation_concurrency(_llama_parallel(options)))
     return {"model_url": _get_model_url(), "model_key": body.model_key}
 
 
@@ -532,15 +947,36 @@ async def switch_model(body: ModelSwitchRequest) -> dict:
 async def service_status() -> dict:
     llama_url = _get_model_url().rstrip("/")
     status = {"backend": "ok", "llama": {"url": llama_url, "running": False}}
-    try:
-        async with httpx.AsyncClient(timeout=2.0) as client:
-            resp = await client.get(f"{llama_url}/health")
-            status["llama"]["running"] = resp.status_code == 200
-    except Exception:
-        status["llama"]["running"] = False
+    endpoints = {}
+    for url in parse_model_urls(llama_url):
+        endpoints[url] = await model_check_health(url)
+    status["llama"]["running"] = any(endpoints.values())
+    if len(endpoints) > 1:
+        status["llama"]["endpoints"] = endpoints
     return status
 
 
+@app.get("/metrics")
+async def get_metrics() -> dict:
+    client = get_model_client()
+    return {
+        "model_client": client.metrics() if client is not None else None,
+        "slots": slot_metrics(),
+        "endpoints": endpoint_metrics(_get_model_url()),
+        "prompt_cache": prompt_cache_metrics(),
+        "scheduler": generation_scheduler.metrics(),
+        "semantic_cache": semantic_cache.metrics(),
+        "embeddings": embedding_metrics(),
+        "vector_index": (await _vector_index()).metrics() if _vector_index_enabled() else None,
+        "db_pools": db.pool_metrics(),
+        "db_writer": db_writer.metrics(),
+        "history_cache": history_cache.metrics(),
+        "preferences": preference_snapshots.metrics(),
+        "sse": stream_stats.metrics(),
+        "repetition_stops": repetition_metrics(),
+    }
+
+
 @app.get("/logs")
 async def get_logs(
     limit: int = Query(default=200),
@@ -572,10 +1008,14 @@ async def list_events(
     limit: int = Query(default=200),
     event_type: str | None = Query(default=None),
     conversation_id: int | None = Query(default=None),
+    before_id: int | None = Query(default=None),
+    after_id: int | None = Query(default=None),
 ) -> dict:
+    """Newest first; ``next_cursor`` continues in the direction of the cursor
+    given (``before_id`` by default)."""
     safe_limit = max(1, min(limit, 2000))
-    conn = _connect()
-    try:
+
+    def _query(conn: sqlite3.Connection) -> dict:
         params = []
         clauses = []
         if event_type:
@@ -584,20 +1024,26 @@ async def list_events(
         if conversation_id is not None:
             clauses.append("conversation_id = ?")
             params.append(conversation_id)
+        id_clauses, id_params, ascending = _keyset("id", before_id, after_id)
+        clauses.extend(id_clauses)
+        params.extend(id_params)
         where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
         rows = conn.execute(
             f"""
             SELECT id, type, payload_json, created_at, conversation_id, causality_message_id
             FROM events
             {where}
-            ORDER BY id DESC
+            ORDER BY id {"ASC" if ascending else "DESC"}
             LIMIT ?
             """,
-            (*params, safe_limit),
+            (*params, safe_limit + 1),
         ).fetchall()
-        return {"events": [dict(r) for r in rows]}
-    finally:
-        conn.close()
+        events, next_cursor = _keyset_page(rows, safe_limit)
+        if ascending:
+            events.reverse()
+        return {"events": events, "next_cursor": next_cursor}
+
+    return await _db_read(_query)
 
 
 
@@ -647,7 +1093,7 @@ async def start_llama(body: ServiceActionRequest) -> dict:
     env.setdefault("LLAMA_PORT", os.getenv("MYGPT_LLAMA_PORT", "8081"))
     env.setdefault("LLAMA_CTX_SIZE", os.getenv("MYGPT_LLAMA_CTX_SIZE", "4096"))
     env.setdefault("LLAMA_THREADS", os.getenv("MYGPT_LLAMA_THREADS", "8"))
-    env.setdefault("LLAMA_PARALLEL", os.getenv("MYGPT_LLAMA_PARALLEL", "2"))
+    env.setdefault("LLAMA_PARALLEL", str(_llama_parallel(options)))
     env.setdefault("LLAMA_CONT_BATCHING", os.getenv("MYGPT_LLAMA_CONT_BATCHING", "1"))
     env.setdefault("LLAMA_MAX_WAIT_SECONDS", os.getenv("MYGPT_LLAMA_MAX_WAIT_SECONDS", "120"))
 
@@ -666,23 +1112,20 @@ async def start_llama(body: ServiceActionRequest) -> dict:
         "stderr": res["stderr"],
         "success": res["success"],
     }
-    conn = _connect()
-    try:
-        _insert_event(
-            conn,
-            event_type="service_start",
-            payload=payload,
-            conversation_id=None,
-            causality_message_id=None,
-        )
-        conn.commit()
-    finally:
-        conn.close()
+    await _log_event(
+        event_type="service_start",
+        payload=payload,
+        conversation_id=None,
+        causality_message_id=None,
+    )
 
     if error:
         raise HTTPException(status_code=500, detail=error)
-    model_url = options.get("model_url") or _get_model_url()
-    _set_model_url(model_url)
+    model_url = ",".join(parse_model_urls(options.get("model_url"))) or _get_model_url()
+    await _set_model_url(model_url)
+    _set_model_key(model_key)
+    model_configure_slots(_llama_parallel(options))
+    generation_scheduler.configure(_generation_concurrency(_llama_parallel(options)))
     return {"status": "started", "model_url": _get_model_url(), "model_key": model_key}
 
 
@@ -706,18 +1149,12 @@ async def stop_llama(body: ServiceActionRequest) -> dict:
         "stderr": res["stderr"],
         "success": res["success"],
     }
-    conn = _connect()
-    try:
-        _insert_event(
-            conn,
-            event_type="service_stop",
-            payload=payload,
-            conversation_id=None,
-            causality_message_id=None,
-        )
-        conn.commit()
-    finally:
-        conn.close()
+    await _log_event(
+        event_type="service_stop",
+        payload=payload,
+        conversation_id=None,
+        causality_message_id=None,
+    )
 
     if error:
         raise HTTPException(status_code=500, detail=error)
@@ -726,6 +1163,9 @@ async def stop_llama(body: ServiceActionRequest) -> dict:
 
 @app.get("/tools")
 async def list_tools() -> dict[str, list[dict]]:
+    # Tools are rarely used; keep the registry out of the startup path.
+    from .tools import get_tool_definitions
+
     tools = []
     for tool in get_tool_definitions():
         tools.append(
@@ -746,49 +1186,49 @@ async def run_tool_endpoint(req: ToolRunRequest) -> dict:
     if req.causality_message_id is None:
         raise HTTPException(status_code=400, detail="causality_message_id is required")
 
-    conn = _connect()
-    try:
-        conversation_id = req.conversation_id
-        if conversation_id is None:
-            conversation_id = _get_conversation_id_for_message(
-                conn, req.causality_message_id
-            )
+    def _resolve(conn: sqlite3.Connection) -> int | None:
+        _ensure_message(conn, req.causality_message_id)
+        if req.conversation_id is not None:
+            _ensure_conversation(conn, req.conversation_id)
+            return req.conversation_id
+        return _get_conversation_id_for_message(conn, req.causality_message_id)
 
-        ctx = build_tool_context(REPO_ROOT, DB_PATH)
-        started_at = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime())
-        start = time.time()
-        success = True
-        output: dict | None = None
-        error: str | None = None
-        try:
-            output = await run_tool(req.tool_id, req.tool_input, ctx, confirmed=req.confirmed)
-        except Exception as exc:
-            success = False
-            error = str(exc)
+    # Validated before the tool runs, so its tool_run event can always be written.
+    conversation_id = await _db_read(_resolve)
 
-        duration = time.time() - start
-        ended_at = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime())
-        payload = {
-            "tool_id": req.tool_id,
-            "input": req.tool_input,
-            "output": output,
-            "error": error,
-            "confirmed": req.confirmed,
-            "started_at": started_at,
-            "ended_at": ended_at,
-            "duration_sec": round(duration, 4),
-            "success": success,
-        }
-        _insert_event(
-            conn,
-            event_type="tool_run",
-            payload=payload,
-            conversation_id=conversation_id,
-            causality_message_id=req.causality_message_id,
-        )
-        conn.commit()
-    finally:
-        conn.close()
+    from .tools import build_tool_context, run_tool
+
+    ctx = build_tool_context(REPO_ROOT, DB_PATH)
+    started_at = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime())
+    start = time.time()
+    success = True
+    output: dict | None = None
+    error: str | None = None
+    try:
+        output = await run_tool(req.tool_id, req.tool_input, ctx, confirmed=req.confirmed)
+    except Exception as exc:
+        success = False
+        error = str(exc)
+
+    duration = time.time() - start
+    ended_at = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime())
+    payload = {
+        "tool_id": req.tool_id,
+        "input": req.tool_input,
+        "output": output,
+        "error": error,
+        "confirmed": req.confirmed,
+        "started_at": started_at,
+        "ended_at": ended_at,
+        "duration_sec": round(duration, 4),
+        "success": success,
+    }
+    await _log_event(
+        event_type="tool_run",
+        payload=payload,
+        conversation_id=conversation_id,
+        causality_message_id=req.causality_message_id,
+    )
 
     return {"success": success, "output": output, "error": error}
 
@@ -831,69 +1271,176 @@ def _ensure_conversation(conn: sqlite3.Connection, conversation_id: int) -> None
         raise HTTPException(status_code=404, detail="Conversation not found")
 
 
+def _ensure_message(conn: sqlite3.Connection, message_id: int) -> None:
+    row = conn.execute("SELECT 1 FROM messages WHERE id = ?", (message_id,)).fetchone()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+
+
+def _keyset(
+    column: str, before_id: int | None, after_id: int | None, cursor_key: str = "?"
+) -> tuple[list[str], list[int], bool]:
+    """Keyset bounds on ``column``; the page walks forward (ascending) from
+    ``after_id`` and backward (descending) otherwise.
+
+    ``cursor_key`` maps the id cursor to the sort key when that is not the
+    id itself (e.g. a row-value subquery for composite keys).
+    """
+    clauses: list[str] = []
+    params: list[int] = []
+    if before_id is not None:
+        clauses.append(f"{column} < {cursor_key}")
+        params.append(before_id)
+    if after_id is not None:
+        clauses.append(f"{column} > {cursor_key}")
+        params.append(after_id)
+    return clauses, params, after_id is not None
+
+
+def _keyset_page(rows: list[sqlite3.Row], limit: int) -> tuple[list[dict], int | None]:
+    """Trim a ``limit + 1`` fetch; ``next_cursor`` is the last id in walk order."""
+    page = [dict(r) for r in rows[:limit]]
+    next_cursor = page[-1]["id"] if len(rows) > limit else None
+    return page, next_cursor
+
+
 @app.get("/conversations")
-async def list_conversations() -> list[dict]:
-    conn = _connect()
-    rows = conn.execute(
-        """
-        SELECT
-          c.id,
-          c.title,
-          c.created_at,
-          COUNT(cm.message_id) AS message_count
-        FROM conversations c
-        LEFT JOIN conversation_messages cm ON cm.conversation_id = c.id
-        GROUP BY c.id
-        ORDER BY c.id DESC
-        """
-    ).fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+async def list_conversations(
+    before_id: int | None = Query(default=None),
+    after_id: int | None = Query(default=None),
+    limit: int | None = Query(default=None, ge=1, le=500),
+    sort: Literal["id", "activity"] = Query(default="id"),
+) -> list[dict] | dict:
+    """Newest first (``sort=activity``: most recent message first). With
+    ``before_id``/``after_id``/``limit`` the response is a page
+    ``{"conversations": [...], "next_cursor": id | None}``; without them,
+    the full list (as before). Cursors are conversation ids either way."""
+    paginated = before_id is not None or after_id is not None or limit is not None
+    page_size = limit or 50
+
+    def _query(conn: sqlite3.Connection) -> list[dict] | dict:
+        if sort == "activity":
+            # Walks idx_conversation_stats_activity; ties (empty conversations)
+            # break on id.
+            order_key = "s.last_message_id, s.conversation_id"
+            clauses, params, ascending = _keyset(
+                f"({order_key})",
+                before_id,
+                after_id,
+                "(SELECT last_message_id, conversation_id FROM conversation_stats WHERE conversation_id = ?)",
+            )
+            source = "conversation_stats s JOIN conversations c ON c.id = s.conversation_id"
+        else:
+            order_key = "c.id"
+            clauses, params, ascending = _keyset("c.id", before_id, after_id)
+            source = "conversations c JOIN conversation_stats s ON s.conversation_id = c.id"
+        direction = "ASC" if ascending else "DESC"
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = conn.execute(
+            f"""
+            SELECT
+              c.id,
+              c.title,
+              c.created_at,
+              s.message_count,
+              NULLIF(s.last_message_id, 0) AS last_message_id,
+              s.last_message_at,
+              s.last_role
+            FROM {source}
+            {where}
+            ORDER BY {", ".join(f"{col} {direction}" for col in order_key.split(", "))}
+            {"LIMIT ?" if paginated else ""}
+            """,
+            (*params, page_size + 1) if paginated else params,
+        ).fetchall()
+        if not paginated:
+            return [dict(r) for r in rows]
+        conversations, next_cursor = _keyset_page(rows, page_size)
+        if ascending:
+            conversations.reverse()
+        return {"conversations": conversations, "next_cursor": next_cursor}
+
+    return await _db_read(_query)
+
+
+@app.get("/conversations/{conversation_id}/summaries")
+async def list_conversation_summaries(conversation_id: int) -> dict:
+    def _query(conn: sqlite3.Connection) -> dict:
+        _ensure_conversation(conn, conversation_id)
+        rows = conn.execute(
+            """
+            SELECT id, covers_through_message_id, covered_count, content,
+                   previous_summary_id, created_at
+            FROM conversation_summaries
+            WHERE conversation_id = ?
+            ORDER BY id DESC
+            """,
+            (conversation_id,),
+        ).fetchall()
+        return {"summaries": [dict(r) for r in rows]}
+
+    return await _db_read(_query)
 
 
 @app.post("/conversations")
 async def create_conversation(body: ConversationCreate) -> dict[str, int]:
-    conn = _connect()
-    try:
+    def _write(conn: sqlite3.Connection) -> dict[str, int]:
         cursor = conn.execute(
             "INSERT INTO conversations (title) VALUES (?)", (body.title,)
         )
-        conn.commit()
         return {"id": int(cursor.lastrowid)}
-    finally:
-        conn.close()
+
+    return await _db_commit(_write)
 
 
 @app.get("/messages")
 async def list_messages(
     conversation_id: int | None = Query(default=None),
-) -> list[dict]:
-    conn = _connect()
-    try:
+    before_id: int | None = Query(default=None),
+    after_id: int | None = Query(default=None),
+    limit: int | None = Query(default=None, ge=1, le=500),
+) -> list[dict] | dict:
+    """Oldest first. With ``before_id``/``after_id``/``limit`` the response is
+    a page ``{"messages": [...], "next_cursor": id | None}``: ``limit`` alone
+    returns the most recent messages, ``before_id`` walks back through older
+    ones and ``after_id`` forward through newer ones; pass ``next_cursor``
+    back in the same parameter. Without them, the full history (as before)."""
+    paginated = before_id is not None or after_id is not None or limit is not None
+    page_size = limit or 100
+
+    def _query(conn: sqlite3.Connection) -> list[dict] | dict:
+        nonlocal conversation_id
         if conversation_id is None:
             conversation_id = _get_latest_conversation_id(conn)
         else:
             _ensure_conversation(conn, conversation_id)
 
+        clauses, params, ascending = _keyset("cm.message_id", before_id, after_id)
+        ascending = ascending or not paginated
         rows = conn.execute(
-            """
+            f"""
             SELECT m.id, m.content, m.role, m.timestamp, m.corrects_message_id
             FROM messages m
             JOIN conversation_messages cm ON cm.message_id = m.id
-            WHERE cm.conversation_id = ?
-            ORDER BY m.id
+            WHERE {" AND ".join(["cm.conversation_id = ?", *clauses])}
+            ORDER BY cm.message_id {"ASC" if ascending else "DESC"}
+            {"LIMIT ?" if paginated else ""}
             """,
-            (conversation_id,),
+            (conversation_id, *params, page_size + 1) if paginated else (conversation_id,),
         ).fetchall()
-        return [dict(r) for r in rows]
-    finally:
-        conn.close()
+        if not paginated:
+            return [dict(r) for r in rows]
+        messages, next_cursor = _keyset_page(rows, page_size)
+        if not ascending:
+            messages.reverse()
+        return {"messages": messages, "next_cursor": next_cursor}
+
+    return await _db_read(_query)
 
 
 @app.get("/preferences")
 async def list_preferences(scope: str = Query(default="global")) -> dict:
-    conn = _connect()
-    try:
+    def _query(conn: sqlite3.Connection) -> dict:
         reset_row = conn.execute(
             "SELECT id, created_at, reset_event_id FROM preference_resets WHERE scope = ? ORDER BY id DESC LIMIT 1",
             (scope,),
@@ -910,8 +1457,8 @@ async def list_preferences(scope: str = Query(default="global")) -> dict:
             (scope,),
         ).fetchall()
         return {"scope": scope, "reset": reset, "preferences": [dict(r) for r in rows]}
-    finally:
-        conn.close()
+
+    return await _db_read(_query)
 
 
 @app.post("/preferences/reset")
@@ -920,8 +1467,11 @@ async def reset_preferences(
     conversation_id: int | None = Query(default=None),
     causality_message_id: int | None = Query(default=None),
 ) -> dict:
-    conn = _connect()
-    try:
+    def _write(conn: sqlite3.Connection) -> dict:
+        if conversation_id is not None:
+            _ensure_conversation(conn, conversation_id)
+        if causality_message_id is not None:
+            _ensure_message(conn, causality_message_id)
         event_id = _insert_event(
             conn,
             event_type="preferences_reset",
@@ -933,10 +1483,13 @@ async def reset_preferences(
             "INSERT INTO preference_resets (scope, reset_event_id) VALUES (?, ?)",
             (scope, event_id),
         )
-        conn.commit()
         return {"reset_id": int(cursor.lastrowid), "event_id": event_id}
-    finally:
-        conn.close()
+
+    result = await _db_commit(_write)
+    preference_snapshots.invalidate()
+    invalidate_prompt_cache()
+    semantic_cache.clear()
+    return result
 
 
 @app.get("/preference-proposals")
@@ -944,8 +1497,8 @@ async def list_preference_proposals(
     conversation_id: int | None = Query(default=None),
     status: str = Query(default="pending"),
 ) -> dict:
-    conn = _connect()
-    try:
+    def _query(conn: sqlite3.Connection) -> dict:
+        nonlocal conversation_id
         if conversation_id is None:
             conversation_id = _get_latest_conversation_id(conn)
         else:
@@ -963,14 +1516,13 @@ async def list_preference_proposals(
             (conversation_id, status),
         ).fetchall()
         return {"proposals": [dict(r) for r in rows]}
-    finally:
-        conn.close()
+
+    return await _db_read(_query)
 
 
 @app.post("/preference-proposals/{proposal_id}/approve")
 async def approve_preference_proposal(proposal_id: int) -> dict:
-    conn = _connect()
-    try:
+    def _write(conn: sqlite3.Connection) -> dict:
         row = conn.execute(
             """
             SELECT id, conversation_id, key, value, status, causality_message_id
@@ -1012,16 +1564,18 @@ async def approve_preference_proposal(proposal_id: int) -> dict:
             """,
             (proposal_id,),
         )
-        conn.commit()
         return {"preference_id": int(cursor.lastrowid), "event_id": event_id}
-    finally:
-        conn.close()
+
+    result = await _db_commit(_write)
+    preference_snapshots.invalidate()
+    invalidate_prompt_cache()
+    semantic_cache.clear()
+    return result
 
 
 @app.post("/preference-proposals/{proposal_id}/reject")
 async def reject_preference_proposal(proposal_id: int) -> dict:
-    conn = _connect()
-    try:
+    def _write(conn: sqlite3.Connection) -> dict:
         row = conn.execute(
             """
             SELECT id, conversation_id, key, value, status, causality_message_id
@@ -1056,10 +1610,9 @@ async def reject_preference_proposal(proposal_id: int) -> dict:
             """,
             (proposal_id,),
         )
-        conn.commit()
         return {"event_id": event_id}
-    finally:
-        conn.close()
+
+    return await _db_commit(_write)
 
 
 @app.post("/messages")
@@ -1068,10 +1621,11 @@ async def create_message(msg: MessageCreate) -> dict[str, int]:
     if not content:
         raise HTTPException(status_code=400, detail="Message content is required")
 
-    conn = _connect()
-    try:
+    def _write(conn: sqlite3.Connection) -> tuple[int, int, list[HistoryMessage] | None]:
         conversation_id = msg.conversation_id or _get_latest_conversation_id(conn)
         _ensure_conversation(conn, conversation_id)
+        if msg.corrects_message_id is not None:
+            _ensure_message(conn, msg.corrects_message_id)
 
         cursor = conn.execute(
             "INSERT INTO messages (content, role, corrects_message_id) VALUES (?, ?, ?)",
@@ -1082,109 +1636,263 @@ async def create_message(msg: MessageCreate) -> dict[str, int]:
             "INSERT OR IGNORE INTO conversation_messages (conversation_id, message_id) VALUES (?, ?)",
             (conversation_id, message_id),
         )
-        conn.commit()
-        return {"id": message_id}
-    finally:
-        conn.close()
+        history = None
+        if conversation_id in history_cache:
+            history = load_history(conn, conversation_id, history_cache.get(conversation_id))
+        return message_id, conversation_id, history
+
+    message_id, conversation_id, history = await _db_commit(_write)
+    if history is not None:
+        history_cache.put(conversation_id, history)
+    _schedule_vector_index()
+    return {"id": message_id}
+
+
+@app.get("/search")
+async def search_history(
+    q: str = Query(...),
+    scope: search.SearchScope = Query(default="messages"),
+    conversation_id: int | None = Query(default=None),
+    role: Literal["user", "assistant"] | None = Query(default=None),
+    event_type: str | None = Query(default=None),
+    syntax: Literal["terms", "fts"] = Query(default="terms"),
+    limit: int = Query(default=20, ge=1, le=200),
+    cursor: str | None = Query(default=None),
+) -> dict:
+    """Full-text search with BM25 ranking; ``syntax=fts`` passes raw FTS5 queries."""
+    match = q.strip() if syntax == "fts" else search.fts_terms(q)
+    if not match:
+        raise HTTPException(status_code=400, detail="Query is required")
+
+    def _query(conn: sqlite3.Connection) -> tuple[list[dict], str | None]:
+        if scope == "events":
+            return search.search_events(
+                conn,
+                match,
+                conversation_id=conversation_id,
+                event_type=event_type,
+                limit=limit,
+                cursor=cursor,
+            )
+        return search.search_messages(
+            conn,
+            match,
+            conversation_id=conversation_id,
+            role=role,
+            limit=limit,
+            cursor=cursor,
+        )
+
+    try:
+        results, next_cursor = await _db_read(_query)
+    except (ValueError, TypeError) as exc:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from exc
+    except sqlite3.OperationalError as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid search query: {exc}") from exc
+    return {"results": results, "next_cursor": next_cursor}
+
+
+@app.get("/search/semantic")
+async def semantic_search(
+    q: str = Query(...),
+    conversation_id: int | None = Query(default=None),
+    k: int = Query(default=10, ge=1, le=100),
+) -> dict:
+    if not _vector_index_enabled():
+        raise HTTPException(status_code=404, detail="Semantic search is disabled")
+    text = q.strip()
+    if not text:
+        raise HTTPException(status_code=400, detail="Query is required")
+
+    # Give a short catch-up the chance to include the latest messages.
+    catch_up = _schedule_vector_index()
+    if catch_up is not None:
+        await asyncio.wait(
+            {catch_up}, timeout=float(os.getenv("MYGPT_VECTOR_INDEX_SEARCH_WAIT_S", "2"))
+        )
+    model_url = _get_model_url()
+    index = await _vector_index()
+    if index.model != embedding_model_tag(model_url, _model_identity()):
+        # Built with another embedding model; catch-up is re-indexing.
+        return {"results": [], "index": index.metrics()}
+    try:
+        vectors = await model_embed([text], model_url, model=_model_identity())
+    except Exception as exc:
+        raise HTTPException(status_code=503, detail=f"Embeddings unavailable: {exc}") from exc
+
+    hits = await asyncio.to_thread(
+        index.search,
+        vectors[0],
+        k,
+        conversation_id,
+        int(os.getenv("MYGPT_VECTOR_IVF_NPROBE", "8")),
+    )
+    rows: dict[int, dict] = {}
+    if hits:
+        placeholders = ",".join("?" for _ in hits)
+        for r in await _db_read(
+            lambda conn: conn.execute(
+                f"SELECT id, role, content, timestamp FROM messages WHERE id IN ({placeholders})",
+                [message_id for message_id, _, _ in hits],
+            ).fetchall()
+        ):
+            rows[int(r["id"])] = dict(r)
+
+    results = []
+    for message_id, hit_conversation_id, score in hits:
+        row = rows.get(message_id)
+        if row is None:
+            continue
+        results.append(
+            {
+                "message_id": message_id,
+                "conversation_id": hit_conversation_id,
+                "score": round(score, 4),
+                "role": row["role"],
+                "content": row["content"],
+                "timestamp": row["timestamp"],
+            }
+        )
+    return {"results": results, "index": index.metrics()}
 
 
 def _sse(payload: dict) -> bytes:
     return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
 
 
+def _log_output_stop(
+    output_filter: OutputFilter, info: GenerationInfo, conversation_id: int
+) -> None:
+    reason = output_filter.stop_reason
+    if reason is None:
+        return
+    model = _model_identity()
+    if reason == "repetition":
+        record_repetition_stop(model)
+    logger.info(
+        "assistant_output_stop reason=%s conversation_id=%s model=%s endpoint=%s",
+        reason,
+        conversation_id,
+        model,
+        info.endpoint,
+    )
+
+
+def _log_disconnect(
+    watcher: DisconnectWatcher, info: GenerationInfo, conversation_id: int
+) -> None:
+    freed_ms = None
+    if watcher.disconnected_at is not None and info.released_at is not None:
+        freed_ms = round(max(0.0, info.released_at - watcher.disconnected_at) * 1000.0, 1)
+    stream_stats.record_disconnect(freed_ms)
+    logger.info(
+        "stream_client_disconnected conversation_id=%s endpoint=%s freed_ms=%s",
+        conversation_id,
+        info.endpoint,
+        freed_ms,
+    )
+
+
 @app.post("/chat")
 async def chat(req: ChatRequest, request: Request) -> StreamingResponse:
     user_content = req.content.strip()
     if not user_content:
         raise HTTPException(status_code=400, detail="Message content is required")
 
-    conn = _connect()
-    try:
+    def _record_user_turn(conn: sqlite3.Connection) -> tuple:
         conversation_id = req.conversation_id or _get_latest_conversation_id(conn)
         _ensure_conversation(conn, conversation_id)
-        approved_preferences = _load_active_preferences(conn)
+        preferences_version, approved_preferences = preference_snapshots.get(conn)
 
-        last_msg_role = None
-        last_msg_row = conn.execute(
-            """
-            SELECT role
-            FROM messages m
-            JOIN conversation_messages cm ON cm.message_id = m.id
-            WHERE cm.conversation_id = ?
-            ORDER BY m.id DESC
-            LIMIT 1
-            """,
-            (conversation_id,),
-        ).fetchone()
-        if last_msg_row:
-            last_msg_role = last_msg_row["role"]
+        history = load_history(conn, conversation_id, history_cache.get(conversation_id))
+        last_msg_role = history[-1].role if history else None
 
         decision = evaluate_clarifying_question(
             user_content, previous_message_role=last_msg_role
         )
 
         cursor = conn.execute(
-        "INSERT INTO messages (content, role) VALUES (?, 'user')",
-        (user_content,),
+            "INSERT INTO messages (content, role) VALUES (?, 'user')",
+            (user_content,),
         )
         user_message_id = int(cursor.lastrowid)
         conn.execute(
             "INSERT OR IGNORE INTO conversation_messages (conversation_id, message_id) VALUES (?, ?)",
             (conversation_id, user_message_id),
         )
-        conn.commit()
 
         _insert_event(
-        conn,
-        event_type="user_prompt",
-        payload={"content": user_content},
-        conversation_id=conversation_id,
-        causality_message_id=user_message_id,
+            conn,
+            event_type="user_prompt",
+            payload={"content": user_content},
+            conversation_id=conversation_id,
+            causality_message_id=user_message_id,
         )
-        conn.commit()
 
-        rows = conn.execute(
-            """
-            SELECT m.id, m.content, m.role, m.timestamp, m.corrects_message_id
-            FROM messages m
-            JOIN conversation_messages cm ON cm.message_id = m.id
-            WHERE cm.conversation_id = ?
-            ORDER BY m.id
-            """,
-            (conversation_id,),
-        ).fetchall()
-        history = [dict(r) for r in rows]
+        history = load_history(conn, conversation_id, history)
+        summary = _latest_summary(conn, conversation_id)
+        return (
+            conversation_id,
+            preferences_version,
+            approved_preferences,
+            decision,
+            user_message_id,
+            history,
+            summary,
+        )
 
-        llm_prompt = model_build_prompt(history, preferences=approved_preferences)
-    finally:
-        conn.close()
+    (
+        conversation_id,
+        preferences_version,
+        approved_preferences,
+        decision,
+        user_message_id,
+        history,
+        summary,
+    ) = await _db_commit(_record_user_turn)
+    history_cache.put(conversation_id, history)
+
+    summary_text = summary["content"] if summary else None
+    context_fit = await model_fit_context(
+        _unsummarized(history, summary),
+        preferences=approved_preferences,
+        conversation_id=conversation_id,
+        model_url=_get_model_url(),
+        summary=summary_text,
+    )
+    llm_prompt = model_build_prompt(
+        context_fit.messages,
+        preferences=approved_preferences,
+        conversation_id=conversation_id,
+        summary=summary_text,
+        preferences_version=preferences_version,
+    )
 
     async def event_stream() -> AsyncIterator[bytes]:
         if decision.action == "clarify":
-            conn_q = _connect()
-            try:
-                cursor_q = conn_q.execute(
+            def _save_question(conn: sqlite3.Connection) -> list[HistoryMessage]:
+                cursor_q = conn.execute(
                     "INSERT INTO messages (content, role) VALUES (?, 'assistant')",
                     (decision.question,),
                 )
                 q_message_id = int(cursor_q.lastrowid)
-                conn_q.execute(
+                conn.execute(
                     "INSERT OR IGNORE INTO conversation_messages (conversation_id, message_id) VALUES (?, ?)",
                     (conversation_id, q_message_id),
                 )
-                conn_q.commit()
-            finally:
-                conn_q.close()
+                return load_history(conn, conversation_id, history)
+
+            history_cache.put(conversation_id, await _db_commit(_save_question))
 
             yield _sse({"token": decision.question})
             yield _sse({"done": True})
             return
 
-        assistant_chunks: list[str] = []
         stopped = False
         proposal_payload: dict | None = None
         trace_id = uuid.uuid4().hex
         request_event_id: int | None = None
+        prompt_sha256 = _sha256_text(llm_prompt)
 
         if _llm_logging_enabled():
             log_dir = _llm_log_dir()
@@ -1196,21 +1904,17 @@ async def chat(req: ChatRequest, request: Request) -> StreamingResponse:
                 "trace_id": trace_id,
                 "model_url": _get_model_url(),
                 "prompt_path": str(prompt_path),
-                "prompt_sha256": _sha256_text(llm_prompt),
+                "prompt_sha256": prompt_sha256,
+                "context": context_fit.as_payload(),
+                "summary_id": summary["id"] if summary else None,
             }
 
-            conn_log = _connect()
-            try:
-                request_event_id = _insert_event(
-                    conn_log,
-                    event_type="llm_request",
-                    payload=meta,
-                    conversation_id=conversation_id,
-                    causality_message_id=user_message_id,
-                )
-                conn_log.commit()
-            finally:
-                conn_log.close()
+            request_event_id = await _log_event(
+                event_type="llm_request",
+                payload=meta,
+                conversation_id=conversation_id,
+                causality_message_id=user_message_id,
+            )
 
             logger.info(
                 "llm_request trace_id=%s event_id=%s prompt_sha256=%s",
@@ -1219,52 +1923,148 @@ async def chat(req: ChatRequest, request: Request) -> StreamingResponse:
                 meta["prompt_sha256"],
             )
 
-        try:
-            async for token in model_generate(
-                history,
+        cache_entry = _completion_cache_key(
+            prompt_sha256, opted_in=req.use_cache, regenerate=False
+        )
+        cached_response = await _completion_cache_get(cache_entry[0]) if cache_entry else None
+        semantic_vector = None
+        semantic_hit = None
+        if cached_response is None and _semantic_cache_applies(history):
+            semantic_vector = await _semantic_embed(user_content)
+            if semantic_vector is not None:
+                semantic_hit = semantic_cache.lookup(_model_identity(), semantic_vector)
+        generation_info = GenerationInfo()
+        ticket = None
+        if cached_response is not None:
+            yield _sse({"cached": {"kind": "exact"}})
+            tokens = completion_cache.replay(cached_response)
+        elif semantic_hit is not None:
+            semantic_entry, similarity = semantic_hit
+            logger.info(
+                "semantic_cache_hit conversation_id=%s entry_id=%s similarity=%.4f",
+                conversation_id,
+                semantic_entry.entry_id,
+                similarity,
+            )
+            yield _sse({"cached": {"kind": "semantic", "similarity": round(similarity, 4)}})
+            tokens = completion_cache.replay(semantic_entry.answer)
+        else:
+            ticket = generation_scheduler.submit(conversation_id, priority="interactive")
+            try:
+                async for position in ticket.positions():
+                    yield _sse({"queue": {"position": position}})
+            except QueueTimeout as exc:
+                ticket.release()
+                logger.warning(
+                    "generation_queue_timeout conversation_id=%s wait_s=%s",
+                    conversation_id,
+                    round(ticket.wait_s, 3),
+                )
+                yield _sse({"error": str(exc)})
+                yield _sse({"done": True})
+                return
+            except BaseException:
+                ticket.release()
+                raise
+
+            tokens = model_generate(
+                context_fit.messages,
                 preferences=approved_preferences,
                 prompt=llm_prompt,
                 model_url=_get_model_url(),
-            ):
-                if await request.is_disconnected():
-                    stopped = True
-                    break
-                assistant_chunks.append(token)
-                yield _sse({"token": token})
+                conversation_id=conversation_id,
+                info=generation_info,
+            )
+
+        output_filter = OutputFilter(RepetitionDetector.from_env())
+        frames = coalesce_tokens(
+            model_filter_output(tokens, output_filter),
+            _flush_policy(req.flush_ms, req.flush_bytes),
+            stream_stats,
+        )
+        interrupted = False
+        watcher = DisconnectWatcher(request.receive)
+        watcher.start()
+        try:
+            async for text in frames:
+                yield _sse({"token": text})
+        except GenerationInterrupted as exc:
+            # The model failed mid-answer: keep what arrived, marked truncated.
+            interrupted = True
+            logger.warning(
+                "generation_interrupted conversation_id=%s endpoint=%s error=%s",
+                conversation_id,
+                generation_info.endpoint,
+                exc,
+            )
         except asyncio.CancelledError:
             stopped = True
+            # Only the disconnect watcher's own cancel is absorbed; shutdown
+            # and server cancellation propagate (after the cleanup below).
+            if not watcher.absorb_cancel():
+                raise
         finally:
-            raw_assistant_content = "".join(assistant_chunks).strip()
+            watcher.stop()
+            await frames.aclose()
+            if watcher.disconnected:
+                stopped = True
+                _log_disconnect(watcher, generation_info, conversation_id)
+            if ticket is not None:
+                ticket.release()
+            output_filter.finish()
+            _log_output_stop(output_filter, generation_info, conversation_id)
+            truncated = interrupted or output_filter.stop_reason == "repetition"
+            raw_assistant_content = output_filter.raw.strip()
+            assistant_content = output_filter.text
             if stopped and raw_assistant_content:
                 raw_assistant_content = f"{raw_assistant_content}\n\n[stopped]"
-
-            cleaned_assistant_content = _truncate_at_role_markers(
-                _strip_ansi(_strip_think_blocks(raw_assistant_content)).strip()
-            )
-            if not cleaned_assistant_content:
-                cleaned_assistant_content = _truncate_at_role_markers(
-                    _strip_ansi(raw_assistant_content).strip()
+                assistant_content = f"{assistant_content}\n\n[stopped]".strip()
+            elif truncated and assistant_content:
+                assistant_content = f"{assistant_content}\n\n[truncated]"
+
+            if (
+                cache_entry is not None
+                and cached_response is None
+                and semantic_hit is None
+                and not stopped
+                and not truncated
+                and not generation_info.fallback
+                and raw_assistant_content
+            ):
+                await _completion_cache_put(
+                    cache_entry[0], cache_entry[1], prompt_sha256, raw_assistant_content
+                )
+            if (
+                semantic_vector is not None
+                and semantic_hit is None
+                and not stopped
+                and not truncated
+                and not generation_info.fallback
+                and assistant_content
+            ):
+                semantic_cache.add(
+                    _model_identity(), user_content, semantic_vector, assistant_content
                 )
-
-            assistant_content = cleaned_assistant_content
 
             if assistant_content:
-                conn2 = _connect()
-                try:
-                    cursor2 = conn2.execute(
+                def _save_answer(
+                    conn: sqlite3.Connection,
+                ) -> tuple[dict | None, list[HistoryMessage]]:
+                    cursor2 = conn.execute(
                         "INSERT INTO messages (content, role) VALUES (?, 'assistant')",
                         (assistant_content,),
                     )
                     assistant_message_id = int(cursor2.lastrowid)
-                    conn2.execute(
+                    conn.execute(
                         "INSERT OR IGNORE INTO conversation_messages (conversation_id, message_id) VALUES (?, ?)",
                         (conversation_id, assistant_message_id),
                     )
 
-                    if not stopped and _get_pending_proposal(conn2, conversation_id) is None:
+                    proposal: dict | None = None
+                    if not stopped and _get_pending_proposal(conn, conversation_id) is None:
                         inferred = _infer_preference_proposal(history, approved_preferences)
                         if inferred is not None:
-                            cursor3 = conn2.execute(
+                            cursor3 = conn.execute(
                                 """
                                 INSERT INTO preference_proposals (
                                   conversation_id, key, value, proposal_text, rationale,
@@ -1283,7 +2083,7 @@ async def chat(req: ChatRequest, request: Request) -> StreamingResponse:
                                 ),
                             )
                             proposal_id = int(cursor3.lastrowid)
-                            proposal_row = conn2.execute(
+                            proposal_row = conn.execute(
                                 """
                                 SELECT
                                   id, conversation_id, key, value, proposal_text, rationale,
@@ -1294,24 +2094,35 @@ async def chat(req: ChatRequest, request: Request) -> StreamingResponse:
                                 (proposal_id,),
                             ).fetchone()
                             if proposal_row is not None:
-                                proposal_payload = dict(proposal_row)
+                                proposal = dict(proposal_row)
 
-                    conn2.commit()
                     _insert_event(
-                        conn2,
+                        conn,
                         event_type="assistant_response",
-                        payload={"content": assistant_content},
+                        payload={
+                            "content": assistant_content,
+                            "cached": cached_response is not None or semantic_hit is not None,
+                            "semantic_similarity": (
+                                round(semantic_hit[1], 4) if semantic_hit is not None else None
+                            ),
+                            "truncated": truncated,
+                        },
                         conversation_id=conversation_id,
                         causality_message_id=assistant_message_id,
                     )
-                    conn2.commit()
-                finally:
-                    conn2.close()
+                    return proposal, load_history(conn, conversation_id, history)
+
+                # Shielded: the answer is persisted even if the stream is being cancelled.
+                proposal_payload, saved_history = await asyncio.shield(
+                    _db_commit(_save_answer)
+                )
+                history_cache.put(conversation_id, saved_history)
             if assistant_content:
                 logger.info(
                     "assistant_response_saved conversation_id=%s",
                     conversation_id,
                 )
+            _schedule_vector_index()
 
             if _llm_logging_enabled():
                 assistant_full_raw = raw_assistant_content if raw_assistant_content else ""
@@ -1335,20 +2146,17 @@ async def chat(req: ChatRequest, request: Request) -> StreamingResponse:
                     "response_cleaned_path": str(response_cleaned_path),
                     "response_cleaned_sha256": _sha256_text(assistant_full_cleaned),
                     "stopped": stopped,
+                    "truncated": truncated,
                 }
 
-                conn_log2 = _connect()
-                try:
-                    response_event_id = _insert_event(
-                        conn_log2,
+                response_event_id = await asyncio.shield(
+                    _log_event(
                         event_type="llm_response",
                         payload=meta2,
                         conversation_id=conversation_id,
                         causality_message_id=user_message_id,
                     )
-                    conn_log2.commit()
-                finally:
-                    conn_log2.close()
+                )
 
                 logger.info(
                     "llm_response trace_id=%s event_id=%s stopped=%s response_sha256=%s",
@@ -1359,6 +2167,9 @@ async def chat(req: ChatRequest, request: Request) -> StreamingResponse:
                 )
 
             if not stopped:
+                _schedule_summary_refresh(conversation_id, history, summary)
+                if interrupted:
+                    yield _sse({"error": "Model stream interrupted"})
                 if proposal_payload is not None:
                     yield _sse({"proposal": proposal_payload})
                 yield _sse({"done": True})
@@ -1368,8 +2179,7 @@ async def chat(req: ChatRequest, request: Request) -> StreamingResponse:
 
 @app.post("/regenerate")
 async def regenerate(req: RegenerateRequest, request: Request) -> StreamingResponse:
-    conn = _connect()
-    try:
+    def _load_turn(conn: sqlite3.Connection) -> tuple:
         conversation_id = req.conversation_id or _get_latest_conversation_id(conn)
         _ensure_conversation(conn, conversation_id)
 
@@ -1384,41 +2194,50 @@ async def regenerate(req: RegenerateRequest, request: Request) -> StreamingRespo
                 status_code=400, detail="Target message is not an assistant message"
             )
 
-        rows = conn.execute(
-            """
-            SELECT m.id, m.content, m.role, m.timestamp, m.corrects_message_id
-            FROM messages m
-            JOIN conversation_messages cm ON cm.message_id = m.id
-            WHERE cm.conversation_id = ?
-            ORDER BY m.id
-            """,
-            (conversation_id,),
-        ).fetchall()
-        history = [dict(r) for r in rows if r["id"] != req.target_message_id]
-
-        approved_preferences = _load_active_preferences(conn)
-        llm_prompt = model_build_prompt(history, preferences=approved_preferences)
-    finally:
-        conn.close()
+        history = load_history(conn, conversation_id, history_cache.get(conversation_id))
+
+        preferences_version, approved_preferences = preference_snapshots.get(conn)
+        summary = _latest_summary(conn, conversation_id)
+        return conversation_id, history, preferences_version, approved_preferences, summary
+
+    (
+        conversation_id,
+        full_history,
+        preferences_version,
+        approved_preferences,
+        summary,
+    ) = await _db_read(_load_turn)
+    history_cache.put(conversation_id, full_history)
+    history = [m for m in full_history if m.id != req.target_message_id]
+
+    summary_text = summary["content"] if summary else None
+    context_fit = await model_fit_context(
+        _unsummarized(history, summary),
+        preferences=approved_preferences,
+        conversation_id=conversation_id,
+        model_url=_get_model_url(),
+        summary=summary_text,
+    )
+    llm_prompt = model_build_prompt(
+        context_fit.messages,
+        preferences=approved_preferences,
+        conversation_id=conversation_id,
+        summary=summary_text,
+        preferences_version=preferences_version,
+    )
 
     async def event_stream() -> AsyncIterator[bytes]:
-        assistant_chunks: list[str] = []
         stopped = False
         trace_id = uuid.uuid4().hex
         request_event_id: int | None = None
+        prompt_sha256 = _sha256_text(llm_prompt)
 
-        conn_log = _connect()
-        try:
-            regen_event_id = _insert_event(
-                conn_log,
-                event_type="regenerate_request",
-                payload={"target_message_id": req.target_message_id},
-                conversation_id=conversation_id,
-                causality_message_id=req.target_message_id,
-            )
-            conn_log.commit()
-        finally:
-            conn_log.close()
+        regen_event_id = await _log_event(
+            event_type="regenerate_request",
+            payload={"target_message_id": req.target_message_id},
+            conversation_id=conversation_id,
+            causality_message_id=req.target_message_id,
+        )
 
         if _llm_logging_enabled():
             log_dir = _llm_log_dir()
@@ -1429,21 +2248,17 @@ async def regenerate(req: RegenerateRequest, request: Request) -> StreamingRespo
                 "trace_id": trace_id,
                 "model_url": _get_model_url(),
                 "prompt_path": str(prompt_path),
-                "prompt_sha256": _sha256_text(llm_prompt),
+                "prompt_sha256": prompt_sha256,
+                "context": context_fit.as_payload(),
+                "summary_id": summary["id"] if summary else None,
             }
 
-            conn_log = _connect()
-            try:
-                request_event_id = _insert_event(
-                    conn_log,
-                    event_type="llm_regenerate_request",
-                    payload=meta,
-                    conversation_id=conversation_id,
-                    causality_message_id=req.target_message_id,
-                )
-                conn_log.commit()
-            finally:
-                conn_log.close()
+            request_event_id = await _log_event(
+                event_type="llm_regenerate_request",
+                payload=meta,
+                conversation_id=conversation_id,
+                causality_message_id=req.target_message_id,
+            )
 
             logger.info(
                 "llm_regenerate_request trace_id=%s event_id=%s prompt_sha256=%s",
@@ -1452,50 +2267,118 @@ async def regenerate(req: RegenerateRequest, request: Request) -> StreamingRespo
                 meta["prompt_sha256"],
             )
 
-        try:
-            async for token in model_generate(
-                history,
+        cache_entry = _completion_cache_key(
+            prompt_sha256, opted_in=req.use_cache, regenerate=True
+        )
+        cached_response = await _completion_cache_get(cache_entry[0]) if cache_entry else None
+        generation_info = GenerationInfo()
+        ticket = None
+        if cached_response is not None:
+            yield _sse({"cached": {"kind": "exact"}})
+            tokens = completion_cache.replay(cached_response)
+        else:
+            ticket = generation_scheduler.submit(conversation_id, priority="regenerate")
+            try:
+                async for position in ticket.positions():
+                    yield _sse({"queue": {"position": position}})
+            except QueueTimeout as exc:
+                ticket.release()
+                logger.warning(
+                    "generation_queue_timeout conversation_id=%s wait_s=%s",
+                    conversation_id,
+                    round(ticket.wait_s, 3),
+                )
+                yield _sse({"error": str(exc)})
+                yield _sse({"done": True})
+                return
+            except BaseException:
+                ticket.release()
+                raise
+
+            tokens = model_generate(
+                context_fit.messages,
                 preferences=approved_preferences,
                 prompt=llm_prompt,
                 model_url=_get_model_url(),
-            ):
-                if await request.is_disconnected():
-                    stopped = True
-                    break
-                assistant_chunks.append(token)
-                yield _sse({"token": token})
+                conversation_id=conversation_id,
+                info=generation_info,
+            )
+
+        output_filter = OutputFilter(RepetitionDetector.from_env())
+        frames = coalesce_tokens(
+            model_filter_output(tokens, output_filter),
+            _flush_policy(req.flush_ms, req.flush_bytes),
+            stream_stats,
+        )
+        interrupted = False
+        watcher = DisconnectWatcher(request.receive)
+        watcher.start()
+        try:
+            async for text in frames:
+                yield _sse({"token": text})
+        except GenerationInterrupted as exc:
+            # The model failed mid-answer: keep what arrived, marked truncated.
+            interrupted = True
+            logger.warning(
+                "generation_interrupted conversation_id=%s endpoint=%s error=%s",
+                conversation_id,
+                generation_info.endpoint,
+                exc,
+            )
         except asyncio.CancelledError:
             stopped = True
+            # Only the disconnect watcher's own cancel is absorbed; shutdown
+            # and server cancellation propagate (after the cleanup below).
+            if not watcher.absorb_cancel():
+                raise
         finally:
-            raw_assistant_content = "".join(assistant_chunks).strip()
+            watcher.stop()
+            await frames.aclose()
+            if watcher.disconnected:
+                stopped = True
+                _log_disconnect(watcher, generation_info, conversation_id)
+            if ticket is not None:
+                ticket.release()
+            output_filter.finish()
+            _log_output_stop(output_filter, generation_info, conversation_id)
+            truncated = interrupted or output_filter.stop_reason == "repetition"
+            raw_assistant_content = output_filter.raw.strip()
+            assistant_content = output_filter.text
             if stopped and raw_assistant_content:
                 raw_assistant_content = f"{raw_assistant_content}\n\n[stopped]"
-
-            cleaned_assistant_content = _truncate_at_role_markers(
-                _strip_ansi(_strip_think_blocks(raw_assistant_content)).strip()
-            )
-            if not cleaned_assistant_content:
-                cleaned_assistant_content = _truncate_at_role_markers(
-                    _strip_ansi(raw_assistant_content).strip()
+                assistant_content = f"{assistant_content}\n\n[stopped]".strip()
+            elif truncated and assistant_content:
+                assistant_content = f"{assistant_content}\n\n[truncated]"
+
+            if (
+                cache_entry is not None
+                and cached_response is None
+                and not stopped
+                and not truncated
+                and not generation_info.fallback
+                and raw_assistant_content
+            ):
+                await _completion_cache_put(
+                    cache_entry[0], cache_entry[1], prompt_sha256, raw_assistant_content
                 )
-
-            assistant_content = cleaned_assistant_content
             if assistant_content:
-                conn2 = _connect()
-                try:
-                    cursor2 = conn2.execute(
+                def _save_answer(conn: sqlite3.Connection) -> list[HistoryMessage]:
+                    cursor2 = conn.execute(
                         "INSERT INTO messages (content, role, corrects_message_id) VALUES (?, 'assistant', ?)",
                         (assistant_content, req.target_message_id),
                     )
                     assistant_message_id = int(cursor2.lastrowid)
-                    conn2.execute(
+                    conn.execute(
                         "INSERT OR IGNORE INTO conversation_messages (conversation_id, message_id) VALUES (?, ?)",
                         (conversation_id, assistant_message_id),
                     )
+                    return load_history(conn, conversation_id, full_history)
 
-                    conn2.commit()
-                finally:
-                    conn2.close()
+                # Shielded: the answer is persisted even if the stream is being cancelled.
+                history_cache.put(
+                    conversation_id, await asyncio.shield(_db_commit(_save_answer))
+                )
+            _schedule_vector_index()
 
             if _llm_logging_enabled():
                 assistant_full_raw = (
@@ -1516,20 +2399,17 @@ async def regenerate(req: RegenerateRequest, request: Request) -> StreamingRespo
                     "response_cleaned_path": str(response_cleaned_path),
                     "response_cleaned_sha256": _sha256_text(assistant_full_cleaned),
                     "stopped": stopped,
+                    "truncated": truncated,
                 }
 
-                conn_log2 = _connect()
-                try:
-                    response_event_id = _insert_event(
-                        conn_log2,
+                response_event_id = await asyncio.shield(
+                    _log_event(
                         event_type="llm_response",
                         payload=meta2,
                         conversation_id=conversation_id,
                         causality_message_id=req.target_message_id,
                     )
-                    conn_log2.commit()
-                finally:
-                    conn_log2.close()
+                )
 
                 logger.info(
                     "llm_response trace_id=%s event_id=%s stopped=%s response_sha256=%s",
@@ -1540,6 +2420,8 @@ async def regenerate(req: RegenerateRequest, request: Request) -> StreamingRespo
                 )
 
             if not stopped:
+                if interrupted:
+                    yield _sse({"error": "Model stream interrupted"})
                 yield _sse({"done": True})
 
     return StreamingResponse(event_stream(), media_type="text/event-stream")
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import sqlite3
+import time
+from typing import AsyncIterator
+
+
+def cache_key(prompt_sha256: str, model: str, params: dict) -> str:
+    material = json.dumps(
+        {"prompt_sha256": prompt_sha256, "model": model, "params": params},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def lookup(conn: sqlite3.Connection, key: str) -> str | None:
+    row = conn.execute(
+        "SELECT response FROM completion_cache WHERE cache_key = ?", (key,)
+    ).fetchone()
+    if row is None:
+        return None
+    conn.execute(
+        "UPDATE completion_cache SET hits = hits + 1, last_used_at = ? WHERE cache_key = ?",
+        (time.time(), key),
+    )
+    return str(row["response"])
+
+
+def store(
+    conn: sqlite3.Connection,
+    *,
+    key: str,
+    prompt_sha256: str,
+    model: str,
+    params: dict,
+    response: str,
+    max_entries: int,
+    max_bytes: int,
+) -> None:
+    now = time.time()
+    conn.execute(
+        """
+        INSERT INTO completion_cache (
+          cache_key, prompt_sha256, model, params_json, response, size_bytes,
+          created_at, last_used_at, hits
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)
+        ON CONFLICT(cache_key) DO UPDATE SET
+          response = excluded.response,
+          size_bytes = excluded.size_bytes,
+          last_used_at = excluded.last_used_at
+        """,
+        (
+            key,
+            prompt_sha256,
+            model,
+            json.dumps(params, sort_keys=True, ensure_ascii=False),
+            response,
+            len(response.encode("utf-8")),
+            now,
+            now,
+        ),
+    )
+    evict(conn, max_entries=max_entries, max_bytes=max_bytes)
+
+
+def evict(conn: sqlite3.Connection, *, max_entries: int, max_bytes: int) -> int:
+    """Drop least recently used entries until both bounds hold."""
+    row = conn.execute(
+        "SELECT COUNT(*) AS n, COALESCE(SUM(size_bytes), 0) AS total FROM completion_cache"
+    ).fetchone()
+    count, total = int(row["n"]), int(row["total"])
+    if count <= max_entries and total <= max_bytes:
+        return 0
+
+    removed = 0
+    rows = conn.execute(
+        "SELECT cache_key, size_bytes FROM completion_cache ORDER BY last_used_at"
+    ).fetchall()
+    doomed: list[str] = []
+    for r in rows:
+        if count <= max_entries and total <= max_bytes:
+            break
+        doomed.append(r["cache_key"])
+        count -= 1
+        total -= int(r["size_bytes"])
+        removed += 1
+    conn.executemany("DELETE FROM completion_cache WHERE cache_key = ?", [(k,) for k in doomed])
+    return removed
+
+
+async def replay(text: str) -> AsyncIterator[str]:
+    """Re-emit a cached response as word-sized tokens."""
+    for piece in re.findall(r"\s*\S+\s*|\s+", text):
+        yield piece
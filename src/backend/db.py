@@ -0,0 +1,312 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, TypeVar
+
+T = TypeVar("T")
+
+
+def _pragmas(readonly: bool) -> list[str]:
+    pragmas = [
+        "PRAGMA foreign_keys = ON",
+        f"PRAGMA busy_timeout = {int(os.getenv('MYGPT_SQLITE_BUSY_TIMEOUT_MS', '5000'))}",
+        f"PRAGMA cache_size = -{int(os.getenv('MYGPT_SQLITE_CACHE_KB', '16384'))}",
+        f"PRAGMA mmap_size = {int(os.getenv('MYGPT_SQLITE_MMAP_MB', '256')) * 1024 * 1024}",
+        "PRAGMA temp_store = MEMORY",
+    ]
+    if readonly:
+        pragmas.append("PRAGMA query_only = ON")
+    else:
+        # WAL makes NORMAL durable against application crashes; only an OS
+        # crash or power loss can drop the last commits.
+        pragmas.append("PRAGMA journal_mode = WAL")
+        pragmas.append(f"PRAGMA synchronous = {os.getenv('MYGPT_SQLITE_SYNCHRONOUS', 'NORMAL')}")
+    return pragmas
+
+
+class PooledConnection(sqlite3.Connection):
+    """A connection whose ``close()`` hands it back to its pool."""
+
+    pool: ConnectionPool | None = None
+    in_group_commit = False
+
+    def commit(self) -> None:
+        if self.in_group_commit:
+            raise RuntimeError("Group-commit operations must not commit themselves")
+        super().commit()
+
+    def close(self) -> None:
+        pool = self.pool
+        if pool is None:
+            super().close()
+            return
+        pool.release(self)
+
+    def discard(self) -> None:
+        self.pool = None
+        super().close()
+
+
+class ConnectionPool:
+    """Reuse configured SQLite connections instead of reopening per request.
+
+    ``acquire()`` never blocks: when no idle connection is available a new
+    one is opened, and at most ``max_idle`` are kept for reuse.
+    """
+
+    def __init__(self, path: Path, *, readonly: bool = False, max_idle: int = 8) -> None:
+        self.path = path
+        self.readonly = readonly
+        self.max_idle = max(0, int(max_idle))
+        self._idle: list[PooledConnection] = []
+        self._lock = threading.Lock()
+        self.opened_total = 0
+        self.reused_total = 0
+
+    def _open(self) -> PooledConnection:
+        if self.readonly:
+            target, uri = f"{self.path.resolve().as_uri()}?mode=ro", True
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            target, uri = str(self.path), False
+        conn = sqlite3.connect(
+            target, uri=uri, factory=PooledConnection, check_same_thread=False
+        )
+        for pragma in _pragmas(self.readonly):
+            conn.execute(pragma)
+        conn.pool = self
+        self.opened_total += 1
+        return conn
+
+    def acquire(self) -> PooledConnection:
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+            if conn is not None:
+                self.reused_total += 1
+        if conn is None:
+            conn = self._open()
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def release(self, conn: PooledConnection) -> None:
+        try:
+            if conn.in_transaction:
+                # Same as closing without commit: uncommitted work is dropped.
+                conn.rollback()
+        except sqlite3.Error:
+            conn.discard()
+            return
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.discard()
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.discard()
+
+    def metrics(self) -> dict:
+        return {
+            "idle": len(self._idle),
+            "opened_total": self.opened_total,
+            "reused_total": self.reused_total,
+        }
+
+
+_POOLS: dict[tuple[str, bool], ConnectionPool] = {}
+
+
+def pool_for(path: Path, *, readonly: bool = False) -> ConnectionPool:
+    key = (str(path), readonly)
+    pool = _POOLS.get(key)
+    if pool is None:
+        pool = ConnectionPool(
+            path, readonly=readonly, max_idle=int(os.getenv("MYGPT_DB_POOL_SIZE", "8"))
+        )
+        _POOLS[key] = pool
+    return pool
+
+
+def close_pools() -> None:
+    for pool in _POOLS.values():
+        pool.close()
+
+
+def pool_metrics() -> dict:
+    return {
+        f"{path}{' (ro)' if readonly else ''}": pool.metrics()
+        for (path, readonly), pool in _POOLS.items()
+    }
+
+
+# All database work runs on these executors so a slow query or fsync never
+# blocks the event loop. One writer thread serializes writes (SQLite allows
+# a single writer anyway, so this avoids busy waits); reads run in parallel
+# on WAL snapshots.
+_WRITE_EXECUTOR: ThreadPoolExecutor | None = None
+_READ_EXECUTOR: ThreadPoolExecutor | None = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def _executors() -> tuple[ThreadPoolExecutor, ThreadPoolExecutor]:
+    global _WRITE_EXECUTOR, _READ_EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _WRITE_EXECUTOR is None:
+            _WRITE_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mygpt-db-write")
+        if _READ_EXECUTOR is None:
+            _READ_EXECUTOR = ThreadPoolExecutor(
+                max_workers=max(1, int(os.getenv("MYGPT_DB_READ_THREADS", "4"))),
+                thread_name_prefix="mygpt-db-read",
+            )
+        return _WRITE_EXECUTOR, _READ_EXECUTOR
+
+
+async def run_write(fn: Callable[..., T], *args, **kwargs) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executors()[0], functools.partial(fn, *args, **kwargs))
+
+
+async def run_read(fn: Callable[..., T], *args, **kwargs) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executors()[1], functools.partial(fn, *args, **kwargs))
+
+
+def shutdown_executors() -> None:
+    global _WRITE_EXECUTOR, _READ_EXECUTOR
+    with _EXECUTOR_LOCK:
+        executors = [e for e in (_WRITE_EXECUTOR, _READ_EXECUTOR) if e is not None]
+        _WRITE_EXECUTOR = _READ_EXECUTOR = None
+    for executor in executors:
+        executor.shutdown(wait=True)
+
+
+class GroupCommitWriter:
+    """Batch many small writes into one transaction (group commit).
+
+    ``submit(fn)`` queues ``fn(conn)``; queued operations run back to back
+    on the writer thread inside a single ``BEGIN IMMEDIATE ... COMMIT``,
+    each in its own savepoint so one failing operation does not undo the
+    others. A batch starts as soon as the writer is idle (after
+    ``window_s``, if set) and holds at most ``max_batch`` operations;
+    whatever arrives while a batch commits goes into the next one.
+
+    Durability is explicit: the future returned by ``submit`` resolves only
+    after the batch containing it has committed, with ``fn``'s return value
+    (e.g. a lastrowid) or its exception. Operations must not call
+    ``commit()`` themselves.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], sqlite3.Connection],
+        *,
+        window_s: float = 0.0,
+        max_batch: int = 64,
+    ) -> None:
+        self._connect = connect
+        self.window_s = window_s
+        self.max_batch = max(1, int(max_batch))
+        self._pending: list[tuple[Callable[[sqlite3.Connection], object], asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._inflight = False
+        self._tasks: set[asyncio.Task] = set()
+        self.batches_total = 0
+        self.ops_total = 0
+        self.largest_batch = 0
+
+    async def submit(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((fn, future))
+        if not self._inflight:
+            if len(self._pending) >= self.max_batch:
+                self._schedule(loop, 0.0)
+            elif self._timer is None:
+                self._schedule(loop, self.window_s)
+        # Shielded: once queued the write happens even if the caller is cancelled.
+        return await asyncio.shield(future)
+
+    def _schedule(self, loop: asyncio.AbstractEventLoop, delay: float) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = loop.call_later(delay, self._flush)
+
+    def _flush(self) -> None:
+        self._timer = None
+        if self._inflight or not self._pending:
+            return
+        batch = self._pending[: self.max_batch]
+        self._pending = self._pending[self.max_batch :]
+        self._inflight = True
+        task = asyncio.ensure_future(self._commit(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _commit(self, batch: list[tuple[Callable, asyncio.Future]]) -> None:
+        try:
+            results = await run_write(self._apply, [fn for fn, _ in batch])
+        except Exception as exc:
+            results = [(False, exc)] * len(batch)
+        finally:
+            self._inflight = False
+            if self._pending:
+                self._schedule(asyncio.get_running_loop(), 0.0)
+        self.batches_total += 1
+        self.ops_total += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        for (_, future), (ok, value) in zip(batch, results):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def _apply(self, fns: list[Callable[[sqlite3.Connection], object]]) -> list[tuple[bool, object]]:
+        conn = self._connect()
+        previous_isolation = conn.isolation_level
+        conn.isolation_level = None  # explicit BEGIN/SAVEPOINT/COMMIT below
+        results: list[tuple[bool, object]] = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.in_group_commit = True
+            try:
+                for fn in fns:
+                    conn.execute("SAVEPOINT group_op")
+                    try:
+                        value = fn(conn)
+                    except Exception as exc:
+                        conn.execute("ROLLBACK TO group_op")
+                        conn.execute("RELEASE group_op")
+                        results.append((False, exc))
+                        continue
+                    conn.execute("RELEASE group_op")
+                    results.append((True, value))
+            finally:
+                conn.in_group_commit = False
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.isolation_level = previous_isolation
+            conn.close()
+        return results
+
+    def metrics(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "batches_total": self.batches_total,
+            "ops_total": self.ops_total,
+            "largest_batch": self.largest_batch,
+        }
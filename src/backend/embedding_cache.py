@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import sys
+import time
+from array import array
+from typing import Callable, Iterable
+
+from . import db
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def pack(vector: Iterable[float]) -> bytes:
+    """Serialize a vector as little-endian float32."""
+    values = array("f", vector)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tobytes()
+
+
+def unpack(blob: bytes) -> list[float]:
+    values = array("f")
+    values.frombytes(blob)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tolist()
+
+
+def lookup_many(conn: sqlite3.Connection, model: str, hashes: list[str]) -> dict[str, list[float]]:
+    found: dict[str, list[float]] = {}
+    # Stay well below SQLite's bound-parameter limit.
+    for start in range(0, len(hashes), 500):
+        chunk = hashes[start : start + 500]
+        placeholders = ",".join("?" for _ in chunk)
+        rows = conn.execute(
+            f"""
+            SELECT content_sha256, vector FROM embedding_cache
+            WHERE model = ? AND content_sha256 IN ({placeholders})
+            """,
+            (model, *chunk),
+        ).fetchall()
+        for row in rows:
+            found[row["content_sha256"]] = unpack(row["vector"])
+    return found
+
+
+def store_many(conn: sqlite3.Connection, model: str, vectors: dict[str, list[float]]) -> None:
+    now = time.time()
+    conn.executemany(
+        """
+        INSERT OR IGNORE INTO embedding_cache (content_sha256, model, dim, vector, created_at)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        [(h, model, len(v), pack(v), now) for h, v in vectors.items()],
+    )
+
+
+class EmbeddingStore:
+    """Embedding cache backed by the ``embedding_cache`` table.
+
+    Lookups use ``connect_read`` (the read-only pool) when given, so they
+    never take a writable connection away from ``put_many``.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], sqlite3.Connection],
+        connect_read: Callable[[], sqlite3.Connection] | None = None,
+    ) -> None:
+        self._connect = connect
+        self._connect_read = connect_read or connect
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, model: str, hashes: list[str]) -> dict[str, list[float]]:
+        conn = self._connect_read()
+        try:
+            return lookup_many(conn, model, hashes)
+        finally:
+            conn.close()
+
+    def _store(self, model: str, vectors: dict[str, list[float]]) -> None:
+        conn = self._connect()
+        try:
+            store_many(conn, model, vectors)
+            conn.commit()
+        finally:
+            conn.close()
+
+    async def get_many(self, model: str, hashes: list[str]) -> dict[str, list[float]]:
+        found = await db.run_read(self._lookup, model, hashes)
+        self.hits += len(found)
+        self.misses += len(hashes) - len(found)
+        return found
+
+    async def put_many(self, model: str, vectors: dict[str, list[float]]) -> None:
+        if vectors:
+            await db.run_write(self._store, model, vectors)
+
+    def metrics(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
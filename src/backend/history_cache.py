@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+from collections import OrderedDict
+from collections.abc import Iterator, Mapping
+
+_FIELDS = ("id", "content", "role", "timestamp", "corrects_message_id")
+
+
+class HistoryMessage(Mapping):
+    """Compact, read-only message row.
+
+    Behaves like the ``dict(row)`` it replaces (``m["role"]``,
+    ``m.get("content")``, ``dict(m)``) without a per-row dict.
+    """
+
+    __slots__ = _FIELDS
+
+    def __init__(
+        self,
+        id: int,
+        content: str,
+        role: str,
+        timestamp: str | None,
+        corrects_message_id: int | None,
+    ) -> None:
+        self.id = id
+        self.content = content
+        self.role = role
+        self.timestamp = timestamp
+        self.corrects_message_id = corrects_message_id
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> HistoryMessage:
+        return cls(
+            int(row["id"]),
+            row["content"],
+            row["role"],
+            row["timestamp"],
+            row["corrects_message_id"],
+        )
+
+    def __getitem__(self, key: str):
+        if key not in _FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(_FIELDS)
+
+    def __len__(self) -> int:
+        return len(_FIELDS)
+
+    def __repr__(self) -> str:
+        return f"HistoryMessage(id={self.id}, role={self.role!r})"
+
+
+def load_history(
+    conn: sqlite3.Connection, conversation_id: int, known: list[HistoryMessage]
+) -> list[HistoryMessage]:
+    """``known`` (a cached prefix, oldest first) plus any newer messages."""
+    after = known[-1].id if known else 0
+    rows = conn.execute(
+        """
+        SELECT m.id, m.content, m.role, m.timestamp, m.corrects_message_id
+        FROM conversation_messages cm
+        JOIN messages m ON m.id = cm.message_id
+        WHERE cm.conversation_id = ? AND cm.message_id > ?
+        ORDER BY cm.message_id
+        """,
+        (conversation_id, after),
+    ).fetchall()
+    return known + [HistoryMessage.from_row(r) for r in rows]
+
+
+class HistoryCache:
+    """LRU of per-conversation message history, oldest message first.
+
+    Messages are immutable, so a cached history is always a correct prefix:
+    ``load_history`` only has to read what came after it. Insert paths load
+    the history inside their write transaction and ``put`` it once the
+    write has committed, so rolled-back rows never enter the cache and a
+    skipped ``put`` only leaves a shorter prefix. Used from the event loop
+    and the database threads, hence the lock.
+    """
+
+    def __init__(self, max_conversations: int = 64) -> None:
+        self.max_conversations = max(1, int(max_conversations))
+        self._entries: OrderedDict[int, list[HistoryMessage]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, conversation_id: int) -> bool:
+        with self._lock:
+            return conversation_id in self._entries
+
+    def get(self, conversation_id: int) -> list[HistoryMessage]:
+        """A copy of the cached prefix (empty on a miss)."""
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                self.misses += 1
+                return []
+            self._entries.move_to_end(conversation_id)
+            self.hits += 1
+            return list(entry)
+
+    def put(self, conversation_id: int, history: list[HistoryMessage]) -> None:
+        with self._lock:
+            current = self._entries.get(conversation_id)
+            # Never replace a longer prefix with an older snapshot.
+            if current and (not history or history[-1].id < current[-1].id):
+                return
+            self._entries[conversation_id] = list(history)
+            self._entries.move_to_end(conversation_id)
+            while len(self._entries) > self.max_conversations:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "conversations": len(self._entries),
+                "messages": sum(len(e) for e in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import logging
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+BASELINE_PATH = Path(__file__).with_name("schema.sql")
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    sql: str
+
+
+def _baseline() -> str:
+    return BASELINE_PATH.read_text(encoding="utf-8")
+
+
+# Append only: never edit a migration that has shipped, add a new one.
+# Version 1 is ``schema.sql`` itself; every statement in it is
+# ``IF NOT EXISTS`` so databases created before versioning upgrade cleanly.
+MIGRATIONS: list[Migration] = [
+    Migration(1, "baseline schema", ""),
+    Migration(
+        2,
+        "hot-path indexes",
+        """
+        -- Conversation history joins messages to conversation_messages by
+        -- message_id (the primary key only covers conversation_id first).
+        CREATE INDEX IF NOT EXISTS idx_conversation_messages_message
+        ON conversation_messages (message_id, conversation_id);
+
+        -- /events filters by type and/or conversation and reads newest
+        -- first; rowid order inside each index entry serves ORDER BY id DESC.
+        CREATE INDEX IF NOT EXISTS idx_events_type
+        ON events (type);
+        CREATE INDEX IF NOT EXISTS idx_events_conversation
+        ON events (conversation_id);
+        CREATE INDEX IF NOT EXISTS idx_events_conversation_type
+        ON events (conversation_id, type);
+
+        CREATE INDEX IF NOT EXISTS idx_preference_proposals_conversation_status
+        ON preference_proposals (conversation_id, status);
+
+        CREATE INDEX IF NOT EXISTS idx_conversation_summaries_conversation
+        ON conversation_summaries (conversation_id);
+        """,
+    ),
+    Migration(
+        3,
+        "conversation_stats projection",
+        """
+        -- Per-conversation counters for the sidebar, maintained by triggers.
+        -- A projection rather than history: rows are updated in place.
+        -- last_message_id is 0 until the conversation has a message.
+        CREATE TABLE IF NOT EXISTS conversation_stats (
+            conversation_id INTEGER PRIMARY KEY,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            last_message_id INTEGER NOT NULL DEFAULT 0,
+            last_message_at DATETIME,
+            last_role TEXT,
+            FOREIGN KEY (conversation_id) REFERENCES conversations(id)
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_conversation_stats_activity
+        ON conversation_stats (last_message_id, conversation_id);
+
+        CREATE TRIGGER IF NOT EXISTS conversation_stats_conversation_insert
+        AFTER INSERT ON conversations
+        BEGIN
+            INSERT OR IGNORE INTO conversation_stats (conversation_id) VALUES (new.id);
+        END;
+
+        -- Fires only for rows actually inserted (not for INSERT OR IGNORE
+        -- duplicates). Messages can be mapped out of id order (legacy
+        -- backfill), so "last" is the highest id, not the latest insert.
+        CREATE TRIGGER IF NOT EXISTS conversation_stats_message_insert
+        AFTER INSERT ON conversation_messages
+        BEGIN
+            INSERT OR IGNORE INTO conversation_stats (conversation_id) VALUES (new.conversation_id);
+            UPDATE conversation_stats
+            SET message_count = message_count + 1
+            WHERE conversation_id = new.conversation_id;
+            UPDATE conversation_stats
+            SET
+              last_message_id = new.message_id,
+              last_message_at = (SELECT timestamp FROM messages WHERE id = new.message_id),
+              last_role = (SELECT role FROM messages WHERE id = new.message_id)
+            WHERE conversation_id = new.conversation_id AND last_message_id < new.message_id;
+        END;
+
+        INSERT OR IGNORE INTO conversation_stats (conversation_id, message_count, last_message_id)
+        SELECT c.id, COUNT(cm.message_id), COALESCE(MAX(cm.message_id), 0)
+        FROM conversations c
+        LEFT JOIN conversation_messages cm ON cm.conversation_id = c.id
+        GROUP BY c.id;
+
+        UPDATE conversation_stats
+        SET
+          last_message_at = (SELECT timestamp FROM messages WHERE id = last_message_id),
+          last_role = (SELECT role FROM messages WHERE id = last_message_id)
+        WHERE last_message_id > 0;
+        """,
+    ),
+    Migration(
+        4,
+        "legacy conversation backfill",
+        """
+        -- Databases from before conversations existed: file every message
+        -- that has no conversation under the first one (created as
+        -- "Legacy" when there is none). Every insert path maps its message
+        -- in the same transaction, so this only ever needs to run once.
+        INSERT INTO conversations (title)
+        SELECT 'Legacy' WHERE NOT EXISTS (SELECT 1 FROM conversations);
+
+        INSERT OR IGNORE INTO conversation_messages (conversation_id, message_id)
+        SELECT (SELECT MIN(id) FROM conversations), m.id
+        FROM messages m
+        WHERE NOT EXISTS (
+            SELECT 1 FROM conversation_messages cm WHERE cm.message_id = m.id
+        )
+        ORDER BY m.id;
+        """,
+    ),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    return int(conn.execute("PRAGMA user_version").fetchone()[0])
+
+
+def migrate(conn: sqlite3.Connection, target: int = LATEST_VERSION) -> int:
+    """Apply pending migrations up to ``target``; returns the resulting version.
+
+    Each migration runs in its own transaction together with the
+    ``user_version`` bump, so a failed migration leaves the previous
+    version fully in place.
+    """
+    version = current_version(conn)
+    if version > LATEST_VERSION:
+        raise RuntimeError(
+            f"Database schema version {version} is newer than this build ({LATEST_VERSION})"
+        )
+    for migration in MIGRATIONS:
+        if migration.version <= version or migration.version > target:
+            continue
+        sql = migration.sql or _baseline()
+        try:
+            # executescript commits any open transaction before running.
+            conn.executescript(
+                f"BEGIN IMMEDIATE;\n{sql}\n;PRAGMA user_version = {migration.version};\nCOMMIT;"
+            )
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        logger.info("schema_migrated version=%s name=%s", migration.version, migration.name)
+        version = migration.version
+    return version
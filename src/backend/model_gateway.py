@@ -4,13 +4,22 @@ import json
 import os
 import hashlib
 import logging
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import AsyncGenerator
+from typing import AsyncGenerator, AsyncIterable, AsyncIterator
 import re
-
-import httpx
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import TYPE_CHECKING
 import asyncio
 
+if TYPE_CHECKING:
+    import httpx
+
+from .embedding_cache import EmbeddingStore, content_hash
+
 DEFAULT_MODEL_URL = "http://127.0.0.1:8080"
 
 
@@ -32,51 +41,71 @@ def _sha256_hex(text: str) -> str:
     return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
 
-BASE_SYSTEM_PROMPT = _load_base_system_prompt()
-BASE_SYSTEM_PROMPT_SHA256 = hashlib.sha256(BASE_SYSTEM_PROMPT_PATH.read_bytes()).hexdigest()
-EXPECTED_BASE_SYSTEM_PROMPT_SHA256 = _load_expected_base_prompt_sha256()
+@lru_cache(maxsize=1)
+def base_system_prompt() -> str:
+    return _load_base_system_prompt()
 
-if BASE_SYSTEM_PROMPT_SHA256 != EXPECTED_BASE_SYSTEM_PROMPT_SHA256:
-    raise RuntimeError(
-        "Base system prompt hash mismatch. "
-        f"expected={EXPECTED_BASE_SYSTEM_PROMPT_SHA256} actual={BASE_SYSTEM_PROMPT_SHA256} "
-        f"path={BASE_SYSTEM_PROMPT_PATH}"
+
+def verify_base_system_prompt() -> str:
+    """Check the base prompt against its pinned hash; returns the hash.
+
+    Called from the app's startup hook rather than at import, so importing
+    the backend (tests, scripts) does no file I/O.
+    """
+    actual = hashlib.sha256(BASE_SYSTEM_PROMPT_PATH.read_bytes()).hexdigest()
+    expected = _load_expected_base_prompt_sha256()
+    if actual != expected:
+        raise RuntimeError(
+            "Base system prompt hash mismatch. "
+            f"expected={expected} actual={actual} "
+            f"path={BASE_SYSTEM_PROMPT_PATH}"
+        )
+    logging.getLogger("mygpt").info(
+        "Base system prompt loaded sha256=%s path=%s",
+        actual,
+        str(BASE_SYSTEM_PROMPT_PATH),
     )
+    return actual
+
+
+def _httpx():
+    # httpx is only needed once the model is called; keep app import cheap.
+    import httpx
+
+    return httpx
 
-logging.getLogger("mygpt").info(
-    "Base system prompt loaded sha256=%s path=%s",
-    BASE_SYSTEM_PROMPT_SHA256,
-    str(BASE_SYSTEM_PROMPT_PATH),
-)
-
-
-def _assemble_prompt(messages: list[dict], preferences: dict[str, str] | None = None) -> str:
-    def _indent_block(text: str, prefix: str = "  ") -> str:
-        lines = str(text).splitlines()
-        if not lines:
-            return prefix
-        return "\n".join(prefix + line for line in lines)
-
-    def _sanitize_assistant_history(text: str) -> str:
-        # Keep assistant history as close as possible to what was said, but remove
-        # obvious transcript artifacts and reasoning wrappers that can cause the
-        # model to "continue the log" instead of answering.
-        s = str(text)
-        s = re.sub(r"\x1b\[[0-9;]*[A-Za-z]", "", s)
-        # Strip reasoning blocks, including cases where the close tag is missing due to truncation.
-        s = re.sub(r"<think>.*?(</think>|$)", "", s, flags=re.DOTALL)
-        s = re.sub(r"〈thinking〉.*?(〈/thinking〉|$)", "", s, flags=re.DOTALL)
-        s = re.sub(r"＜thinking＞.*?(＜/thinking＞|$)", "", s, flags=re.DOTALL)
-        lines = []
-        for line in s.splitlines():
-            if line.startswith("User:") or line.startswith("Assistant:") or line.startswith("System:"):
-                continue
-            lines.append(line)
-        return "\n".join(lines).strip()
 
+def _indent_block(text: str, prefix: str = "  ") -> str:
+    lines = str(text).splitlines()
+    if not lines:
+        return prefix
+    return "\n".join(prefix + line for line in lines)
+
+
+def _sanitize_assistant_history(text: str) -> str:
+    # Keep assistant history as close as possible to what was said, but remove
+    # obvious transcript artifacts and reasoning wrappers that can cause the
+    # model to "continue the log" instead of answering.
+    s = str(text)
+    s = re.sub(r"\x1b\[[0-9;]*[A-Za-z]", "", s)
+    # Strip reasoning blocks, including cases where the close tag is missing due to truncation.
+    s = re.sub(r"<think>.*?(</think>|$)", "", s, flags=re.DOTALL)
+    s = re.sub(r"〈thinking〉.*?(〈/thinking〉|$)", "", s, flags=re.DOTALL)
+    s = re.sub(r"＜thinking＞.*?(＜/thinking＞|$)", "", s, flags=re.DOTALL)
+    lines = []
+    for line in s.splitlines():
+        if line.startswith("User:") or line.startswith("Assistant:") or line.startswith("System:"):
+            continue
+        lines.append(line)
+    return "\n".join(lines).strip()
+
+
+def _system_block(
+    preferences: dict[str, str] | None = None, summary: str | None = None
+) -> list[str]:
     prompt_parts: list[str] = []
 
-    base = BASE_SYSTEM_PROMPT.rstrip()
+    base = base_system_prompt().rstrip()
     prompt_parts.append(f"System: {base.replace(chr(10), chr(10) + 'System: ')}")
     prompt_parts.append(
         "System: Reply as the assistant only. Do not write any 'User:' lines or simulate additional turns."
@@ -89,26 +118,143 @@ def _assemble_prompt(messages: list[dict], preferences: dict[str, str] | None =
         prompt_parts.append(
             f"System: Defaults (apply only when user did not specify otherwise): {defaults}"
         )
+    if summary:
+        prompt_parts.append("System: Summary of earlier turns in this conversation:")
+        prompt_parts.append(_indent_block(summary, prefix="System:   "))
+    return prompt_parts
 
-    for msg in messages:
-        role = msg.get("role")
-        content = msg.get("content", "")
-        if role == "user":
-            prompt_parts.append("User:")
-            prompt_parts.append(_indent_block(content))
-        elif role == "assistant":
-            cleaned = _sanitize_assistant_history(content)
-            if not cleaned:
-                continue
-            prompt_parts.append("Assistant:")
-            prompt_parts.append(_indent_block(cleaned))
 
+def _render_message(msg: dict) -> list[str]:
+    role = msg.get("role")
+    content = msg.get("content", "")
+    if role == "user":
+        return ["User:", _indent_block(content)]
+    if role == "assistant":
+        cleaned = _sanitize_assistant_history(content)
+        if not cleaned:
+            return []
+        return ["Assistant:", _indent_block(cleaned)]
+    return []
+
+
+def _assemble_prompt(
+    messages: list[dict],
+    preferences: dict[str, str] | None = None,
+    summary: str | None = None,
+) -> str:
+    prompt_parts = _system_block(preferences, summary)
+    for msg in messages:
+        prompt_parts.extend(_render_message(msg))
     prompt_parts.append("Assistant:")
     return "\n".join(prompt_parts) + " "
 
 
-def build_prompt(messages: list[dict], preferences: dict[str, str] | None = None) -> str:
-    return _assemble_prompt(messages, preferences=preferences)
+class _PromptCacheEntry:
+    __slots__ = ("key", "text", "count", "last_id")
+
+    def __init__(self, key: tuple, text: str, count: int, last_id: object) -> None:
+        self.key = key
+        self.text = text
+        self.count = count
+        self.last_id = last_id
+
+
+class PromptCache:
+    """Per-conversation cache of the assembled prompt prefix.
+
+    Messages are immutable and only ever appended to a conversation, so the
+    rendered prefix for messages ``[0, n)`` never changes. Each turn only the
+    new messages are sanitized and appended. An entry is rebuilt when its
+    system block inputs change or when the history is not an extension of
+    the cached one (e.g. regenerate drops the target message).
+    """
+
+    def __init__(self, max_entries: int = 64) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict[int, _PromptCacheEntry] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def build(
+        self,
+        conversation_id: int,
+        messages: list[dict],
+        preferences: dict[str, str] | None = None,
+        summary: str | None = None,
+        preferences_version: int | None = None,
+    ) -> str:
+        # A known preferences version stands in for comparing the dict itself.
+        prefs_key = (
+            preferences_version
+            if preferences_version is not None
+            else tuple(sorted((preferences or {}).items()))
+        )
+        key = (prefs_key, summary)
+        entry = self._entries.get(conversation_id)
+        if (
+            entry is not None
+            and entry.key == key
+            and 0 < entry.count <= len(messages)
+            and messages[entry.count - 1].get("id") == entry.last_id
+        ):
+            self.hits += 1
+            new_parts: list[str] = []
+            for msg in messages[entry.count :]:
+                new_parts.extend(_render_message(msg))
+            if new_parts:
+                entry.text = entry.text + "\n" + "\n".join(new_parts)
+        else:
+            self.misses += 1
+            parts = _system_block(preferences, summary)
+            for msg in messages:
+                parts.extend(_render_message(msg))
+            entry = _PromptCacheEntry(key, "\n".join(parts), 0, None)
+            self._entries[conversation_id] = entry
+
+        entry.count = len(messages)
+        entry.last_id = messages[-1].get("id") if messages else None
+        self._entries.move_to_end(conversation_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry.text + "\nAssistant: "
+
+    def invalidate(self, conversation_id: int | None = None) -> None:
+        if conversation_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(conversation_id, None)
+
+    def metrics(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+_PROMPT_CACHE = PromptCache(int(os.getenv("MYGPT_PROMPT_CACHE_SIZE", "64")))
+
+
+def invalidate_prompt_cache(conversation_id: int | None = None) -> None:
+    _PROMPT_CACHE.invalidate(conversation_id)
+
+
+def prompt_cache_metrics() -> dict:
+    return _PROMPT_CACHE.metrics()
+
+
+def build_prompt(
+    messages: list[dict],
+    preferences: dict[str, str] | None = None,
+    conversation_id: int | None = None,
+    summary: str | None = None,
+    preferences_version: int | None = None,
+) -> str:
+    if conversation_id is None or not messages or messages[-1].get("id") is None:
+        return _assemble_prompt(messages, preferences=preferences, summary=summary)
+    return _PROMPT_CACHE.build(
+        conversation_id,
+        messages,
+        preferences=preferences,
+        summary=summary,
+        preferences_version=preferences_version,
+    )
 
 
 def _default_stop_sequences() -> list[str]:
@@ -148,69 +294,1444 @@ async def _fallback_generate(messages: list[dict]) -> AsyncGenerator[str, None]:
         await asyncio.sleep(delay_s)
 
 
+class ModelClient:
+    """Pooled keep-alive HTTP clients for the model server(s).
+
+    One ``httpx.AsyncClient`` is kept per model URL so connections are reused
+    across chat turns instead of paying a TCP handshake per request. The
+    client is owned by the app lifespan; ``retarget`` retires pools for URLs
+    that are no longer in use once their in-flight streams finish.
+    """
+
+    def __init__(
+        self,
+        *,
+        connect_timeout_s: float | None = None,
+        read_timeout_s: float | None = None,
+        max_connections: int | None = None,
+        max_keepalive: int | None = None,
+        keepalive_expiry_s: float | None = None,
+    ) -> None:
+        self.connect_timeout_s = connect_timeout_s if connect_timeout_s is not None else float(
+            os.getenv("MYGPT_MODEL_CONNECT_TIMEOUT_S", "2.0")
+        )
+        # Token streams can legitimately pause for a long time during prompt
+        # evaluation, so the read timeout is generous (0 disables it).
+        read_timeout = read_timeout_s if read_timeout_s is not None else float(
+            os.getenv("MYGPT_MODEL_READ_TIMEOUT_S", "300")
+        )
+        self.read_timeout_s = read_timeout if read_timeout > 0 else None
+        self.max_connections = max_connections or int(os.getenv("MYGPT_MODEL_MAX_CONNECTIONS", "8"))
+        self.max_keepalive = max_keepalive or int(os.getenv("MYGPT_MODEL_MAX_KEEPALIVE", "4"))
+        self.keepalive_expiry_s = keepalive_expiry_s if keepalive_expiry_s is not None else float(
+            os.getenv("MYGPT_MODEL_KEEPALIVE_EXPIRY_S", "60")
+        )
+        self._clients: dict[str, httpx.AsyncClient] = {}
+        self._retired: dict[str, httpx.AsyncClient] = {}
+        self._in_flight: dict[str, int] = {}
+        self._requests_total = 0
+        self._errors_total = 0
+        self._clients_created = 0
+
+    def _build(self) -> httpx.AsyncClient:
+        self._clients_created += 1
+        httpx = _httpx()
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                connect=self.connect_timeout_s,
+                read=self.read_timeout_s,
+                write=self.connect_timeout_s,
+                pool=self.connect_timeout_s,
+            ),
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=self.keepalive_expiry_s,
+            ),
+        )
+
+    def client_for(self, model_url: str) -> httpx.AsyncClient:
+        key = model_url.rstrip("/")
+        client = self._clients.get(key)
+        if client is None:
+            client = self._retired.pop(key, None) or self._build()
+            self._clients[key] = client
+        return client
+
+    async def retarget(self, model_url: str) -> None:
+        """Retire pools for every URL not listed in ``model_url``."""
+        keep = set(parse_model_urls(model_url))
+        for key in [k for k in self._clients if k not in keep]:
+            self._retired[key] = self._clients.pop(key)
+            await self._close_if_idle(key)
+
+    async def _close_if_idle(self, key: str) -> None:
+        if self._in_flight.get(key, 0) > 0:
+            return
+        client = self._retired.pop(key, None)
+        if client is not None:
+            await client.aclose()
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        key = _base_url(url)
+        client = self.client_for(key)
+        self._requests_total += 1
+        self._in_flight[key] = self._in_flight.get(key, 0) + 1
+        try:
+            async with client.stream(method, url, **kwargs) as resp:
+                yield resp
+        except Exception:
+            self._errors_total += 1
+            raise
+        finally:
+            self._in_flight[key] -= 1
+            if key in self._retired:
+                await self._close_if_idle(key)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        key = _base_url(url)
+        self._requests_total += 1
+        try:
+            return await self.client_for(key).get(url, **kwargs)
+        except Exception:
+            self._errors_total += 1
+            raise
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        key = _base_url(url)
+        self._requests_total += 1
+        try:
+            return await self.client_for(key).post(url, **kwargs)
+        except Exception:
+            self._errors_total += 1
+            raise
+
+    async def aclose(self) -> None:
+        clients = list(self._clients.values()) + list(self._retired.values())
+        self._clients.clear()
+        self._retired.clear()
+        for client in clients:
+            await client.aclose()
+
+    def metrics(self) -> dict:
+        pools = {}
+        for key, client in list(self._clients.items()) + list(self._retired.items()):
+            connections = _pool_connections(client)
+            pools[key] = {
+                "retired": key in self._retired,
+                "in_flight": self._in_flight.get(key, 0),
+                "connections": len(connections),
+                "idle_connections": sum(1 for c in connections if c.is_idle()),
+            }
+        return {
+            "requests_total": self._requests_total,
+            "errors_total": self._errors_total,
+            "clients_created": self._clients_created,
+            "connect_timeout_s": self.connect_timeout_s,
+            "read_timeout_s": self.read_timeout_s,
+            "max_connections": self.max_connections,
+            "max_keepalive": self.max_keepalive,
+            "pools": pools,
+        }
+
+
+def _base_url(url: str) -> str:
+    parsed = _httpx().URL(url)
+    port = f":{parsed.port}" if parsed.port else ""
+    return f"{parsed.scheme}://{parsed.host}{port}"
+
+
+def _pool_connections(client: httpx.AsyncClient) -> list:
+    # httpx does not expose pool stats publicly; read them defensively.
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    return list(getattr(pool, "connections", []) or [])
+
+
+_MODEL_CLIENT: ModelClient | None = None
+
+
+def get_model_client() -> ModelClient | None:
+    return _MODEL_CLIENT
+
+
+async def start_model_client(model_url: str | None = None) -> ModelClient:
+    global _MODEL_CLIENT
+    if _MODEL_CLIENT is None:
+        _MODEL_CLIENT = ModelClient()
+    for url in parse_model_urls(model_url):
+        _MODEL_CLIENT.client_for(url)
+    return _MODEL_CLIENT
+
+
+async def stop_model_client() -> None:
+    global _MODEL_CLIENT
+    client, _MODEL_CLIENT = _MODEL_CLIENT, None
+    if client is not None:
+        await client.aclose()
+
+
+@asynccontextmanager
+async def _model_client() -> AsyncIterator[ModelClient]:
+    # Outside the app lifespan (scripts, tests) fall back to a short-lived client.
+    shared = get_model_client()
+    if shared is not None:
+        yield shared
+        return
+    client = ModelClient()
+    try:
+        yield client
+    finally:
+        await client.aclose()
+
+
+async def check_health(model_url: str, timeout_s: float = 2.0) -> bool:
+    url = f"{model_url.rstrip('/')}/health"
+    try:
+        async with _model_client() as client:
+            resp = await client.get(url, timeout=timeout_s)
+        return resp.status_code == 200
+    except Exception:
+        return False
+
+
+class SlotAffinity:
+    """Pins conversations to llama-server slots so each keeps its KV cache.
+
+    llama-server only reuses a cached prompt prefix when the request lands on
+    the slot that evaluated it. Conversations are assigned to the least
+    recently used idle slot (the least busy one if none is idle) and keep
+    that slot until it is handed to another conversation. ``acquire`` and
+    ``release`` bracket each request so busy slots are known.
+    """
+
+    def __init__(self, n_slots: int) -> None:
+        self.n_slots = max(0, int(n_slots))
+        self._by_conversation: OrderedDict[int, int] = OrderedDict()
+        self._slot_order: OrderedDict[int, None] = OrderedDict((i, None) for i in range(self.n_slots))
+        self._in_flight = [0] * self.n_slots
+
+    def slot_for(self, conversation_id: int | None) -> int | None:
+        if conversation_id is None or self.n_slots <= 0:
+            return None
+        slot = self._by_conversation.get(conversation_id)
+        if slot is None:
+            # min() keeps LRU order among equally busy slots.
+            slot = min(self._slot_order, key=lambda s: self._in_flight[s])
+            for conv, owned in list(self._by_conversation.items()):
+                if owned == slot:
+                    del self._by_conversation[conv]
+            self._by_conversation[conversation_id] = slot
+        self._by_conversation.move_to_end(conversation_id)
+        self._slot_order.move_to_end(slot)
+        return slot
+
+    def acquire(self, slot: int | None) -> None:
+        if slot is not None:
+            self._in_flight[slot] += 1
+
+    def release(self, slot: int | None) -> None:
+        if slot is not None:
+            self._in_flight[slot] = max(0, self._in_flight[slot] - 1)
+
+    def snapshot(self) -> dict:
+        return {
+            "n_slots": self.n_slots,
+            "assignments": {str(k): v for k, v in self._by_conversation.items()},
+            "in_flight": list(self._in_flight),
+        }
+
+
+def _default_parallel() -> int:
+    # Parsed like the app's ``_llama_parallel``: a bad value falls back to
+    # the default instead of failing the import.
+    try:
+        return max(0, int(os.getenv("MYGPT_LLAMA_PARALLEL", "").strip() or 2))
+    except ValueError:
+        return 2
+
+
+_SLOT_COUNT = _default_parallel()
+_SLOT_AFFINITIES: dict[str, SlotAffinity] = {}
+
+
+def _slot_affinity(endpoint_url: str) -> SlotAffinity:
+    affinity = _SLOT_AFFINITIES.get(endpoint_url)
+    if affinity is None:
+        affinity = _SLOT_AFFINITIES[endpoint_url] = SlotAffinity(_SLOT_COUNT)
+    return affinity
+
+
+def configure_slots(n_slots: int) -> None:
+    """Match slot affinity to the server's ``--parallel`` count."""
+    global _SLOT_COUNT
+    if n_slots != _SLOT_COUNT:
+        _SLOT_COUNT = n_slots
+        _SLOT_AFFINITIES.clear()
+
+
+def slot_metrics() -> dict:
+    return {
+        "n_slots": _SLOT_COUNT,
+        "endpoints": {url: a.snapshot()["assignments"] for url, a in _SLOT_AFFINITIES.items()},
+    }
+
+
+def parse_model_urls(value: str | list | None) -> list[str]:
+    """Split a model URL setting into endpoints.
+
+    ``MYGPT_MODEL_URL`` and ``model_url`` in models.json accept a single URL,
+    a comma/whitespace separated list, or (models.json only) a JSON list.
+    """
+
+    if value is None:
+        return []
+    items = value if isinstance(value, list) else re.split(r"[,\s]+", str(value))
+    urls: list[str] = []
+    for item in items:
+        url = str(item).strip().rstrip("/")
+        if url and url not in urls:
+            urls.append(url)
+    return urls
+
+
+class Endpoint:
+    __slots__ = (
+        "url", "outstanding", "requests_total", "failures_total", "ejected_until", "needs_probe"
+    )
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.outstanding = 0
+        self.requests_total = 0
+        self.failures_total = 0
+        self.ejected_until = 0.0
+        # Set on ejection; cleared only by a passing /health probe.
+        self.needs_probe = False
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.ejected_until and not self.needs_probe
+
+    def eject(self, eject_s: float) -> None:
+        self.ejected_until = time.monotonic() + eject_s
+        self.needs_probe = True
+
+
+class EndpointPool:
+    """Routes generations across one or more llama-server instances.
+
+    New conversations go to the endpoint with the fewest outstanding
+    requests; a conversation then sticks to its endpoint (and that server's
+    KV cache) unless it is ejected or more than ``sticky_slack`` requests
+    busier than the least loaded one. Endpoints that fail are ejected for
+    ``eject_s`` and must pass ``/health`` before they are used again (a
+    single-endpoint pool just retries). Probes only happen on demand, when
+    an ejection has expired, never in the background.
+    """
+
+    def __init__(
+        self,
+        urls: list[str],
+        *,
+        eject_s: float | None = None,
+        sticky_slack: int | None = None,
+        max_sticky: int = 4096,
+    ) -> None:
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.eject_s = eject_s if eject_s is not None else float(os.getenv("MYGPT_ENDPOINT_EJECT_S", "15"))
+        self.sticky_slack = sticky_slack if sticky_slack is not None else int(
+            os.getenv("MYGPT_ENDPOINT_STICKY_SLACK", "2")
+        )
+        self.max_sticky = max_sticky
+        self._sticky: OrderedDict[int, Endpoint] = OrderedDict()
+
+    @property
+    def urls(self) -> list[str]:
+        return [e.url for e in self.endpoints]
+
+    async def _readmit(self, endpoint: Endpoint) -> bool:
+        # A single-endpoint pool is always tried directly; the request itself
+        # is the health check and the caller falls back on failure.
+        if len(self.endpoints) == 1 or await check_health(endpoint.url, timeout_s=1.0):
+            endpoint.ejected_until = 0.0
+            endpoint.needs_probe = False
+            return True
+        endpoint.eject(self.eject_s)
+        return False
+
+    async def choose(
+        self, conversation_id: int | None = None, exclude: set[str] | None = None
+    ) -> Endpoint | None:
+        exclude = exclude or set()
+        now = time.monotonic()
+        candidates = [e for e in self.endpoints if e.url not in exclude]
+        # An expired ejection is not enough: the endpoint must pass /health.
+        probed = [e for e in candidates if e.needs_probe and now >= e.ejected_until]
+        for endpoint in probed:
+            await self._readmit(endpoint)
+        healthy = [e for e in candidates if e.healthy(now)]
+        if not healthy:
+            # Every endpoint is ejected: try the one whose ejection ends first.
+            waiting = [e for e in candidates if e not in probed]
+            for endpoint in sorted(waiting, key=lambda e: e.ejected_until):
+                if await self._readmit(endpoint):
+                    healthy = [endpoint]
+                    break
+        if not healthy:
+            return None
+
+        least = min(healthy, key=lambda e: e.outstanding)
+        chosen = least
+        sticky = self._sticky.get(conversation_id) if conversation_id is not None else None
+        if sticky is not None and sticky in healthy:
+            if sticky.outstanding <= least.outstanding + self.sticky_slack:
+                chosen = sticky
+        if conversation_id is not None:
+            self._sticky[conversation_id] = chosen
+            self._sticky.move_to_end(conversation_id)
+            while len(self._sticky) > self.max_sticky:
+                self._sticky.popitem(last=False)
+        return chosen
+
+    def acquire(self, endpoint: Endpoint) -> None:
+        endpoint.outstanding += 1
+        endpoint.requests_total += 1
+
+    def release(self, endpoint: Endpoint, *, failed: bool = False) -> None:
+        endpoint.outstanding = max(0, endpoint.outstanding - 1)
+        if failed:
+            endpoint.failures_total += 1
+            endpoint.eject(self.eject_s)
+
+    def primary_url(self) -> str | None:
+        now = time.monotonic()
+        for endpoint in self.endpoints:
+            if endpoint.healthy(now):
+                return endpoint.url
+        return self.endpoints[0].url if self.endpoints else None
+
+    def metrics(self) -> dict:
+        now = time.monotonic()
+        return {
+            e.url: {
+                "outstanding": e.outstanding,
+                "requests_total": e.requests_total,
+                "failures_total": e.failures_total,
+                "ejected_for_s": round(max(0.0, e.ejected_until - now), 2),
+            }
+            for e in self.endpoints
+        }
+
+
+_ENDPOINT_POOLS: dict[tuple[str, ...], EndpointPool] = {}
+
+
+def endpoint_pool(model_url: str | None = None) -> EndpointPool:
+    urls = parse_model_urls(model_url or os.getenv("MYGPT_MODEL_URL", DEFAULT_MODEL_URL))
+    key = tuple(urls)
+    pool = _ENDPOINT_POOLS.get(key)
+    if pool is None:
+        pool = _ENDPOINT_POOLS[key] = EndpointPool(urls)
+    return pool
+
+
+def endpoint_metrics(model_url: str | None = None) -> dict:
+    return endpoint_pool(model_url).metrics()
+
+
+def _n_predict() -> int:
+    return int(os.getenv("MYGPT_N_PREDICT", "256"))
+
+
+@dataclass(frozen=True)
+class ContextFit:
+    messages: list[dict]
+    included_ids: list
+    dropped_count: int
+    prompt_tokens: int
+    budget_tokens: int
+    token_source: str
+
+    def as_payload(self) -> dict:
+        return {
+            "included_message_ids": self.included_ids,
+            "dropped_count": self.dropped_count,
+            "prompt_tokens": self.prompt_tokens,
+            "budget_tokens": self.budget_tokens,
+            "token_source": self.token_source,
+        }
+
+
+class ContextWindow:
+    """Fits conversation history plus ``n_predict`` into the model context.
+
+    Token counts come from llama-server's ``/tokenize`` and are cached per
+    message (messages are immutable, so a count never goes stale). When the
+    server cannot tokenize, a conservative bytes-based estimate is used and
+    the server is not asked again until ``retry_s`` has passed.
+
+    The oldest turns are dropped first. Once a conversation overflows, the
+    window start only moves forward in steps that bring usage down to
+    ``low_water`` of the budget, so the prompt prefix stays byte-stable for
+    several turns and the server's KV cache keeps hitting.
+    """
+
+    def __init__(
+        self,
+        *,
+        ctx_size: int | None = None,
+        margin_tokens: int | None = None,
+        low_water: float | None = None,
+        retry_s: float = 30.0,
+        max_cached_counts: int = 20_000,
+    ) -> None:
+        self.ctx_size = ctx_size
+        self.margin_tokens = margin_tokens if margin_tokens is not None else int(
+            os.getenv("MYGPT_CONTEXT_MARGIN_TOKENS", "32")
+        )
+        self.low_water = low_water if low_water is not None else float(
+            os.getenv("MYGPT_CONTEXT_LOW_WATER", "0.75")
+        )
+        self.retry_s = retry_s
+        self.max_cached_counts = max_cached_counts
+        self._counts: OrderedDict[tuple, int] = OrderedDict()
+        self._window_start: OrderedDict[int, object] = OrderedDict()
+        self._server_down_until = 0.0
+
+    def context_tokens(self) -> int:
+        if self.ctx_size is not None:
+            return self.ctx_size
+        override = os.getenv("MYGPT_CONTEXT_TOKENS", "").strip()
+        if override:
+            return int(override)
+        # llama-server splits --ctx-size evenly across its --parallel slots.
+        ctx_size = int(os.getenv("MYGPT_LLAMA_CTX_SIZE", "4096"))
+        return ctx_size // max(1, _SLOT_COUNT)
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        # Roughly 3 bytes per token errs on the side of overcounting.
+        return len(text.encode("utf-8")) // 3 + 1
+
+    async def _tokenize(self, text: str, model_url: str | None) -> int | None:
+        if model_url is None or time.monotonic() < self._server_down_until:
+            return None
+        endpoint_url = endpoint_pool(model_url).primary_url()
+        if endpoint_url is None:
+            return None
+        try:
+            async with _model_client() as client:
+                resp = await client.post(
+                    f"{endpoint_url}/tokenize", json={"content": text}, timeout=2.0
+                )
+            resp.raise_for_status()
+            return len(resp.json()["tokens"])
+        except Exception:
+            self._server_down_until = time.monotonic() + self.retry_s
+            return None
+
+    async def count_tokens(
+        self, text: str, *, model_url: str | None = None, key: object = None
+    ) -> tuple[int, str]:
+        cache_key = (model_url, key if key is not None else _sha256_hex(text))
+        cached = self._counts.get(cache_key)
+        if cached is not None:
+            self._counts.move_to_end(cache_key)
+            return cached, "cache"
+        count = await self._tokenize(text, model_url)
+        if count is None:
+            return self.estimate_tokens(text), "estimate"
+        self._counts[cache_key] = count
+        while len(self._counts) > self.max_cached_counts:
+            self._counts.popitem(last=False)
+        return count, "server"
+
+    async def fit(
+        self,
+        messages: list[dict],
+        preferences: dict[str, str] | None = None,
+        *,
+        conversation_id: int | None = None,
+        model_url: str | None = None,
+        n_predict: int | None = None,
+        summary: str | None = None,
+    ) -> ContextFit:
+        sources: set[str] = set()
+        system_text = "\n".join(_system_block(preferences, summary)) + "\nAssistant: "
+        system_tokens, source = await self.count_tokens(system_text, model_url=model_url)
+        sources.add(source)
+        budget = (
+            self.context_tokens()
+            - (n_predict if n_predict is not None else _n_predict())
+            - system_tokens
+            - self.margin_tokens
+        )
+
+        # Count from the newest message backwards; older turns are only
+        # tokenized while they can still fit.
+        costs: list[int] = []
+        total = 0
+        for msg in reversed(messages):
+            text = "\n".join(_render_message(msg))
+            cost = 0
+            if text:
+                cost, source = await self.count_tokens(
+                    text + "\n", model_url=model_url, key=msg.get("id")
+                )
+                sources.add(source)
+            costs.append(cost)
+            total += cost
+            if total > budget and len(costs) > 1:
+                break
+        costs.reverse()
+        n_counted = len(costs)
+        offset = len(messages) - n_counted
+
+        start = offset if total > budget and n_counted > 1 else 0
+        if start > 0:
+            # Overflow: keep the previous window start if it still fits,
+            # otherwise advance far enough to leave headroom.
+            previous = self._window_start.get(conversation_id) if conversation_id is not None else None
+            prev_idx = -1
+            if previous is not None:
+                for idx in range(len(messages) - 1, start, -1):
+                    if messages[idx].get("id") == previous:
+                        prev_idx = idx
+                        break
+            if prev_idx > start:
+                start, target = prev_idx, budget
+            else:
+                target = int(budget * self.low_water)
+            remaining = sum(costs[start - offset :])
+            while remaining > target and start < len(messages) - 1:
+                remaining -= costs[start - offset]
+                start += 1
+            # Start the window on a user turn when possible.
+            while start < len(messages) - 1 and messages[start].get("role") != "user":
+                remaining -= costs[start - offset]
+                start += 1
+            total = remaining
+
+        selected = messages[start:]
+        if conversation_id is not None:
+            if start > 0:
+                self._window_start[conversation_id] = selected[0].get("id")
+                self._window_start.move_to_end(conversation_id)
+                while len(self._window_start) > 1024:
+                    self._window_start.popitem(last=False)
+            else:
+                self._window_start.pop(conversation_id, None)
+
+        if "estimate" in sources:
+            token_source = "estimate"
+        elif "server" in sources:
+            token_source = "server"
+        else:
+            token_source = "cache"
+        return ContextFit(
+            messages=selected,
+            included_ids=[m.get("id") for m in selected],
+            dropped_count=start,
+            prompt_tokens=system_tokens + total,
+            budget_tokens=budget + system_tokens,
+            token_source=token_source,
+        )
+
+
+_CONTEXT_WINDOW = ContextWindow()
+
+
+async def fit_context(
+    messages: list[dict],
+    preferences: dict[str, str] | None = None,
+    *,
+    conversation_id: int | None = None,
+    model_url: str | None = None,
+    summary: str | None = None,
+) -> ContextFit:
+    return await _CONTEXT_WINDOW.fit(
+        messages,
+        preferences,
+        conversation_id=conversation_id,
+        model_url=model_url,
+        summary=summary,
+    )
+
+
+def _summary_prompt(previous_summary: str | None, messages: list[dict]) -> str:
+    parts = [
+        "System: You maintain a running summary of a conversation between a user and an assistant.",
+        "System: Merge the previous summary with the new turns into one compact summary.",
+        "System: Keep facts, decisions, open questions and user instructions. Do not add anything new.",
+    ]
+    if previous_summary:
+        parts.append("Previous summary:")
+        parts.append(_indent_block(previous_summary))
+    parts.append("New turns:")
+    for msg in messages:
+        parts.extend(_render_message(msg))
+    parts.append("Summary:")
+    return "\n".join(parts) + " "
+
+
+async def summarize(
+    messages: list[dict],
+    previous_summary: str | None = None,
+    model_url: str | None = None,
+) -> str:
+    """Condense ``messages`` (and an optional earlier summary) via the model.
+
+    Unlike ``generate`` there is no echo fallback: an unreachable server
+    raises, so callers never persist a placeholder as a summary.
+    """
+
+    pool = endpoint_pool(model_url)
+    endpoint = await pool.choose()
+    if endpoint is None:
+        raise RuntimeError("No model endpoint available")
+    payload = {
+        "prompt": _summary_prompt(previous_summary, messages),
+        "stream": False,
+        "n_predict": int(os.getenv("MYGPT_SUMMARY_N_PREDICT", "256")),
+        "reasoning_format": "none",
+        "cache_prompt": False,
+        "stop": _default_stop_sequences(),
+    }
+    pool.acquire(endpoint)
+    failed = False
+    try:
+        async with _model_client() as client:
+            resp = await client.post(f"{endpoint.url}/completion", json=payload)
+        resp.raise_for_status()
+    except Exception as exc:
+        failed = _endpoint_failed(exc)
+        raise
+    finally:
+        pool.release(endpoint, failed=failed)
+    text = _sanitize_assistant_history(str(resp.json().get("content", "")))
+    if not text:
+        raise ValueError("Model returned an empty summary")
+    return text
+
+
+_SAMPLING_ENV = {
+    "temperature": ("MYGPT_TEMPERATURE", float),
+    "top_k": ("MYGPT_TOP_K", int),
+    "top_p": ("MYGPT_TOP_P", float),
+    "min_p": ("MYGPT_MIN_P", float),
+    "repeat_penalty": ("MYGPT_REPEAT_PENALTY", float),
+    "seed": ("MYGPT_SEED", int),
+}
+
+
+def generation_params() -> dict:
+    """Request fields that shape the completion, apart from the prompt.
+
+    Sampling fields are only sent when configured so the server's own
+    defaults apply otherwise.
+    """
+
+    params: dict = {"n_predict": _n_predict()}
+
+    # llama.cpp server supports disabling "reasoning" wrappers for some models.
+    # Default to "none" to avoid verbose 〈thinking〉 blocks consuming output tokens.
+    params["reasoning_format"] = os.getenv("MYGPT_REASONING_FORMAT", "none").strip() or "none"
+    params["reasoning_in_content"] = os.getenv("MYGPT_REASONING_IN_CONTENT", "false").strip().lower() == "true"
+
+    stop_env = os.getenv("MYGPT_STOP_SEQS", "").strip()
+    stop_seqs = _parse_stop_sequences(stop_env) if stop_env else _default_stop_sequences()
+    if stop_seqs:
+        params["stop"] = stop_seqs
+
+    for field, (env_name, cast) in _SAMPLING_ENV.items():
+        raw = os.getenv(env_name, "").strip()
+        if raw:
+            params[field] = cast(raw)
+    return params
+
+
+def sampling_is_deterministic(params: dict) -> bool:
+    # Server default temperature is non-zero, so unset means stochastic.
+    temperature = params.get("temperature")
+    return (temperature is not None and temperature <= 0) or params.get("top_k") == 1
+
+
+class _PatternMatcher:
+    """Aho-Corasick automaton over a few literal patterns, fed one char at a time.
+
+    ``depth`` is the length of the longest suffix of the input so far that
+    is still a prefix of some pattern: those characters may yet turn out
+    to be a match, so streaming filters hold them back.
+    """
+
+    def __init__(self, patterns: list[str]) -> None:
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail = [0]
+        self._out: list[str | None] = [None]
+        self._depth = [0]
+        for pattern in patterns:
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(None)
+                    self._depth.append(self._depth[state] + 1)
+                state = nxt
+            self._out[state] = pattern
+        queue = list(self._goto[0].values())
+        while queue:
+            state = queue.pop(0)
+            for ch, nxt in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                if self._out[nxt] is None:
+                    self._out[nxt] = self._out[self._fail[nxt]]
+                queue.append(nxt)
+        self.state = 0
+
+    @property
+    def depth(self) -> int:
+        return self._depth[self.state]
+
+    def step(self, ch: str) -> str | None:
+        """Advance by one char; returns the pattern that ends here, if any."""
+        state = self.state
+        while state and ch not in self._goto[state]:
+            state = self._fail[state]
+        self.state = self._goto[state].get(ch, 0)
+        return self._out[self.state]
+
+    def reset(self) -> None:
+        self.state = 0
+
+
+_REASONING_WRAPPERS = {
+    "<think>": "</think>",
+    "〈thinking〉": "〈/thinking〉",
+    "＜thinking＞": "＜/thinking＞",
+}
+_ANSI_START = "\x1b["
+_ROLE_MARKERS = ["\nUser:", "\nSystem:", "\nAssistant:"]
+
+
+class _ReasoningFilter:
+    """Drops reasoning blocks and ANSI escape sequences as text streams.
+
+    A close tag without an open one means the model started inside a
+    reasoning block (the template opened it), so everything before it is
+    reasoning too: it is discarded and ``resets`` is bumped. If nothing
+    visible is left at the end, the reasoning itself is the answer.
+    """
+
+    _CLOSERS = set(_REASONING_WRAPPERS.values())
+
+    def __init__(self) -> None:
+        self._matcher = _PatternMatcher(
+            [*_REASONING_WRAPPERS, *_REASONING_WRAPPERS.values(), _ANSI_START]
+        )
+        self._held: list[str] = []
+        self._inside: str | None = None
+        self._ansi: str | None = None
+        self._out: list[str] = []
+        self._visible: list[str] = []
+        self._reasoning: list[str] = []
+        self.resets = 0
+
+    def _release(self, chars) -> None:
+        if self._inside is not None:
+            self._reasoning.extend(chars)
+        else:
+            self._out.extend(chars)
+            self._visible.extend(chars)
+
+    def _on_match(self, pattern: str) -> None:
+        self._held.clear()
+        self._matcher.reset()
+        if self._inside is not None:
+            if pattern == self._inside:
+                self._inside = None
+            return
+        if pattern in _REASONING_WRAPPERS:
+            self._inside = _REASONING_WRAPPERS[pattern]
+        elif pattern in self._CLOSERS:
+            self._reasoning.extend(self._visible)
+            self._visible.clear()
+            self._out.clear()
+            self.resets += 1
+        else:
+            self._ansi = pattern
+
+    def feed(self, text: str) -> str:
+        self._out = []
+        for ch in text:
+            if self._ansi is not None:
+                if ch.isdigit() or ch == ";":
+                    self._ansi += ch
+                    continue
+                sequence, self._ansi = self._ansi, None
+                if ch.isascii() and ch.isalpha():
+                    continue
+                self._release(sequence)
+            self._held.append(ch)
+            pattern = self._matcher.step(ch)
+            if pattern is not None:
+                self._on_match(pattern)
+                continue
+            excess = len(self._held) - self._matcher.depth
+            if excess > 0:
+                self._release(self._held[:excess])
+                del self._held[:excess]
+        return "".join(self._out)
+
+    def finish(self) -> str:
+        self._out = []
+        if self._ansi is not None:
+            self._release(self._ansi)
+            self._ansi = None
+        self._release(self._held)
+        self._held.clear()
+        if not "".join(self._visible).strip() and self._reasoning:
+            self._out = list(self._reasoning)
+            self._visible = list(self._reasoning)
+            self.resets += 1
+        return "".join(self._out)
+
+
+class _RoleFilter:
+    """Strips a leading ``Assistant:`` and stops at the first role header.
+
+    A line starting with ``User:``/``System:``/``Assistant:`` after the
+    answer began is the model writing the next turn itself.
+    """
+
+    _PREFIX = "Assistant:"
+
+    def __init__(self) -> None:
+        self._matcher = _PatternMatcher(_ROLE_MARKERS)
+        self.reset()
+
+    def reset(self) -> None:
+        self._matcher.reset()
+        self._held: list[str] = []
+        self._lead = ""
+        self._leading = True
+        self._prefix_done = False
+        self._visible: list[str] = []
+        self.stopped = False
+
+    def _body(self, ch: str, out: list[str]) -> None:
+        self._held.append(ch)
+        if self._matcher.step(ch) is not None:
+            self._held.clear()
+            self.stopped = True
+            return
+        excess = len(self._held) - self._matcher.depth
+        if excess > 0:
+            out.extend(self._held[:excess])
+            del self._held[:excess]
+
+    def feed(self, text: str) -> str:
+        out: list[str] = []
+        for ch in text:
+            if self.stopped:
+                break
+            if self._leading:
+                if not self._lead and ch.isspace():
+                    continue
+                self._lead += ch
+                if not self._prefix_done and self._PREFIX.startswith(self._lead):
+                    if self._lead == self._PREFIX:
+                        self._lead = ""
+                        self._prefix_done = True
+                    continue
+                self._leading = False
+                lead, self._lead = self._lead, ""
+                for c in lead:
+                    self._body(c, out)
+                continue
+            self._body(ch, out)
+        self._visible.extend(out)
+        return "".join(out)
+
+    def finish(self) -> str:
+        out: list[str] = []
+        if not self.stopped:
+            out.extend(self._lead)
+            out.extend(self._held)
+        self._lead = ""
+        self._held.clear()
+        self._visible.extend(out)
+        return "".join(out)
+
+    @property
+    def text(self) -> str:
+        return "".join(self._visible).strip()
+
+
+class RepetitionDetector:
+    """Flags a stream stuck in a loop.
+
+    Keeps a rolling hash of the last ``ngram`` tokens and counts each
+    n-gram over the last ``window`` tokens; once any n-gram has been seen
+    ``max_repeats`` times the output is degenerate. O(1) per token.
+    """
+
+    _BASE = 1_000_003
+    _MOD = (1 << 61) - 1
+
+    def __init__(self, ngram: int = 12, max_repeats: int = 8, window: int = 1024) -> None:
+        self.ngram = max(1, int(ngram))
+        self.max_repeats = max(2, int(max_repeats))
+        self.window = max(self.ngram, int(window))
+        self._top = pow(self._BASE, self.ngram - 1, self._MOD)
+        self._tokens: deque[int] = deque()
+        self._grams: deque[int] = deque()
+        self._counts: dict[int, int] = {}
+        self._hash = 0
+        self.tripped = False
+
+    @classmethod
+    def from_env(cls) -> RepetitionDetector | None:
+        ngram = int(os.getenv("MYGPT_REPETITION_NGRAM", "12"))
+        if ngram <= 0:
+            return None
+        return cls(
+            ngram=ngram,
+            max_repeats=int(os.getenv("MYGPT_REPETITION_MAX_REPEATS", "8")),
+            window=int(os.getenv("MYGPT_REPETITION_WINDOW", "1024")),
+        )
+
+    def feed(self, token: str) -> bool:
+        """Add one token; True once the stream is degenerate."""
+        if self.tripped:
+            return True
+        h = hash(token) % self._MOD
+        if len(self._tokens) == self.ngram:
+            self._hash = (self._hash - self._tokens.popleft() * self._top) % self._MOD
+        self._tokens.append(h)
+        self._hash = (self._hash * self._BASE + h) % self._MOD
+        if len(self._tokens) < self.ngram:
+            return False
+        self._grams.append(self._hash)
+        count = self._counts.get(self._hash, 0) + 1
+        self._counts[self._hash] = count
+        if len(self._grams) > self.window - self.ngram + 1:
+            old = self._grams.popleft()
+            remaining = self._counts[old] - 1
+            if remaining:
+                self._counts[old] = remaining
+            else:
+                del self._counts[old]
+        self.tripped = count >= self.max_repeats
+        return self.tripped
+
+
+class OutputFilter:
+    """Incremental cleanup of a streamed answer.
+
+    Chain of stateful filters fed token by token, matching patterns across
+    token boundaries: reasoning wrappers (``<think>`` ...) and ANSI escape
+    codes are dropped, and the answer ends at the first hallucinated role
+    turn or when ``repetition`` reports a loop (``stop_reason`` is then
+    set so the caller can stop generating). ``text`` is the cleaned answer
+    for persistence; ``raw`` is everything that was fed.
+    """
+
+    def __init__(self, repetition: RepetitionDetector | None = None) -> None:
+        self._reasoning = _ReasoningFilter()
+        self._roles = _RoleFilter()
+        self._repetition = repetition
+        self._raw: list[str] = []
+        self._finished = False
+
+    @property
+    def stop_reason(self) -> str | None:
+        if self._roles.stopped:
+            return "role_marker"
+        if self._repetition is not None and self._repetition.tripped:
+            return "repetition"
+        return None
+
+    @property
+    def stopped(self) -> bool:
+        return self.stop_reason is not None
+
+    @property
+    def raw(self) -> str:
+        return "".join(self._raw)
+
+    @property
+    def text(self) -> str:
+        return self._roles.text
+
+    def _chain(self, text: str, resets: int) -> str:
+        if self._reasoning.resets != resets:
+            self._roles.reset()
+        return self._roles.feed(text)
+
+    def feed(self, token: str) -> str:
+        """Visible text to emit for ``token`` (may be empty)."""
+        if self.stopped or self._finished:
+            return ""
+        self._raw.append(token)
+        resets = self._reasoning.resets
+        text = self._chain(self._reasoning.feed(token), resets)
+        if self._repetition is not None:
+            self._repetition.feed(token)
+        return text
+
+    def finish(self) -> str:
+        """Release held-back text at the end of the stream; idempotent."""
+        if self._finished:
+            return ""
+        self._finished = True
+        if self._roles.stopped:
+            return ""
+        resets = self._reasoning.resets
+        text = self._chain(self._reasoning.finish(), resets)
+        return text + self._roles.finish()
+
+
+async def filter_output(
+    tokens: AsyncIterable[str], output_filter: OutputFilter
+) -> AsyncIterator[str]:
+    """Run ``tokens`` through ``output_filter``, yielding the visible text.
+
+    Stops pulling as soon as the filter stops (role header, repetition
+    loop); closing ``tokens`` then closes the upstream HTTP stream, so
+    llama-server stops generating text that would be thrown away.
+    """
+    source = tokens.__aiter__()
+    try:
+        async for token in source:
+            text = output_filter.feed(token)
+            if text:
+                yield text
+            if output_filter.stopped:
+                break
+        tail = output_filter.finish()
+        if tail:
+            yield tail
+    finally:
+        aclose = getattr(source, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+_REPETITION_STOPS: dict[str, int] = {}
+
+
+def record_repetition_stop(model: str) -> None:
+    _REPETITION_STOPS[model] = _REPETITION_STOPS.get(model, 0) + 1
+
+
+def repetition_metrics() -> dict:
+    """Generations cut for repetition, per model identity."""
+    return dict(_REPETITION_STOPS)
+
+
+@dataclass
+class GenerationInfo:
+    """Filled in by ``generate`` so callers can tell how a stream was served."""
+
+    endpoint: str | None = None
+    fallback: bool = False
+    # time.monotonic() when the upstream stream was closed and its endpoint
+    # released (normal end, error or cancellation).
+    released_at: float | None = None
+
+
+class GenerationInterrupted(RuntimeError):
+    """The upstream stream failed after tokens had reached the caller."""
+
+
+def _endpoint_failed(exc: BaseException) -> bool:
+    """True for errors that say the server is unwell, not the request.
+
+    Connection errors, timeouts and 5xx eject the endpoint; a 4xx (or a
+    malformed stream line) is not the endpoint's fault.
+    """
+    httpx = _httpx()
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500
+    return isinstance(exc, httpx.TransportError)
+
+
+def _cache_prompt_enabled() -> bool:
+    return os.getenv("MYGPT_CACHE_PROMPT", "1").strip() != "0"
+
+
 async def generate(
     messages: list[dict],
     preferences: dict[str, str] | None = None,
     prompt: str | None = None,
     model_url: str | None = None,
+    conversation_id: int | None = None,
+    info: GenerationInfo | None = None,
 ) -> AsyncGenerator[str, None]:
     """
     Streams tokens from a local llama.cpp-style HTTP server. If the server is
-    unreachable, falls back to a deterministic local echo.
+    unreachable, falls back to a deterministic local echo. A failure after
+    the first token raises ``GenerationInterrupted`` so the caller can mark
+    the partial answer as truncated.
     """
 
-    model_url = (model_url or os.getenv("MYGPT_MODEL_URL", DEFAULT_MODEL_URL)).rstrip("/")
     prompt_text = prompt if prompt is not None else build_prompt(messages, preferences=preferences)
+    if info is None:
+        info = GenerationInfo()
 
     payload = {
         "prompt": prompt_text,
         "stream": True,
-        "n_predict": int(os.getenv("MYGPT_N_PREDICT", "256")),
+        **generation_params(),
     }
 
-    # llama.cpp server supports disabling "reasoning" wrappers for some models.
-    # Default to "none" to avoid verbose 〈thinking〉 blocks consuming output tokens.
-    payload["reasoning_format"] = os.getenv("MYGPT_REASONING_FORMAT", "none").strip() or "none"
-    payload["reasoning_in_content"] = os.getenv("MYGPT_REASONING_IN_CONTENT", "false").strip().lower() == "true"
+    pool = endpoint_pool(model_url)
+    tried: set[str] = set()
+    while True:
+        endpoint = await pool.choose(conversation_id, exclude=tried)
+        if endpoint is None:
+            break
+        tried.add(endpoint.url)
+        info.endpoint = endpoint.url
 
-    stop_env = os.getenv("MYGPT_STOP_SEQS", "").strip()
-    stop_seqs = _parse_stop_sequences(stop_env) if stop_env else _default_stop_sequences()
-    if stop_seqs:
-        payload["stop"] = stop_seqs
+        # Reuse the KV cache for the shared prompt prefix; only the new suffix of
+        # the conversation is evaluated when the request lands on the same slot.
+        payload.pop("id_slot", None)
+        affinity = _slot_affinity(endpoint.url)
+        slot = None
+        if _cache_prompt_enabled():
+            payload["cache_prompt"] = True
+            slot = affinity.slot_for(conversation_id)
+            if slot is not None:
+                payload["id_slot"] = slot
 
-    try:
-        async with httpx.AsyncClient(timeout=None) as client:
-            async with client.stream(
-                "POST",
-                f"{model_url}/completion",
-                json=payload,
-                headers={"Accept": "text/event-stream"},
-            ) as resp:
-                resp.raise_for_status()
-                async for line in resp.aiter_lines():
-                    if not line:
-                        continue
-                    if not line.startswith("data:"):
-                        continue
-                    data_str = line[len("data:") :].strip()
-                    if not data_str:
-                        continue
-                    if data_str == "[DONE]":
-                        break
+        yielded = False
+        failed = False
+        pool.acquire(endpoint)
+        affinity.acquire(slot)
+        try:
+            async with _model_client() as client:
+                async with client.stream(
+                    "POST",
+                    f"{endpoint.url}/completion",
+                    json=payload,
+                    headers={"Accept": "text/event-stream"},
+                ) as resp:
+                    resp.raise_for_status()
+                    async for line in resp.aiter_lines():
+                        if not line:
+                            continue
+                        if not line.startswith("data:"):
+                            continue
+                        data_str = line[len("data:") :].strip()
+                        if not data_str:
+                            continue
+                        if data_str == "[DONE]":
+                            break
 
-                    data = json.loads(data_str)
-                    token = data.get("content")
-                    if token:
-                        yield str(token)
-                    if data.get("stop") is True:
-                        break
-    except Exception:
-        async for token in _fallback_generate(messages):
-            yield token
+                        data = json.loads(data_str)
+                        token = data.get("content")
+                        if token:
+                            yielded = True
+                            yield str(token)
+                        if data.get("stop") is True:
+                            break
+            return
+        except Exception as exc:
+            failed = _endpoint_failed(exc)
+            # Only retry elsewhere if nothing reached the caller yet.
+            if yielded:
+                raise GenerationInterrupted(str(exc) or type(exc).__name__) from exc
+        finally:
+            # Leaving ``client.stream`` above closed the HTTP response, which
+            # is what tells llama-server to stop and free the slot.
+            pool.release(endpoint, failed=failed)
+            affinity.release(slot)
+            info.released_at = time.monotonic()
+
+    info.endpoint = None
+    info.fallback = True
+    async for token in _fallback_generate(messages):
+        yield token
+
+
+def _parse_embeddings(data: object) -> list[list[float]]:
+    """Normalize the shapes llama-server uses for /embedding responses."""
+    items = data if isinstance(data, list) else [data]
+    items = sorted(items, key=lambda item: item.get("index", 0) if isinstance(item, dict) else 0)
+    vectors: list[list[float]] = []
+    for item in items:
+        vector = item.get("embedding") if isinstance(item, dict) else item
+        if vector and isinstance(vector[0], list):
+            # Per-token vectors (pooling "none") or a single pooled row.
+            rows = vector
+            vector = [sum(col) / len(rows) for col in zip(*rows)]
+        vectors.append([float(x) for x in vector or []])
+    return vectors
+
+
+class EmbeddingBatcher:
+    """Coalesce concurrent embedding requests into batched upstream calls.
+
+    Texts requested within ``window_s`` of each other (or until
+    ``max_batch`` distinct texts are pending) go to llama-server in one
+    ``/embedding`` request; identical texts share a single slot.
+    """
+
+    def __init__(self, url: str, window_s: float = 0.005, max_batch: int = 64) -> None:
+        self.url = url
+        self.window_s = window_s
+        self.max_batch = max(1, int(max_batch))
+        self._pending: dict[str, asyncio.Future] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self.requests_total = 0
+        self.texts_total = 0
+        self.batches_total = 0
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        loop = asyncio.get_running_loop()
+        self.requests_total += 1
+        futures = []
+        for text in texts:
+            future = self._pending.get(text)
+            if future is None:
+                future = loop.create_future()
+                self._pending[text] = future
+            futures.append(future)
+        if len(self._pending) >= self.max_batch:
+            self._schedule(loop, 0.0)
+        elif self._timer is None:
+            self._schedule(loop, self.window_s)
+        # Shield the shared futures: one caller giving up must not cancel
+        # the result for the others waiting on the same text.
+        return list(await asyncio.gather(*(asyncio.shield(f) for f in futures)))
+
+    def _schedule(self, loop: asyncio.AbstractEventLoop, delay: float) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = loop.call_later(delay, self._flush)
+
+    def _flush(self) -> None:
+        self._timer = None
+        pending = list(self._pending.items())
+        self._pending = {}
+        for start in range(0, len(pending), self.max_batch):
+            task = asyncio.ensure_future(self._send(dict(pending[start : start + self.max_batch])))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: dict[str, asyncio.Future]) -> None:
+        self.batches_total += 1
+        self.texts_total += len(batch)
+        try:
+            async with _model_client() as client:
+                resp = await client.post(
+                    f"{self.url}/embedding", json={"content": list(batch)}, timeout=30.0
+                )
+            resp.raise_for_status()
+            vectors = _parse_embeddings(resp.json())
+            if len(vectors) != len(batch) or not all(vectors):
+                raise ValueError(
+                    f"Expected {len(batch)} embeddings, got {len(vectors)}"
+                )
+        except Exception as exc:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(exc)
+                    # Callers that already gave up never retrieve it.
+                    future.add_done_callback(lambda f: f.exception())
+            return
+        for future, vector in zip(batch.values(), vectors):
+            if not future.done():
+                future.set_result(vector)
+
+    def metrics(self) -> dict:
+        return {
+            "requests_total": self.requests_total,
+            "texts_total": self.texts_total,
+            "batches_total": self.batches_total,
+            "pending": len(self._pending),
+        }
 
 
-async def embed(text: str) -> None:
-    raise NotImplementedError("embed() not implemented yet")
+_EMBED_BATCHERS: dict[str, EmbeddingBatcher] = {}
+_EMBEDDING_STORE: EmbeddingStore | None = None
+
+
+def set_embedding_store(store: EmbeddingStore | None) -> None:
+    global _EMBEDDING_STORE
+    _EMBEDDING_STORE = store
+
+
+def _embed_url(model_url: str | None) -> str:
+    return (
+        os.getenv("MYGPT_EMBED_URL", "").strip().rstrip("/")
+        or endpoint_pool(model_url).primary_url()
+    )
+
+
+def _embed_batcher(url: str) -> EmbeddingBatcher:
+    batcher = _EMBED_BATCHERS.get(url)
+    if batcher is None:
+        batcher = EmbeddingBatcher(
+            url,
+            window_s=float(os.getenv("MYGPT_EMBED_BATCH_WINDOW_MS", "5")) / 1000.0,
+            max_batch=int(os.getenv("MYGPT_EMBED_MAX_BATCH", "64")),
+        )
+        _EMBED_BATCHERS[url] = batcher
+    return batcher
+
+
+def embedding_model_tag(model_url: str | None = None, model: str | None = None) -> str:
+    return os.getenv("MYGPT_EMBED_MODEL", "").strip() or model or _embed_url(model_url)
+
+
+def embedding_metrics() -> dict:
+    return {
+        "store": _EMBEDDING_STORE.metrics() if _EMBEDDING_STORE is not None else None,
+        "batchers": {url: b.metrics() for url, b in _EMBED_BATCHERS.items()},
+    }
+
+
+async def embed(
+    texts: list[str], model_url: str | None = None, *, model: str | None = None
+) -> list[list[float]]:
+    """Embed ``texts`` with llama-server's ``/embedding`` endpoint.
+
+    The server must run with ``--embeddings``; ``MYGPT_EMBED_URL`` can point
+    at a dedicated embedding server. Vectors are cached by content hash under
+    the embedding model tag (``MYGPT_EMBED_MODEL``, else ``model``, else the
+    endpoint URL), so each text is embedded once per model. Raises when no
+    embedding is available.
+    """
+
+    if not texts:
+        return []
+    url = _embed_url(model_url)
+    if not url:
+        raise RuntimeError("No embedding endpoint configured")
+    tag = embedding_model_tag(model_url, model)
+
+    hashes = [content_hash(text) for text in texts]
+    unique = dict(zip(hashes, texts))
+    store = _EMBEDDING_STORE
+    found = await store.get_many(tag, list(unique)) if store is not None else {}
+    missing = [h for h in unique if h not in found]
+    if missing:
+        vectors = await _embed_batcher(url).embed([unique[h] for h in missing])
+        fresh = dict(zip(missing, vectors))
+        if store is not None:
+            await store.put_many(tag, fresh)
+        found.update(fresh)
+    return [found[h] for h in hashes]
 
 
 async def vision(image: str) -> None:
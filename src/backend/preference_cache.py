@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+from typing import Callable
+
+
+def preferences_version(conn: sqlite3.Connection) -> int:
+    """A number that changes whenever a preference or a reset is recorded.
+
+    Both tables are append-only with increasing ids, so the sum of their
+    highest ids strictly increases on every write, from any process. Each
+    ``MAX(id)`` is a single b-tree seek.
+    """
+    row = conn.execute(
+        """
+        SELECT
+          (SELECT COALESCE(MAX(id), 0) FROM preferences)
+          + (SELECT COALESCE(MAX(id), 0) FROM preference_resets)
+        """
+    ).fetchone()
+    return int(row[0])
+
+
+class PreferenceSnapshots:
+    """Active preferences per scope, reloaded only when the version moves.
+
+    ``invalidate()`` is called by this process's own write paths; the
+    version check keeps other processes writing to the same database
+    coherent.
+    """
+
+    def __init__(self, load: Callable[[sqlite3.Connection, str], dict[str, str]]) -> None:
+        self._load = load
+        self._entries: dict[str, tuple[int, dict[str, str]]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, conn: sqlite3.Connection, scope: str = "global") -> tuple[int, dict[str, str]]:
+        """``(version, preferences)``; the dict is a copy the caller may keep."""
+        version = preferences_version(conn)
+        with self._lock:
+            entry = self._entries.get(scope)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                return version, dict(entry[1])
+            self.misses += 1
+        preferences = self._load(conn, scope)
+        with self._lock:
+            self._entries[scope] = (version, preferences)
+        return version, dict(preferences)
+
+    def invalidate(self, scope: str | None = None) -> None:
+        with self._lock:
+            if scope is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(scope, None)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "scopes": {scope: version for scope, (version, _) in self._entries.items()},
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Literal
+
+Priority = Literal["interactive", "regenerate", "batch"]
+
+PRIORITIES: tuple[Priority, ...] = ("interactive", "regenerate", "batch")
+
+
+class QueueTimeout(Exception):
+    pass
+
+
+class Ticket:
+    """A request's place in the generation queue.
+
+    Iterate ``positions()`` to wait for a slot (it yields the 1-based queue
+    position whenever it changes) and always call ``release()`` when the
+    generation ends or the caller gives up.
+    """
+
+    __slots__ = (
+        "_scheduler",
+        "conversation_id",
+        "priority",
+        "seq",
+        "enqueued_at",
+        "granted_at",
+        "released",
+        "_wakeup",
+    )
+
+    def __init__(
+        self,
+        scheduler: GenerationScheduler,
+        conversation_id: int | None,
+        priority: Priority,
+        seq: int,
+    ) -> None:
+        self._scheduler = scheduler
+        self.conversation_id = conversation_id
+        self.priority = priority
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.granted_at: float | None = None
+        self.released = False
+        self._wakeup: asyncio.Future | None = None
+
+    @property
+    def granted(self) -> bool:
+        return self.granted_at is not None
+
+    @property
+    def wait_s(self) -> float:
+        end = self.granted_at if self.granted_at is not None else time.monotonic()
+        return end - self.enqueued_at
+
+    def _notify(self) -> None:
+        if self._wakeup is not None and not self._wakeup.done():
+            self._wakeup.set_result(None)
+
+    async def positions(self, timeout_s: float | None = None) -> AsyncIterator[int]:
+        timeout = self._scheduler.queue_timeout_s if timeout_s is None else timeout_s
+        deadline = self.enqueued_at + timeout
+        last: int | None = None
+        while not self.granted:
+            position = self._scheduler.position(self)
+            if position != last:
+                last = position
+                yield position
+                if self.granted:
+                    break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._scheduler._expire(self)
+                raise QueueTimeout(f"No generation slot within {timeout:.0f}s")
+            self._wakeup = asyncio.get_running_loop().create_future()
+            await asyncio.wait({self._wakeup}, timeout=remaining)
+            self._wakeup = None
+
+    def release(self) -> None:
+        if self.released:
+            return
+        self.released = True
+        self._scheduler._release(self)
+
+
+class GenerationScheduler:
+    """Admission control in front of the model server.
+
+    At most ``max_concurrent`` generations run at once (by default one per
+    llama-server slot). Waiting requests are served by priority, and within
+    a priority round-robin across conversations so one busy conversation
+    cannot starve the others; each conversation's own requests stay FIFO.
+    """
+
+    def __init__(self, max_concurrent: int = 2, queue_timeout_s: float = 120.0) -> None:
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.queue_timeout_s = queue_timeout_s
+        self._queues: dict[Priority, OrderedDict[object, deque[Ticket]]] = {
+            p: OrderedDict() for p in PRIORITIES
+        }
+        self._active: set[Ticket] = set()
+        self._seq = itertools.count(1)
+        self._granted_total = 0
+        self._timeouts_total = 0
+        self._abandoned_total = 0
+        self._max_wait_s = 0.0
+        self._recent_waits: deque[float] = deque(maxlen=256)
+
+    def configure(self, max_concurrent: int) -> None:
+        self.max_concurrent = max(1, int(max_concurrent))
+        self._dispatch()
+
+    def submit(self, conversation_id: int | None, priority: Priority = "interactive") -> Ticket:
+        if priority not in self._queues:
+            raise ValueError(f"Unknown priority: {priority}")
+        ticket = Ticket(self, conversation_id, priority, next(self._seq))
+        # Requests without a conversation each get their own lane.
+        lane = conversation_id if conversation_id is not None else ("anon", ticket.seq)
+        self._queues[priority].setdefault(lane, deque()).append(ticket)
+        self._dispatch()
+        return ticket
+
+    def _order(self) -> list[Ticket]:
+        ordered: list[Ticket] = []
+        for priority in PRIORITIES:
+            lanes = [list(q) for q in self._queues[priority].values()]
+            depth = max((len(q) for q in lanes), default=0)
+            for i in range(depth):
+                ordered.extend(q[i] for q in lanes if i < len(q))
+        return ordered
+
+    def position(self, ticket: Ticket) -> int:
+        if ticket.granted:
+            return 0
+        for idx, queued in enumerate(self._order(), start=1):
+            if queued is ticket:
+                return idx
+        return 0
+
+    def _pop_next(self) -> Ticket | None:
+        for priority in PRIORITIES:
+            lanes = self._queues[priority]
+            if not lanes:
+                continue
+            lane, queue = next(iter(lanes.items()))
+            ticket = queue.popleft()
+            del lanes[lane]
+            if queue:
+                lanes[lane] = queue
+            return ticket
+        return None
+
+    def _remove(self, ticket: Ticket) -> bool:
+        lanes = self._queues[ticket.priority]
+        for lane, queue in lanes.items():
+            if ticket in queue:
+                queue.remove(ticket)
+                if not queue:
+                    del lanes[lane]
+                return True
+        return False
+
+    def _dispatch(self) -> None:
+        changed = False
+        while len(self._active) < self.max_concurrent:
+            ticket = self._pop_next()
+            if ticket is None:
+                break
+            ticket.granted_at = time.monotonic()
+            self._active.add(ticket)
+            self._granted_total += 1
+            self._recent_waits.append(ticket.wait_s)
+            self._max_wait_s = max(self._max_wait_s, ticket.wait_s)
+            changed = True
+        if changed:
+            self._notify_waiting()
+
+    def _notify_waiting(self) -> None:
+        for ticket in self._active:
+            ticket._notify()
+        for lanes in self._queues.values():
+            for queue in lanes.values():
+                for ticket in queue:
+                    ticket._notify()
+
+    def _expire(self, ticket: Ticket) -> None:
+        if self._remove(ticket):
+            self._timeouts_total += 1
+            ticket.released = True
+            self._notify_waiting()
+
+    def _release(self, ticket: Ticket) -> None:
+        if ticket in self._active:
+            self._active.discard(ticket)
+            self._dispatch()
+        elif self._remove(ticket):
+            self._abandoned_total += 1
+            self._notify_waiting()
+
+    def metrics(self) -> dict:
+        waits = sorted(self._recent_waits)
+
+        def _pct(p: float) -> float | None:
+            if not waits:
+                return None
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 2)
+
+        return {
+            "max_concurrent": self.max_concurrent,
+            "active": len(self._active),
+            "queue_depth": {
+                p: sum(len(q) for q in self._queues[p].values()) for p in PRIORITIES
+            },
+            "granted_total": self._granted_total,
+            "timeouts_total": self._timeouts_total,
+            "abandoned_total": self._abandoned_total,
+            "wait_ms_p50": _pct(0.5),
+            "wait_ms_p95": _pct(0.95),
+            "wait_ms_max": round(self._max_wait_s * 1000, 2),
+        }
@@ -72,6 +72,84 @@ CREATE TABLE IF NOT EXISTS preference_resets (
     FOREIGN KEY (reset_event_id) REFERENCES events(id)
 );
 
+CREATE TABLE IF NOT EXISTS conversation_summaries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id INTEGER NOT NULL,
+    covers_through_message_id INTEGER NOT NULL,
+    covered_count INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    previous_summary_id INTEGER,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (conversation_id) REFERENCES conversations(id),
+    FOREIGN KEY (covers_through_message_id) REFERENCES messages(id),
+    FOREIGN KEY (previous_summary_id) REFERENCES conversation_summaries(id)
+);
+
+-- Replay cache for deterministic completions. Unlike the tables above this is
+-- not history: rows are updated on hit and evicted (LRU, size bound).
+CREATE TABLE IF NOT EXISTS completion_cache (
+    cache_key TEXT PRIMARY KEY,
+    prompt_sha256 TEXT NOT NULL,
+    model TEXT NOT NULL,
+    params_json TEXT NOT NULL,
+    response TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used_at REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS idx_completion_cache_last_used
+ON completion_cache (last_used_at);
+
+-- Embeddings keyed by content hash and embedding model. A given text always
+-- embeds to the same vector, so rows are write-once (INSERT OR IGNORE).
+-- vector holds dim little-endian float32 values.
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    content_sha256 TEXT NOT NULL,
+    model TEXT NOT NULL,
+    dim INTEGER NOT NULL,
+    vector BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (content_sha256, model)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS prevent_update_embedding_cache
+BEFORE UPDATE ON embedding_cache
+BEGIN
+    SELECT RAISE(ABORT, 'Cached embeddings are immutable');
+END;
+
+-- Full-text indexes over the append-only messages and events tables.
+-- External-content FTS5 tables: text lives in the base table only, and
+-- since base rows can never change or be deleted, an insert trigger is all
+-- that is needed to keep them in sync.
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content,
+    content='messages',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5(
+    payload_json,
+    content='events',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert
+AFTER INSERT ON messages
+BEGIN
+    INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+END;
+
+CREATE TRIGGER IF NOT EXISTS events_fts_insert
+AFTER INSERT ON events
+BEGIN
+    INSERT INTO events_fts(rowid, payload_json) VALUES (new.id, new.payload_json);
+END;
+
 CREATE TRIGGER IF NOT EXISTS prevent_update_messages
 BEFORE UPDATE ON messages
 BEGIN
@@ -119,3 +197,15 @@ BEFORE DELETE ON preference_resets
 BEGIN
     SELECT RAISE(ABORT, 'Preference resets are immutable');
 END;
+
+CREATE TRIGGER IF NOT EXISTS prevent_update_conversation_summaries
+BEFORE UPDATE ON conversation_summaries
+BEGIN
+    SELECT RAISE(ABORT, 'Conversation summaries are immutable; append a new summary instead');
+END;
+
+CREATE TRIGGER IF NOT EXISTS prevent_delete_conversation_summaries
+BEFORE DELETE ON conversation_summaries
+BEGIN
+    SELECT RAISE(ABORT, 'Conversation summaries are immutable; append a new summary instead');
+END;
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import base64
+import json
+import re
+import sqlite3
+from typing import Literal
+
+SearchScope = Literal["messages", "events"]
+
+SNIPPET_OPEN = "<mark>"
+SNIPPET_CLOSE = "</mark>"
+
+
+def fts_terms(q: str) -> str:
+    """Turn free text into an FTS5 query that ANDs every word literally.
+
+    Quoting each token keeps user input such as ``C++``, ``"`` or ``AND``
+    from being parsed as FTS5 syntax.
+    """
+
+    tokens = re.findall(r"\S+", q)
+    return " ".join('"' + token.replace('"', '""') + '"' for token in tokens)
+
+
+def encode_cursor(rank: float, row_id: int) -> str:
+    raw = json.dumps([rank, row_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[float, int]:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    rank, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    return float(rank), int(row_id)
+
+
+def _page(rows: list[sqlite3.Row], limit: int) -> tuple[list[dict], str | None]:
+    results = [dict(r) for r in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = results[-1]
+        next_cursor = encode_cursor(last["rank"], last["id"])
+    return results, next_cursor
+
+
+def search_messages(
+    conn: sqlite3.Connection,
+    match: str,
+    *,
+    conversation_id: int | None = None,
+    role: str | None = None,
+    limit: int = 20,
+    cursor: str | None = None,
+) -> tuple[list[dict], str | None]:
+    """BM25-ranked message hits, best first, keyset-paginated by (rank, id)."""
+    where = ["messages_fts MATCH ?"]
+    params: list[object] = [match]
+    if conversation_id is not None:
+        where.append("cm.conversation_id = ?")
+        params.append(conversation_id)
+    if role is not None:
+        where.append("m.role = ?")
+        params.append(role)
+    if cursor is not None:
+        rank, row_id = decode_cursor(cursor)
+        where.append("(messages_fts.rank > ? OR (messages_fts.rank = ? AND m.id > ?))")
+        params.extend([rank, rank, row_id])
+    rows = conn.execute(
+        f"""
+        SELECT
+          m.id, m.role, m.timestamp, cm.conversation_id,
+          snippet(messages_fts, 0, ?, ?, '…', 16) AS snippet,
+          messages_fts.rank AS rank
+        FROM messages_fts
+        JOIN messages m ON m.id = messages_fts.rowid
+        LEFT JOIN conversation_messages cm ON cm.message_id = m.id
+        WHERE {" AND ".join(where)}
+        ORDER BY messages_fts.rank, m.id
+        LIMIT ?
+        """,
+        (SNIPPET_OPEN, SNIPPET_CLOSE, *params, limit + 1),
+    ).fetchall()
+    return _page(rows, limit)
+
+
+def search_events(
+    conn: sqlite3.Connection,
+    match: str,
+    *,
+    conversation_id: int | None = None,
+    event_type: str | None = None,
+    limit: int = 20,
+    cursor: str | None = None,
+) -> tuple[list[dict], str | None]:
+    """BM25-ranked event hits over ``payload_json``, keyset-paginated by (rank, id)."""
+    where = ["events_fts MATCH ?"]
+    params: list[object] = [match]
+    if conversation_id is not None:
+        where.append("e.conversation_id = ?")
+        params.append(conversation_id)
+    if event_type is not None:
+        where.append("e.type = ?")
+        params.append(event_type)
+    if cursor is not None:
+        rank, row_id = decode_cursor(cursor)
+        where.append("(events_fts.rank > ? OR (events_fts.rank = ? AND e.id > ?))")
+        params.extend([rank, rank, row_id])
+    rows = conn.execute(
+        f"""
+        SELECT
+          e.id, e.type, e.created_at, e.conversation_id, e.causality_message_id,
+          snippet(events_fts, 0, ?, ?, '…', 16) AS snippet,
+          events_fts.rank AS rank
+        FROM events_fts
+        JOIN events e ON e.id = events_fts.rowid
+        WHERE {" AND ".join(where)}
+        ORDER BY events_fts.rank, e.id
+        LIMIT ?
+        """,
+        (SNIPPET_OPEN, SNIPPET_CLOSE, *params, limit + 1),
+    ).fetchall()
+    return _page(rows, limit)
+
+
+def rebuild_missing_indexes(conn: sqlite3.Connection, created: set[str]) -> None:
+    """Backfill FTS tables created on an existing database."""
+    for table in ("messages_fts", "events_fts"):
+        if table in created:
+            conn.execute(f"INSERT INTO {table}({table}) VALUES ('rebuild')")
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import itertools
+from collections import OrderedDict
+
+
+def _np():
+    # NumPy is only needed once the cache is used; keep app import cheap.
+    import numpy
+
+    return numpy
+
+
+def _normalize(vector):
+    np = _np()
+    row = np.asarray(vector, dtype=np.float32).ravel()
+    norm = float(np.linalg.norm(row))
+    return row / norm if norm else row
+
+
+class SemanticEntry:
+    __slots__ = ("entry_id", "question", "answer", "vector", "hits", "row")
+
+    def __init__(self, entry_id: int, question: str, answer: str, vector, row: int) -> None:
+        self.entry_id = entry_id
+        self.question = question
+        self.answer = answer
+        self.vector = vector
+        self.hits = 0
+        self.row = row
+
+
+class _Partition:
+    """One model's entries plus their vectors as rows of a single matrix.
+
+    Rows freed by eviction are reused; ``live`` masks the unused ones so a
+    lookup scores the whole partition with one matrix-vector product.
+    """
+
+    def __init__(self, dim: int) -> None:
+        np = _np()
+        self.entries: OrderedDict[int, SemanticEntry] = OrderedDict()
+        self.matrix = np.zeros((0, dim), dtype=np.float32)
+        self.live = np.zeros(0, dtype=bool)
+        self.slots: list[SemanticEntry | None] = []
+        self.free: list[int] = []
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    def insert(self, entry_id: int, question: str, answer: str, vector, capacity: int) -> SemanticEntry:
+        np = _np()
+        if not self.free:
+            # Grow geometrically so adds stay amortised O(dim).
+            old = len(self.slots)
+            size = min(capacity, max(8, old * 2))
+            matrix = np.zeros((size, self.dim), dtype=np.float32)
+            matrix[:old] = self.matrix
+            live = np.zeros(size, dtype=bool)
+            live[:old] = self.live
+            self.matrix, self.live = matrix, live
+            self.slots.extend([None] * (size - old))
+            self.free.extend(range(size - 1, old - 1, -1))
+        row = self.free.pop()
+        self.matrix[row] = vector
+        self.live[row] = True
+        entry = SemanticEntry(entry_id, question, answer, vector, row)
+        self.slots[row] = entry
+        self.entries[entry_id] = entry
+        return entry
+
+    def evict_oldest(self) -> None:
+        _, entry = self.entries.popitem(last=False)
+        self.live[entry.row] = False
+        self.slots[entry.row] = None
+        self.free.append(entry.row)
+
+    def best(self, query) -> tuple[SemanticEntry, float] | None:
+        if not self.entries or query.shape[0] != self.dim:
+            return None
+        np = _np()
+        scores = self.matrix @ query
+        scores[~self.live] = -np.inf
+        row = int(np.argmax(scores))
+        entry = self.slots[row]
+        return (entry, float(scores[row])) if entry is not None else None
+
+
+class SemanticCache:
+    """Bounded in-memory store of answers keyed by question embeddings.
+
+    Entries are partitioned per model so answers never cross model
+    versions; each partition keeps at most ``max_entries`` answers and
+    evicts the least recently used one. Vectors are stored normalized in
+    one float32 matrix per partition, so a lookup is a single matmul.
+    """
+
+    def __init__(self, max_entries: int = 512, threshold: float = 0.92) -> None:
+        self.max_entries = max(1, int(max_entries))
+        self.threshold = float(threshold)
+        self._partitions: dict[str, _Partition] = {}
+        self._ids = itertools.count(1)
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def lookup(self, model: str, vector) -> tuple[SemanticEntry, float] | None:
+        partition = self._partitions.get(model)
+        found = partition.best(_normalize(vector)) if partition is not None else None
+        if found is None or found[1] < self.threshold:
+            self._misses += 1
+            return None
+        entry, _ = found
+        partition.entries.move_to_end(entry.entry_id)
+        entry.hits += 1
+        self._hits += 1
+        return found
+
+    def add(self, model: str, question: str, vector, answer: str) -> SemanticEntry:
+        row = _normalize(vector)
+        partition = self._partitions.get(model)
+        if partition is None or partition.dim != row.shape[0]:
+            # A new embedding model changes the dimension; old vectors
+            # could never match again.
+            partition = self._partitions[model] = _Partition(row.shape[0])
+        while len(partition.entries) >= self.max_entries:
+            partition.evict_oldest()
+            self._evictions += 1
+        return partition.insert(next(self._ids), question, answer, row, self.max_entries)
+
+    def clear(self, model: str | None = None) -> None:
+        if model is None:
+            self._partitions.clear()
+        else:
+            self._partitions.pop(model, None)
+
+    def metrics(self) -> dict:
+        return {
+            "threshold": self.threshold,
+            "max_entries": self.max_entries,
+            "entries": {model: len(p.entries) for model, p in self._partitions.items()},
+            "hits": self._hits,
+            "misses": self._misses,
+            "evictions": self._evictions,
+        }
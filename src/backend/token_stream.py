@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable
+
+
+@dataclass(frozen=True)
+class FlushPolicy:
+    """When streamed tokens are written out as an SSE frame.
+
+    At most one frame per ``window_ms``: a token arriving after a quiet
+    window (including the first token) is sent at once, later ones are
+    buffered until the window ends or the buffer reaches ``max_bytes``
+    (UTF-8, ``0`` = no size limit). ``window_ms <= 0`` sends every token
+    as its own frame.
+    """
+
+    window_ms: float = 0.0
+    max_bytes: int = 0
+
+    @property
+    def per_token(self) -> bool:
+        return self.window_ms <= 0
+
+
+class StreamStats:
+    """Tokens in vs frames out, across all coalesced streams."""
+
+    def __init__(self) -> None:
+        self.tokens_total = 0
+        self.frames_total = 0
+        self.disconnects_total = 0
+        self.last_disconnect_freed_ms: float | None = None
+
+    def record_disconnect(self, freed_ms: float | None) -> None:
+        self.disconnects_total += 1
+        if freed_ms is not None:
+            self.last_disconnect_freed_ms = freed_ms
+
+    def metrics(self) -> dict:
+        return {
+            "tokens_total": self.tokens_total,
+            "frames_total": self.frames_total,
+            "tokens_per_frame": (
+                round(self.tokens_total / self.frames_total, 2) if self.frames_total else None
+            ),
+            "disconnects_total": self.disconnects_total,
+            "last_disconnect_freed_ms": self.last_disconnect_freed_ms,
+        }
+
+
+class DisconnectWatcher:
+    """Cancel the streaming task as soon as the client goes away.
+
+    A single task waits on the ASGI ``receive`` channel for
+    ``http.disconnect`` instead of the stream polling it between tokens.
+    Cancellation only happens between ``start()`` and ``stop()``, so the
+    caller's cleanup (persisting the partial answer) is never interrupted.
+    After catching ``CancelledError``, re-raise it unless
+    ``absorb_cancel()`` returns True: any other cancellation (shutdown,
+    the server's task group) must propagate.
+    """
+
+    def __init__(self, receive: Callable[[], Awaitable[dict]]) -> None:
+        self._receive = receive
+        self._task: asyncio.Task | None = None
+        self._target: asyncio.Task | None = None
+        self.disconnected_at: float | None = None
+        self.cancelled = False
+
+    @property
+    def disconnected(self) -> bool:
+        return self.disconnected_at is not None
+
+    def start(self) -> None:
+        self._target = asyncio.current_task()
+        self._task = asyncio.ensure_future(self._watch())
+
+    async def _watch(self) -> None:
+        try:
+            while (await self._receive())["type"] != "http.disconnect":
+                pass
+        except Exception:
+            return
+        self.disconnected_at = time.monotonic()
+        if self._target is not None:
+            self.cancelled = True
+            self._target.cancel()
+
+    def stop(self) -> None:
+        self._target = None
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    def absorb_cancel(self) -> bool:
+        """Undo this watcher's cancellation of the current task.
+
+        True if the watcher's cancel was the only one pending, i.e. the
+        caller may swallow the ``CancelledError``.
+        """
+        if not self.cancelled:
+            return False
+        self.cancelled = False
+        task = asyncio.current_task()
+        cancelling = getattr(task, "cancelling", None)
+        if cancelling is None:
+            # Python < 3.11 does not count cancellations.
+            return True
+        return not cancelling() or task.uncancel() == 0
+
+
+async def coalesce_tokens(
+    tokens: AsyncIterable[str],
+    policy: FlushPolicy,
+    stats: StreamStats | None = None,
+) -> AsyncIterator[str]:
+    """Re-chunk ``tokens`` into frames according to ``policy``.
+
+    The next token is awaited as a task so a window can end while the
+    model is still producing it. Closing this iterator cancels that task
+    and closes ``tokens``.
+    """
+    source = tokens.__aiter__()
+    pending: asyncio.Future | None = None
+    try:
+        if policy.per_token:
+            async for token in source:
+                if stats is not None:
+                    stats.tokens_total += 1
+                    stats.frames_total += 1
+                yield token
+            return
+
+        loop = asyncio.get_running_loop()
+        window_s = policy.window_ms / 1000.0
+        last_flush = float("-inf")
+        buffer: list[str] = []
+        buffered_bytes = 0
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(source.__anext__())
+            if buffer:
+                remaining = last_flush + window_s - loop.time()
+                done, _ = await asyncio.wait({pending}, timeout=max(0.0, remaining))
+                if not done:
+                    last_flush = loop.time()
+                    if stats is not None:
+                        stats.frames_total += 1
+                    yield "".join(buffer)
+                    buffer, buffered_bytes = [], 0
+                    continue
+            else:
+                await asyncio.wait({pending})
+            future, pending = pending, None
+            try:
+                token = future.result()
+            except StopAsyncIteration:
+                break
+            if not token:
+                continue
+            if stats is not None:
+                stats.tokens_total += 1
+            now = loop.time()
+            if not buffer and now - last_flush >= window_s:
+                last_flush = now
+                if stats is not None:
+                    stats.frames_total += 1
+                yield token
+                continue
+            buffer.append(token)
+            buffered_bytes += len(token.encode("utf-8"))
+            if policy.max_bytes > 0 and buffered_bytes >= policy.max_bytes:
+                last_flush = now
+                if stats is not None:
+                    stats.frames_total += 1
+                yield "".join(buffer)
+                buffer, buffered_bytes = [], 0
+        if buffer:
+            if stats is not None:
+                stats.frames_total += 1
+            yield "".join(buffer)
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+            await asyncio.gather(pending, return_exceptions=True)
+        aclose = getattr(source, "aclose", None)
+        if aclose is not None:
+            await aclose()
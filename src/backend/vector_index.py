@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+def _np():
+    # NumPy is only needed once the index is used; keep app import cheap.
+    import numpy
+
+    return numpy
+
+
+class VectorIndex:
+    """Append-only, memory-mapped float32 matrix of message embeddings.
+
+    Files live next to ``chat.db`` under a common ``base`` path:
+
+    - ``<base>.f32``: ``count x dim`` unit-normalized float32 rows
+    - ``<base>.ids`` / ``<base>.conv``: int64 message / conversation id per row
+    - ``<base>.json``: embedding model tag and dimension
+    - ``<base>.ivf.npy`` / ``<base>.ivf.i32``: optional IVF centroids and the
+      centroid assignment per row
+
+    Rows are only ever appended in message-id order, so the highest indexed
+    id is where the next catch-up resumes. Search runs on the mapped files in
+    chunks and never materializes rows as Python objects.
+    """
+
+    CHUNK_ROWS = 65536
+
+    def __init__(self, base: Path) -> None:
+        self.base = base
+        self.model: str | None = None
+        self.dim = 0
+        self.count = 0
+        self._centroids: np.ndarray | None = None
+        self._maps: dict[str, object] = {}
+        self._last_id = 0
+        # Appends and searches run in worker threads; the lock keeps ``count``
+        # and the mappings consistent for the duration of each call.
+        self._lock = threading.Lock()
+        # Replaced (never mutated) by every write, so ``metrics()`` can read
+        # it from the event loop without waiting for a long append or build.
+        self._snapshot: dict = {}
+        self._load()
+        self._publish()
+
+    def _path(self, suffix: str) -> Path:
+        return self.base.with_name(self.base.name + suffix)
+
+    def _load(self) -> None:
+        meta_path = self._path(".json")
+        if not meta_path.exists():
+            return
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        self.model = meta.get("model")
+        self.dim = int(meta.get("dim") or 0)
+        if not self.dim:
+            return
+        rows = [
+            self._file_rows(".f32", 4 * self.dim),
+            self._file_rows(".ids", 8),
+            self._file_rows(".conv", 8),
+        ]
+        centroids_path = self._path(".ivf.npy")
+        if centroids_path.exists():
+            self._centroids = _np().load(centroids_path)
+            rows.append(self._file_rows(".ivf.i32", 4))
+        # A crash mid-append can leave files of different lengths; the
+        # shortest one bounds the rows that are complete everywhere.
+        self.count = min(rows)
+        if self.count:
+            with self._path(".ids").open("rb") as handle:
+                handle.seek((self.count - 1) * 8)
+                self._last_id = int.from_bytes(handle.read(8), "little", signed=True)
+
+    def _file_rows(self, suffix: str, row_bytes: int) -> int:
+        path = self._path(suffix)
+        return path.stat().st_size // row_bytes if path.exists() else 0
+
+    def reset(self, model: str, dim: int) -> None:
+        # Drop mappings first; Windows refuses to delete mapped files.
+        self._maps.clear()
+        for suffix in (".f32", ".ids", ".conv", ".ivf.npy", ".ivf.i32"):
+            self._path(suffix).unlink(missing_ok=True)
+        self.base.parent.mkdir(parents=True, exist_ok=True)
+        self._path(".json").write_text(json.dumps({"model": model, "dim": dim}), encoding="utf-8")
+        self.model, self.dim, self.count = model, dim, 0
+        self._centroids = None
+        self._last_id = 0
+        self._publish()
+
+    def _map(self, suffix: str, dtype: str, shape: tuple[int, ...]):
+        key = f"{suffix}:{self.count}"
+        mapped = self._maps.get(key)
+        if mapped is None:
+            mapped = _np().memmap(self._path(suffix), dtype=dtype, mode="r", shape=shape)
+            self._maps = {k: v for k, v in self._maps.items() if not k.startswith(suffix + ":")}
+            self._maps[key] = mapped
+        return mapped
+
+    def _matrix(self):
+        return self._map(".f32", "float32", (self.count, self.dim))
+
+    def _ids(self):
+        return self._map(".ids", "int64", (self.count,))
+
+    def _conversations(self):
+        return self._map(".conv", "int64", (self.count,))
+
+    def _assignments(self):
+        return self._map(".ivf.i32", "int32", (self.count,))
+
+    @property
+    def last_message_id(self) -> int:
+        return self._last_id
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        np = _np()
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def append(
+        self,
+        message_ids: list[int],
+        conversation_ids: list[int | None],
+        vectors: list[list[float]],
+        model: str,
+    ) -> None:
+        with self._lock:
+            if len(vectors) == 0:
+                return
+            np = _np()
+            matrix = self._normalize(np.asarray(vectors, dtype=np.float32))
+            if model != self.model or matrix.shape[1] != self.dim:
+                self.reset(model, int(matrix.shape[1]))
+            # Truncate any partial tail left by an interrupted append.
+            tails = [(".f32", 4 * self.dim), (".ids", 8), (".conv", 8)]
+            if self._centroids is not None:
+                tails.append((".ivf.i32", 4))
+            for suffix, row_bytes in tails:
+                path = self._path(suffix)
+                if path.exists() and path.stat().st_size != self.count * row_bytes:
+                    self._maps.clear()
+                    os.truncate(path, self.count * row_bytes)
+            ids = np.asarray(message_ids, dtype=np.int64)
+            convs = np.asarray([-1 if c is None else c for c in conversation_ids], dtype=np.int64)
+            with self._path(".f32").open("ab") as handle:
+                matrix.astype(np.float32).tofile(handle)
+            with self._path(".conv").open("ab") as handle:
+                convs.tofile(handle)
+            if self._centroids is not None:
+                with self._path(".ivf.i32").open("ab") as handle:
+                    self._assign(matrix).tofile(handle)
+            # ids go last: last_message_id only advances once the row is complete.
+            with self._path(".ids").open("ab") as handle:
+                ids.tofile(handle)
+            self.count += len(ids)
+            self._last_id = int(ids[-1])
+            self._publish()
+
+    def _assign(self, matrix: np.ndarray) -> np.ndarray:
+        np = _np()
+        return np.argmax(matrix @ self._centroids.T, axis=1).astype(np.int32)
+
+    def build_ivf(self, nlist: int | None = None, iterations: int = 10, sample: int = 50000) -> int:
+        """Cluster rows into ``nlist`` cells (spherical k-means on a sample)."""
+        with self._lock:
+            np = _np()
+            if self.count == 0:
+                return 0
+            nlist = max(1, min(nlist or int(self.count**0.5), self.count))
+            rng = np.random.default_rng(0)
+            matrix = self._matrix()
+            picks = np.sort(rng.choice(self.count, size=min(sample, self.count), replace=False))
+            training = np.asarray(matrix[picks])
+            centroids = training[rng.choice(len(training), size=nlist, replace=False)]
+            for _ in range(iterations):
+                labels = np.argmax(training @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, labels, training)
+                # Empty cells keep their previous centroid.
+                filled = np.bincount(labels, minlength=nlist) > 0
+                centroids[filled] = sums[filled]
+                centroids = self._normalize(centroids)
+            self._maps.clear()
+            self._centroids = centroids.astype(np.float32)
+            with self._path(".ivf.i32").open("wb") as handle:
+                for start in range(0, self.count, self.CHUNK_ROWS):
+                    self._assign(np.asarray(matrix[start : start + self.CHUNK_ROWS])).tofile(handle)
+            # Centroids are saved last so a half-written build is simply ignored.
+            np.save(self._path(".ivf.npy"), self._centroids)
+            self._publish()
+            return nlist
+
+    def search(
+        self,
+        query: list[float],
+        k: int = 10,
+        conversation_id: int | None = None,
+        nprobe: int = 8,
+    ) -> list[tuple[int, int | None, float]]:
+        """Top-``k`` rows by cosine similarity as (message_id, conversation_id, score)."""
+        with self._lock:
+            np = _np()
+            if self.count == 0 or k <= 0 or len(query) != self.dim:
+                return []
+            q = self._normalize(np.asarray([query], dtype=np.float32))[0]
+            matrix = self._matrix()
+
+            rows: np.ndarray | None = None
+            if self._centroids is not None:
+                cells = np.argsort(-(self._centroids @ q))[:nprobe]
+                rows = np.flatnonzero(np.isin(self._assignments(), cells))
+            if conversation_id is not None:
+                in_conversation = np.flatnonzero(self._conversations() == conversation_id)
+                rows = in_conversation if rows is None else np.intersect1d(rows, in_conversation)
+
+            best_rows = np.empty(0, dtype=np.int64)
+            best_scores = np.empty(0, dtype=np.float32)
+            total = self.count if rows is None else len(rows)
+            for start in range(0, total, self.CHUNK_ROWS):
+                if rows is None:
+                    chunk_rows = np.arange(start, min(start + self.CHUNK_ROWS, total))
+                    scores = np.asarray(matrix[start : start + self.CHUNK_ROWS]) @ q
+                else:
+                    chunk_rows = rows[start : start + self.CHUNK_ROWS]
+                    scores = np.asarray(matrix[chunk_rows]) @ q
+                best_rows = np.concatenate([best_rows, chunk_rows])
+                best_scores = np.concatenate([best_scores, scores])
+                if len(best_scores) > k:
+                    keep = np.argpartition(-best_scores, k)[:k]
+                    best_rows, best_scores = best_rows[keep], best_scores[keep]
+
+            order = np.argsort(-best_scores)
+            ids, convs = self._ids(), self._conversations()
+            results = []
+            for i in order:
+                row = int(best_rows[i])
+                conv = int(convs[row])
+                results.append((int(ids[row]), None if conv < 0 else conv, float(best_scores[i])))
+            return results
+
+    def _publish(self) -> None:
+        self._snapshot = {
+            "model": self.model,
+            "dim": self.dim,
+            "rows": self.count,
+            "last_message_id": self._last_id,
+            "mode": "ivf" if self._centroids is not None else "flat",
+            "ivf_cells": None if self._centroids is None else int(self._centroids.shape[0]),
+        }
+
+    def metrics(self) -> dict:
+        """State as of the last completed write; never blocks."""
+        return dict(self._snapshot)
@@ -0,0 +1,114 @@
+import sqlite3
+
+import pytest
+
+from src.backend.db import ConnectionPool
+
+
+def test_pool_reuses_tuned_connections(tmp_path) -> None:
+    pool = ConnectionPool(tmp_path / "chat.db", max_idle=1)
+    conn = pool.acquire()
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+    assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.commit()
+    conn.execute("INSERT INTO t VALUES (1)")
+    conn.close()  # uncommitted insert is rolled back on release
+
+    again = pool.acquire()
+    assert again is conn
+    assert again.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+    other = pool.acquire()
+    again.close()
+    other.close()  # beyond max_idle: really closed
+    assert pool.metrics() == {"idle": 1, "opened_total": 2, "reused_total": 1}
+    with pytest.raises(sqlite3.ProgrammingError):
+        other.execute("SELECT 1")
+
+    reader = ConnectionPool(tmp_path / "chat.db", readonly=True).acquire()
+    assert reader.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+    with pytest.raises(sqlite3.OperationalError):
+        reader.execute("INSERT INTO t VALUES (2)")
+    reader.close()
+    pool.close()
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.mark.anyio
+async def test_db_work_runs_off_the_event_loop() -> None:
+    import asyncio
+    import threading
+    import time
+
+    from src.backend import db
+
+    threads = []
+
+    def slow_write() -> str:
+        threads.append(threading.current_thread().name)
+        time.sleep(0.2)
+        return "written"
+
+    ticks = 0
+
+    async def ticker() -> None:
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    task = asyncio.create_task(ticker())
+    first, second = await asyncio.gather(db.run_write(slow_write), db.run_write(slow_write))
+    task.cancel()
+
+    assert (first, second) == ("written", "written")
+    # Writes are serialized on the single writer thread...
+    assert threads[0] == threads[1] and threads[0].startswith("mygpt-db-write")
+    # ...while the loop kept running.
+    assert ticks >= 20
+
+
+@pytest.mark.anyio
+async def test_group_commit_batches_writes_and_isolates_failures(tmp_path) -> None:
+    import asyncio
+
+    from src.backend.db import GroupCommitWriter
+
+    pool = ConnectionPool(tmp_path / "chat.db")
+    setup = pool.acquire()
+    setup.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, x INTEGER)")
+    setup.commit()
+    setup.close()
+    writer = GroupCommitWriter(pool.acquire, max_batch=8)
+
+    def insert(x: int):
+        def _op(conn: sqlite3.Connection) -> int:
+            if x < 0:
+                conn.execute("INSERT INTO t (x) VALUES (?)", (x,))
+                raise ValueError("bad row")
+            return int(conn.execute("INSERT INTO t (x) VALUES (?)", (x,)).lastrowid)
+
+        return writer.submit(_op)
+
+    results = await asyncio.gather(*(insert(x) for x in [1, 2, -1, 3]), return_exceptions=True)
+    assert results[:2] == [1, 2] and results[3] == 3
+    assert isinstance(results[2], ValueError)
+    with pytest.raises(RuntimeError):
+        await writer.submit(lambda conn: conn.commit())
+
+    # Twenty concurrent writers: the first goes alone, the rest queue behind it.
+    ids = await asyncio.gather(*(insert(x) for x in range(20)))
+    assert len(set(ids)) == 20
+    assert writer.metrics()["largest_batch"] == 8
+    assert writer.batches_total < writer.ops_total
+
+    check = pool.acquire()
+    assert check.execute("SELECT COUNT(*) FROM t WHERE x < 0").fetchone()[0] == 0
+    assert check.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 23
+    check.close()
+    pool.close()
@@ -0,0 +1,68 @@
+import sqlite3
+
+from src.backend import migrations
+from src.backend.history_cache import HistoryCache, HistoryMessage, load_history
+
+
+def _db() -> sqlite3.Connection:
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    migrations.migrate(conn)
+    conn.execute("INSERT INTO conversations (title) VALUES ('a'), ('b')")
+    return conn
+
+
+def _add(conn: sqlite3.Connection, conversation_id: int, content: str, role: str = "user") -> int:
+    message_id = conn.execute(
+        "INSERT INTO messages (content, role) VALUES (?, ?)", (content, role)
+    ).lastrowid
+    conn.execute(
+        "INSERT INTO conversation_messages (conversation_id, message_id) VALUES (?, ?)",
+        (conversation_id, message_id),
+    )
+    return message_id
+
+
+def test_history_message_reads_like_a_row_dict() -> None:
+    message = HistoryMessage(3, "hi", "user", "2024-01-01 00:00:00", None)
+    assert message["role"] == "user" and message.get("content") == "hi"
+    assert message.get("missing", "x") == "x"
+    assert dict(message) == {
+        "id": 3,
+        "content": "hi",
+        "role": "user",
+        "timestamp": "2024-01-01 00:00:00",
+        "corrects_message_id": None,
+    }
+    assert not hasattr(message, "__dict__")
+
+
+def test_load_history_only_reads_newer_messages() -> None:
+    conn = _db()
+    first = _add(conn, 1, "q1")
+    _add(conn, 2, "other")
+    history = load_history(conn, 1, [])
+    assert [m.content for m in history] == ["q1"]
+
+    second = _add(conn, 1, "a1", "assistant")
+    extended = load_history(conn, 1, history)
+    assert [m.id for m in extended] == [first, second]
+    assert extended[0] is history[0]  # cached records are reused, not re-read
+
+
+def test_cache_keeps_longest_prefix_and_evicts_lru() -> None:
+    conn = _db()
+    _add(conn, 1, "q1")
+    older = load_history(conn, 1, [])
+    _add(conn, 1, "a1", "assistant")
+    newer = load_history(conn, 1, older)
+
+    cache = HistoryCache(max_conversations=1)
+    assert cache.get(1) == [] and 1 not in cache
+    cache.put(1, newer)
+    cache.put(1, older)  # a late, shorter snapshot is ignored
+    assert [m.id for m in cache.get(1)] == [m.id for m in newer]
+
+    cache.put(2, load_history(conn, 2, []))
+    assert 1 not in cache and 2 in cache
+    assert cache.metrics()["hits"] == 1 and cache.metrics()["misses"] == 1
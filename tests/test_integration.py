@@ -1,16 +1,18 @@
+import asyncio
+import json
 import os
+import shutil
 import sqlite3
 from typing import Any
 
 import pytest
+from fastapi import Request
 from fastapi.testclient import TestClient
 from pathlib import Path
 
 # Set env vars before importing app to use tmp db
-# We use a fixture to handle this cleanly, but importing app at top level 
-# might trigger init_db on the default path if we aren't careful.
-# app.py calls init_db() at module level? Yes.
-# So we need to set the env var *before* import.
+# app.py reads MYGPT_DB_PATH at import (init_db itself runs lazily on the
+# first connection), so we need to set the env var *before* import.
 # But we can't easily do that in a test file if we import at top level.
 # So we will set os.environ here before import.
 
@@ -22,9 +24,14 @@ import tempfile
 temp_db = tempfile.NamedTemporaryFile(delete=False)
 temp_db.close()
 os.environ["MYGPT_DB_PATH"] = temp_db.name
+# Logs, startup markers and LLM logs all live under the data dir; keep the
+# lifespan-running tests from writing into the repo's data/.
+temp_data_dir = tempfile.mkdtemp(prefix="mygpt-test-data-")
+os.environ["MYGPT_DATA_DIR"] = temp_data_dir
 
 from src.backend.app import app
 import src.backend.app as app_module
+from src.backend import model_gateway
 
 client = TestClient(app)
 
@@ -33,6 +40,7 @@ def teardown_module():
         os.unlink(temp_db.name)
     except:
         pass
+    shutil.rmtree(temp_data_dir, ignore_errors=True)
 
 def test_message_immutability():
     # 1. Create a message
@@ -131,7 +139,7 @@ def test_preference_proposal_after_tokens():
 def test_pending_proposal_does_not_affect_prompt(monkeypatch):
     captured = {}
 
-    def fake_build_prompt(history, preferences=None):
+    def fake_build_prompt(history, preferences=None, **_):
         captured["preferences"] = dict(preferences or {})
         return "PROMPT"
 
@@ -165,3 +173,371 @@ def test_pending_proposal_does_not_affect_prompt(monkeypatch):
     pref_count = conn.execute("SELECT COUNT(*) FROM preferences").fetchone()[0]
     conn.close()
     assert pref_count == 0
+
+
+def test_rolling_summary_replaces_old_turns(monkeypatch):
+    monkeypatch.setenv("MYGPT_SUMMARIZE", "1")
+    monkeypatch.setenv("MYGPT_SUMMARY_KEEP_MESSAGES", "2")
+    monkeypatch.setenv("MYGPT_SUMMARY_STEP", "2")
+    monkeypatch.setenv("MYGPT_FALLBACK_STREAM_DELAY_S", "0")
+
+    summarized: list[list[int]] = []
+
+    async def fake_summarize(messages, previous_summary=None, model_url=None):
+        summarized.append([m["id"] for m in messages])
+        return f"summary of {len(messages)} messages"
+
+    captured = {}
+    real_build_prompt = app_module.model_build_prompt
+
+    def spy_build_prompt(history, preferences=None, **kwargs):
+        captured["history"] = [m["id"] for m in history]
+        captured["summary"] = kwargs.get("summary")
+        return real_build_prompt(history, preferences=preferences, **kwargs)
+
+    monkeypatch.setattr(app_module, "model_summarize", fake_summarize)
+    monkeypatch.setattr(app_module, "model_build_prompt", spy_build_prompt)
+
+    import time
+
+    with TestClient(app) as local_client:
+        conv_id = local_client.post("/conversations", json={"title": "Summary"}).json()["id"]
+        for text in ["first question", "second question", "third question"]:
+            _read_sse_events(
+                local_client.post("/chat", json={"conversation_id": conv_id, "content": text})
+            )
+
+        summaries = []
+        for _ in range(50):
+            summaries = local_client.get(f"/conversations/{conv_id}/summaries").json()["summaries"]
+            if summaries:
+                break
+            time.sleep(0.02)
+
+        assert len(summarized) == 1 and len(summarized[0]) == 3
+        assert summaries[0]["covers_through_message_id"] == summarized[0][-1]
+        assert summaries[0]["covered_count"] == 3
+
+        _read_sse_events(
+            local_client.post("/chat", json={"conversation_id": conv_id, "content": "fourth question"})
+        )
+        assert captured["summary"] == "summary of 3 messages"
+        assert min(captured["history"]) > summarized[0][-1]
+
+
+def test_exact_completion_cache_replays_deterministic_answers(monkeypatch):
+    monkeypatch.setenv("MYGPT_TEMPERATURE", "0")
+    calls = []
+
+    async def fake_generate(messages, **kwargs):
+        calls.append(kwargs.get("prompt"))
+        for token in ["Cached ", "answer ", "text"]:
+            yield token
+
+    monkeypatch.setattr(app_module, "model_generate", fake_generate)
+
+    def ask(title):
+        conv_id = client.post("/conversations", json={"title": title}).json()["id"]
+        res = client.post(
+            "/chat", json={"conversation_id": conv_id, "content": "What is a cache key?"}
+        )
+        return conv_id, _read_sse_events(res)
+
+    _, first = ask("Cache A")
+    conv_b, second = ask("Cache B")
+
+    assert len(calls) == 1
+    assert not any("cached" in e for e in first)
+    assert second[0] == {"cached": {"kind": "exact"}}
+    assert "".join(e["token"] for e in second if "token" in e) == "Cached answer text"
+
+    msgs = client.get(f"/messages?conversation_id={conv_b}").json()
+    assert msgs[-1]["content"] == "Cached answer text"
+
+    # Regenerate never replays from the cache unless asked to.
+    res = client.post(
+        "/regenerate", json={"conversation_id": conv_b, "target_message_id": msgs[-1]["id"]}
+    )
+    events = _read_sse_events(res)
+    assert len(calls) == 2
+    assert not any("cached" in e for e in events)
+
+
+def test_semantic_cache_serves_near_duplicate_questions(monkeypatch):
+    monkeypatch.setenv("MYGPT_SEMANTIC_CACHE", "1")
+    monkeypatch.setenv("MYGPT_COMPLETION_CACHE", "0")
+    monkeypatch.setattr(app_module, "semantic_cache", app_module.SemanticCache(threshold=0.9))
+    calls = []
+
+    async def fake_embed(texts, model_url=None, **_):
+        # "reset" questions land close together, everything else far away.
+        return [[1.0, 0.1] if "reset" in t.lower() else [0.0, 1.0] for t in texts]
+
+    async def fake_generate(messages, **kwargs):
+        calls.append(messages[-1]["content"])
+        for token in ["Use ", "the ", "reset ", "button."]:
+            yield token
+
+    monkeypatch.setattr(app_module, "model_embed", fake_embed)
+    monkeypatch.setattr(app_module, "model_generate", fake_generate)
+
+    def ask(content):
+        conv_id = client.post("/conversations", json={"title": content}).json()["id"]
+        res = client.post("/chat", json={"conversation_id": conv_id, "content": content})
+        return conv_id, _read_sse_events(res)
+
+    _, first = ask("How do I reset prefs")
+    conv_b, second = ask("reset my preferences?")
+    _, third = ask("What is the weather?")
+
+    assert calls == ["How do I reset prefs", "What is the weather?"]
+    assert not any("cached" in e for e in first)
+    assert second[0]["cached"]["kind"] == "semantic"
+    assert second[0]["cached"]["similarity"] >= 0.9
+    assert "".join(e["token"] for e in second if "token" in e) == "Use the reset button."
+    assert not any("cached" in e for e in third)
+
+    msgs = client.get(f"/messages?conversation_id={conv_b}").json()
+    assert msgs[-1]["content"] == "Use the reset button."
+
+    # Follow-ups depend on their conversation and are never served from the cache.
+    res = client.post("/chat", json={"conversation_id": conv_b, "content": "and reset again?"})
+    assert not any("cached" in e for e in _read_sse_events(res))
+    assert len(calls) == 3
+
+
+def test_semantic_search_indexes_new_messages(monkeypatch, tmp_path):
+    monkeypatch.setenv("MYGPT_VECTOR_INDEX", "1")
+    monkeypatch.setenv("MYGPT_VECTOR_INDEX_PATH", str(tmp_path / "chat.vectors"))
+    monkeypatch.setattr(app_module, "_VECTOR_INDEX", None)
+    monkeypatch.setattr(app_module, "_VECTOR_INDEX_TASK", None)
+
+    async def fake_embed(texts, model_url=None, **_):
+        # Bag of words over a tiny hashed vocabulary.
+        vectors = []
+        for text in texts:
+            vector = [0.0] * 32
+            for word in text.lower().split():
+                vector[sum(map(ord, word.strip("?.!"))) % 32] += 1.0
+            vectors.append(vector)
+        return vectors
+
+    monkeypatch.setattr(app_module, "model_embed", fake_embed)
+
+    with TestClient(app) as local_client:
+        conv_id = local_client.post("/conversations", json={"title": "Search"}).json()["id"]
+        ids = {}
+        for content in ["pasta recipe with garlic", "fixing a flat bicycle tire", "garden tomatoes"]:
+            res = local_client.post(
+                "/messages",
+                json={"conversation_id": conv_id, "role": "user", "content": content},
+            )
+            ids[content] = res.json()["id"]
+
+        res = local_client.get(
+            "/search/semantic",
+            params={"q": "bicycle tire", "conversation_id": conv_id, "k": 2},
+        )
+        assert res.status_code == 200
+        body = res.json()
+        assert body["results"][0]["message_id"] == ids["fixing a flat bicycle tire"]
+        assert body["results"][0]["conversation_id"] == conv_id
+        assert len(body["results"]) == 2
+        assert body["index"]["last_message_id"] >= ids["garden tomatoes"]
+
+
+def test_full_text_search_endpoint():
+    conv_id = client.post("/conversations", json={"title": "FTS"}).json()["id"]
+    for content in ["Kubernetes pod eviction", "pods get evicted under memory pressure", "lunch"]:
+        client.post(
+            "/messages", json={"conversation_id": conv_id, "role": "user", "content": content}
+        )
+
+    res = client.get("/search", params={"q": "eviction", "conversation_id": conv_id})
+    assert res.status_code == 200
+    body = res.json()
+    assert [r["snippet"] for r in body["results"]] == ["Kubernetes pod <mark>eviction</mark>"]
+    assert body["next_cursor"] is None
+
+    res = client.get("/search", params={"q": "pod*", "syntax": "fts", "conversation_id": conv_id})
+    assert len(res.json()["results"]) == 2
+
+    res = client.get("/search", params={"q": "lunch", "scope": "events", "event_type": "user_prompt"})
+    assert res.status_code == 200
+
+    assert client.get("/search", params={"q": '"unbalanced', "syntax": "fts"}).status_code == 400
+    assert client.get("/search", params={"q": "pod", "cursor": "!!"}).status_code == 400
+
+
+def test_keyset_pagination():
+    conv_id = client.post("/conversations", json={"title": "Paged"}).json()["id"]
+    ids = [
+        client.post(
+            "/messages", json={"conversation_id": conv_id, "role": "user", "content": f"m{i}"}
+        ).json()["id"]
+        for i in range(5)
+    ]
+
+    # Unpaginated requests keep their original shape.
+    assert [m["id"] for m in client.get("/messages", params={"conversation_id": conv_id}).json()] == ids
+    assert isinstance(client.get("/conversations").json(), list)
+
+    page = client.get("/messages", params={"conversation_id": conv_id, "limit": 2}).json()
+    assert [m["id"] for m in page["messages"]] == ids[3:]
+    assert page["next_cursor"] == ids[3]
+    page = client.get(
+        "/messages", params={"conversation_id": conv_id, "limit": 2, "before_id": page["next_cursor"]}
+    ).json()
+    assert [m["id"] for m in page["messages"]] == ids[1:3]
+    page = client.get(
+        "/messages", params={"conversation_id": conv_id, "limit": 2, "before_id": page["next_cursor"]}
+    ).json()
+    assert [m["id"] for m in page["messages"]] == ids[:1]
+    assert page["next_cursor"] is None
+    page = client.get(
+        "/messages", params={"conversation_id": conv_id, "limit": 3, "after_id": ids[0]}
+    ).json()
+    assert [m["id"] for m in page["messages"]] == ids[1:4]
+    assert page["next_cursor"] == ids[3]
+
+    page = client.get("/conversations", params={"limit": 1}).json()
+    assert page["conversations"][0] == {
+        **page["conversations"][0], "id": conv_id, "message_count": 5
+    }
+    older = client.get("/conversations", params={"limit": 1, "before_id": page["next_cursor"]}).json()
+    assert older["conversations"][0]["id"] < conv_id
+
+    # sort=activity: the conversation that got a message most recently comes first.
+    other_id = client.post("/conversations", json={"title": "Idle"}).json()["id"]
+    client.post("/messages", json={"conversation_id": conv_id, "role": "user", "content": "again"})
+    active = client.get("/conversations", params={"sort": "activity", "limit": 2}).json()
+    assert [c["id"] for c in active["conversations"]][0] == conv_id
+    assert active["conversations"][0]["last_role"] == "user"
+    rest = client.get(
+        "/conversations", params={"sort": "activity", "limit": 500, "before_id": conv_id}
+    ).json()["conversations"]
+    assert other_id in [c["id"] for c in rest] and conv_id not in [c["id"] for c in rest]
+
+    latest = client.get("/events", params={"limit": 2}).json()
+    first, second = [e["id"] for e in latest["events"]]
+    assert first > second and latest["next_cursor"] == second
+    page = client.get("/events", params={"limit": 1, "before_id": first}).json()
+    assert [e["id"] for e in page["events"]] == [second]
+    newer = client.get("/events", params={"after_id": first}).json()
+    assert newer["events"] == [] and newer["next_cursor"] is None
+
+
+def test_repetition_loop_is_cut_and_flagged(monkeypatch):
+    monkeypatch.setenv("MYGPT_REPETITION_NGRAM", "3")
+    monkeypatch.setenv("MYGPT_REPETITION_MAX_REPEATS", "4")
+    pulled = []
+
+    async def fake_generate(*args, **kwargs):
+        yield "Here we go: "
+        for _ in range(10000):
+            for token in ("la", " la", " lo"):
+                pulled.append(token)
+                yield token
+
+    monkeypatch.setattr(app_module, "model_generate", fake_generate)
+    conv_id = client.post("/conversations", json={"title": "Loop"}).json()["id"]
+    res = client.post("/chat", json={"conversation_id": conv_id, "content": "Sing"})
+    _read_sse_events(res)
+
+    assert len(pulled) < 30  # the upstream stream was closed, not drained
+    msgs = client.get(f"/messages?conversation_id={conv_id}").json()
+    assert msgs[-1]["content"].startswith("Here we go: la la lo")
+    assert msgs[-1]["content"].endswith("[truncated]")
+
+    events = client.get(
+        f"/events?conversation_id={conv_id}&event_type=assistant_response"
+    ).json()["events"]
+    assert json.loads(events[0]["payload_json"])["truncated"] is True
+    assert sum(client.get("/metrics").json()["repetition_stops"].values()) >= 1
+
+
+def test_interrupted_generation_is_saved_as_truncated(monkeypatch):
+    async def fake_generate(*args, **kwargs):
+        yield "Half an"
+        raise model_gateway.GenerationInterrupted("connection reset")
+
+    monkeypatch.setattr(app_module, "model_generate", fake_generate)
+    conv_id = client.post("/conversations", json={"title": "Interrupted"}).json()["id"]
+    res = client.post("/chat", json={"conversation_id": conv_id, "content": "Explain"})
+    events = _read_sse_events(res)
+
+    assert {"error": "Model stream interrupted"} in events
+    assert events[-1] == {"done": True}
+    msgs = client.get(f"/messages?conversation_id={conv_id}").json()
+    assert msgs[-1]["content"] == "Half an\n\n[truncated]"
+
+
+def test_chat_stream_cancellation_propagates(monkeypatch):
+    async def fake_generate(*args, **kwargs):
+        yield "partial"
+        await asyncio.sleep(30)
+        yield " never"
+
+    monkeypatch.setattr(app_module, "model_generate", fake_generate)
+    conv_id = client.post("/conversations", json={"title": "Cancelled"}).json()["id"]
+
+    async def scenario():
+        async def receive():
+            await asyncio.sleep(3600)  # the client never disconnects
+            return {"type": "http.disconnect"}
+
+        request = Request({"type": "http", "method": "POST", "headers": []}, receive)
+        response = await app_module.chat(
+            app_module.ChatRequest(content="Hi", conversation_id=conv_id, flush_ms=0),
+            request,
+        )
+        frames = []
+
+        async def consume():
+            async for frame in response.body_iterator:
+                frames.append(frame)
+
+        task = asyncio.ensure_future(consume())
+        while not any(b"partial" in f for f in frames):
+            await asyncio.sleep(0.01)
+        task.cancel()  # e.g. server shutdown, not a client disconnect
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+
+    # The partial answer is still persisted on the way out.
+    msgs = client.get(f"/messages?conversation_id={conv_id}").json()
+    assert msgs[-1]["content"] == "partial\n\n[stopped]"
+
+
+def test_unknown_referenced_rows_are_rejected_before_writing():
+    conv_id = client.post("/conversations", json={"title": "References"}).json()["id"]
+    msg_id = client.post(
+        "/messages", json={"conversation_id": conv_id, "role": "user", "content": "Hi"}
+    ).json()["id"]
+
+    res = client.post(
+        "/messages",
+        json={"conversation_id": conv_id, "role": "user", "content": "Fix", "corrects_message_id": 99999},
+    )
+    assert res.status_code == 404
+    assert [m["content"] for m in client.get(f"/messages?conversation_id={conv_id}").json()] == ["Hi"]
+
+    res = client.post(
+        "/tools/run",
+        json={"tool_id": "stat_path", "tool_input": {"path": "."}, "causality_message_id": 424242},
+    )
+    assert res.status_code == 404
+    res = client.post(
+        "/tools/run",
+        json={"tool_id": "stat_path", "tool_input": {"path": "."}, "causality_message_id": msg_id},
+    )
+    assert res.status_code == 200
+    events = client.get(f"/events?conversation_id={conv_id}&event_type=tool_run").json()["events"]
+    assert len(events) == 1 and events[0]["causality_message_id"] == msg_id
+
+    res = client.post("/preferences/reset?causality_message_id=424242")
+    assert res.status_code == 404
+    res = client.post("/preferences/reset?conversation_id=424242")
+    assert res.status_code == 404
@@ -0,0 +1,86 @@
+import sqlite3
+
+import pytest
+
+from src.backend import migrations
+
+
+def _indexes(conn: sqlite3.Connection) -> set[str]:
+    return {
+        r[0]
+        for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'")
+    }
+
+
+def test_migrate_fresh_and_legacy_databases(tmp_path) -> None:
+    fresh = sqlite3.connect(tmp_path / "fresh.db")
+    assert migrations.migrate(fresh) == migrations.LATEST_VERSION
+    assert "idx_events_type" in _indexes(fresh)
+    assert migrations.migrate(fresh) == migrations.LATEST_VERSION  # no-op on rerun
+
+    # A database created before versioning: tables exist, user_version is 0.
+    legacy = sqlite3.connect(tmp_path / "legacy.db")
+    legacy.executescript(migrations.BASELINE_PATH.read_text(encoding="utf-8"))
+    legacy.execute("INSERT INTO messages (content, role) VALUES ('hi', 'user')")
+    legacy.commit()
+    assert migrations.current_version(legacy) == 0
+    assert migrations.migrate(legacy, target=1) == 1
+    assert "idx_events_type" not in _indexes(legacy)
+    assert migrations.migrate(legacy) == migrations.LATEST_VERSION
+    assert _indexes(legacy) == _indexes(fresh)
+    assert legacy.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 1
+
+    legacy.execute(f"PRAGMA user_version = {migrations.LATEST_VERSION + 1}")
+    with pytest.raises(RuntimeError):
+        migrations.migrate(legacy)
+
+
+def test_failed_migration_keeps_previous_version(tmp_path, monkeypatch) -> None:
+    conn = sqlite3.connect(tmp_path / "chat.db")
+    migrations.migrate(conn)
+    broken = migrations.Migration(
+        migrations.LATEST_VERSION + 1,
+        "broken",
+        "CREATE TABLE half_done (x INTEGER); SELECT * FROM missing_table;",
+    )
+    monkeypatch.setattr(migrations, "MIGRATIONS", [*migrations.MIGRATIONS, broken])
+    monkeypatch.setattr(migrations, "LATEST_VERSION", broken.version)
+    with pytest.raises(sqlite3.OperationalError):
+        migrations.migrate(conn, target=broken.version)
+    assert migrations.current_version(conn) == broken.version - 1
+    assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'half_done'").fetchone() is None
+
+
+def test_conversation_stats_backfill_and_triggers(tmp_path) -> None:
+    conn = sqlite3.connect(tmp_path / "chat.db")
+    migrations.migrate(conn, target=2)
+    conn.executescript(
+        """
+        INSERT INTO conversations (title) VALUES ('a'), ('b'), ('empty');
+        INSERT INTO messages (content, role) VALUES ('q1', 'user'), ('a1', 'assistant'), ('q2', 'user');
+        INSERT INTO conversation_messages (conversation_id, message_id) VALUES (1, 1), (1, 2), (2, 3);
+        """
+    )
+    migrations.migrate(conn)
+
+    def stats() -> list[tuple]:
+        return conn.execute(
+            "SELECT conversation_id, message_count, last_message_id, last_role "
+            "FROM conversation_stats ORDER BY conversation_id"
+        ).fetchall()
+
+    assert stats() == [(1, 2, 2, "assistant"), (2, 1, 3, "user"), (3, 0, 0, None)]
+
+    conn.execute("INSERT INTO conversations (title) VALUES ('new')")
+    conn.execute("INSERT INTO messages (content, role) VALUES ('q3', 'user')")
+    conn.execute("INSERT INTO conversation_messages (conversation_id, message_id) VALUES (3, 4)")
+    # Duplicates are ignored and an older message mapped late does not
+    # become the conversation's last message.
+    conn.execute("INSERT OR IGNORE INTO conversation_messages (conversation_id, message_id) VALUES (3, 4)")
+    conn.execute("INSERT INTO conversation_messages (conversation_id, message_id) VALUES (3, 1)")
+    assert stats() == [
+        (1, 2, 2, "assistant"),
+        (2, 1, 3, "user"),
+        (3, 2, 4, "user"),
+        (4, 0, 0, None),
+    ]
@@ -0,0 +1,362 @@
+import pytest
+
+from src.backend import model_gateway
+from src.backend.model_gateway import ModelClient
+
+
+@pytest.mark.anyio
+async def test_model_client_reuses_and_retires_pools() -> None:
+    client = ModelClient(connect_timeout_s=1.0, read_timeout_s=5.0)
+    first = client.client_for("http://127.0.0.1:8081/")
+    assert client.client_for("http://127.0.0.1:8081") is first
+
+    client.client_for("http://127.0.0.1:8082")
+    await client.retarget("http://127.0.0.1:8082")
+
+    metrics = client.metrics()
+    assert list(metrics["pools"]) == ["http://127.0.0.1:8082"]
+    assert metrics["clients_created"] == 2
+    assert first.is_closed
+    await client.aclose()
+
+
+@pytest.mark.anyio
+async def test_check_health_unreachable_server() -> None:
+    assert model_gateway.get_model_client() is None
+    assert await model_gateway.check_health("http://127.0.0.1:9", timeout_s=0.5) is False
+
+
+def test_slot_affinity_pins_conversations_to_lru_slot() -> None:
+    slots = model_gateway.SlotAffinity(2)
+    assert slots.slot_for(None) is None
+    assert slots.slot_for(10) == 0
+    assert slots.slot_for(11) == 1
+    assert slots.slot_for(10) == 0
+
+    # Slot 1 is now least recently used, so conversation 12 takes it over.
+    assert slots.slot_for(12) == 1
+    assert slots.slot_for(11) == 0
+    assert slots.snapshot()["assignments"] == {"12": 1, "11": 0}
+
+
+def test_slot_affinity_prefers_idle_slot(monkeypatch) -> None:
+    slots = model_gateway.SlotAffinity(2)
+    busy = slots.slot_for(10)
+    slots.acquire(busy)
+    slots.slot_for(11)
+    # Slot 0 is least recently used but still generating for conversation 10.
+    assert slots.slot_for(12) == 1
+    slots.release(busy)
+    assert slots.slot_for(13) == 0
+    assert slots.snapshot()["in_flight"] == [0, 0]
+
+    monkeypatch.setenv("MYGPT_LLAMA_PARALLEL", "four")
+    assert model_gateway._default_parallel() == 2
+    monkeypatch.setenv("MYGPT_LLAMA_PARALLEL", "4")
+    assert model_gateway._default_parallel() == 4
+
+
+def test_prompt_cache_matches_full_assembly() -> None:
+    cache = model_gateway.PromptCache(max_entries=4)
+    history = [
+        {"id": 1, "role": "user", "content": "Hi"},
+        {"id": 2, "role": "assistant", "content": "<think>hmm</think>Hello\nUser: fake"},
+    ]
+    assert cache.build(7, history) == model_gateway._assemble_prompt(history)
+
+    history = history + [{"id": 3, "role": "user", "content": "Be brief"}]
+    prefs = {"verbosity": "concise"}
+    assert cache.build(7, history) == model_gateway._assemble_prompt(history)
+    assert cache.build(7, history, preferences=prefs) == model_gateway._assemble_prompt(
+        history, preferences=prefs
+    )
+    assert cache.hits == 1
+    assert cache.misses == 2
+
+    # Regenerate drops a message from the middle; the cache must rebuild.
+    trimmed = [history[0], history[2]]
+    assert cache.build(7, trimmed, preferences=prefs) == model_gateway._assemble_prompt(
+        trimmed, preferences=prefs
+    )
+    assert cache.misses == 3
+
+    # With a preferences version the dict is not compared; a new version rebuilds.
+    cache.build(7, trimmed, preferences=prefs, preferences_version=5)
+    cache.build(7, trimmed, preferences=prefs, preferences_version=5)
+    assert (cache.hits, cache.misses) == (2, 4)
+    cache.build(7, trimmed, preferences={}, preferences_version=6)
+    assert cache.misses == 5
+
+
+@pytest.mark.anyio
+async def test_context_window_drops_oldest_turns_with_stable_start() -> None:
+    window = model_gateway.ContextWindow(ctx_size=100_000, margin_tokens=0, low_water=0.5)
+    system_tokens = window.estimate_tokens(
+        "\n".join(model_gateway._system_block(None)) + "\nAssistant: "
+    )
+    window.ctx_size = system_tokens + 16 + 120
+
+    def turn(i: int) -> dict:
+        return {"id": i, "role": "user" if i % 2 else "assistant", "content": "x" * 60}
+
+    history = [turn(i) for i in range(1, 5)]
+    fit = await window.fit(history, conversation_id=1, n_predict=16)
+    assert fit.dropped_count == 0
+    assert fit.token_source == "estimate"
+
+    history = [turn(i) for i in range(1, 9)]
+    fit = await window.fit(history, conversation_id=1, n_predict=16)
+    assert fit.dropped_count > 0
+    assert fit.prompt_tokens <= window.ctx_size - 16
+    assert fit.messages[0]["role"] == "user"
+    assert fit.included_ids == [m["id"] for m in history[fit.dropped_count :]]
+
+    # The next turn keeps the same window start while it still fits.
+    first_id = fit.included_ids[0]
+    history.append(turn(9))
+    again = await window.fit(history, conversation_id=1, n_predict=16)
+    assert again.included_ids[0] == first_id
+
+
+def test_parse_model_urls_accepts_lists() -> None:
+    assert model_gateway.parse_model_urls("http://a:1/, http://b:2 http://a:1") == [
+        "http://a:1",
+        "http://b:2",
+    ]
+    assert model_gateway.parse_model_urls(["http://a:1"]) == ["http://a:1"]
+
+
+@pytest.mark.anyio
+async def test_endpoint_pool_routes_least_outstanding_and_sticks() -> None:
+    pool = model_gateway.EndpointPool(["http://a:1", "http://b:2"], eject_s=60, sticky_slack=1)
+
+    first = await pool.choose(1)
+    pool.acquire(first)
+    second = await pool.choose(2)
+    assert second is not first
+
+    # Conversation 1 stays on its endpoint while it is within the slack.
+    pool.acquire(second)
+    pool.acquire(second)
+    assert await pool.choose(1) is first
+
+    # A failed endpoint is ejected and traffic moves to the other one.
+    pool.release(first, failed=True)
+    assert await pool.choose(1) is second
+    assert pool.metrics()["http://a:1"]["failures_total"] == 1
+
+
+@pytest.mark.anyio
+async def test_endpoint_pool_probes_before_readmitting(monkeypatch) -> None:
+    probes = []
+    healthy = {"http://a:1": False}
+
+    async def fake_check_health(url, timeout_s):
+        probes.append(url)
+        return healthy.get(url, True)
+
+    monkeypatch.setattr(model_gateway, "check_health", fake_check_health)
+    pool = model_gateway.EndpointPool(["http://a:1", "http://b:2"], eject_s=0.0, sticky_slack=1)
+    a, b = pool.endpoints
+    pool.acquire(a)
+    pool.release(a, failed=True)
+
+    # The ejection has expired, but a still fails /health and gets no traffic.
+    assert await pool.choose(1) is b
+    assert probes == ["http://a:1"]
+    pool.acquire(b)
+    assert await pool.choose(2) is b
+
+    healthy["http://a:1"] = True
+    assert await pool.choose(3) is a
+    assert await pool.choose(4) is a  # readmitted; no further probes
+    assert probes == ["http://a:1"] * 3
+
+
+def test_parse_embeddings_handles_server_shapes():
+    assert model_gateway._parse_embeddings({"embedding": [1, 2]}) == [[1.0, 2.0]]
+    assert model_gateway._parse_embeddings(
+        [{"index": 1, "embedding": [[3, 4]]}, {"index": 0, "embedding": [[1, 2], [3, 4]]}]
+    ) == [[2.0, 3.0], [3.0, 4.0]]
+
+
+
+@pytest.mark.anyio
+# The embedding batcher is built on asyncio futures and timers.
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+async def test_embed_coalesces_callers_and_caches_vectors(monkeypatch, tmp_path) -> None:
+    import asyncio
+    import sqlite3
+    from contextlib import asynccontextmanager
+    from pathlib import Path
+
+    import httpx
+
+    from src.backend.embedding_cache import EmbeddingStore
+
+    db_path = tmp_path / "embed.db"
+    schema = Path(model_gateway.__file__).with_name("schema.sql").read_text(encoding="utf-8")
+    init = sqlite3.connect(db_path)
+    init.executescript(schema)
+    init.close()
+
+    def connect() -> sqlite3.Connection:
+        conn = sqlite3.connect(db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def connect_read() -> sqlite3.Connection:
+        conn = connect()
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    posts = []
+
+    class FakeClient:
+        async def post(self, url, json, timeout):
+            posts.append(json["content"])
+            data = [
+                {"index": i, "embedding": [[float(len(t)), 0.5]]}
+                for i, t in enumerate(json["content"])
+            ]
+            return httpx.Response(200, json=data, request=httpx.Request("POST", url))
+
+    @asynccontextmanager
+    async def fake_model_client():
+        yield FakeClient()
+
+    monkeypatch.setenv("MYGPT_EMBED_URL", "http://embed:1")
+    monkeypatch.setattr(model_gateway, "_model_client", fake_model_client)
+    monkeypatch.setattr(model_gateway, "_EMBED_BATCHERS", {})
+    monkeypatch.setattr(model_gateway, "_EMBEDDING_STORE", EmbeddingStore(connect, connect_read))
+
+    first, second = await asyncio.gather(
+        model_gateway.embed(["a", "bb"], model="m1"),
+        model_gateway.embed(["bb", "ccc"], model="m1"),
+    )
+    # Cache lookups run on reader threads, so the callers may enqueue in either order.
+    assert len(posts) == 1 and sorted(posts[0]) == ["a", "bb", "ccc"]
+    assert first == [[1.0, 0.5], [2.0, 0.5]]
+    assert second == [[2.0, 0.5], [3.0, 0.5]]
+
+    # Cached vectors are reused; a different model tag embeds again.
+    assert await model_gateway.embed(["ccc", "a"], model="m1") == [[3.0, 0.5], [1.0, 0.5]]
+    assert len(posts) == 1
+    await model_gateway.embed(["a"], model="m2")
+    assert posts[-1] == ["a"]
+
+
+def _filtered(text: str, size: int) -> tuple[str, str, bool]:
+    output_filter = model_gateway.OutputFilter()
+    streamed = []
+    for i in range(0, len(text), size):
+        streamed.append(output_filter.feed(text[i : i + size]))
+    streamed.append(output_filter.finish())
+    return "".join(streamed), output_filter.text, output_filter.stopped
+
+
+@pytest.mark.parametrize(
+    ("text", "expected", "stopped"),
+    [
+        ("<think>plan</think>Answer", "Answer", False),
+        ("Pre <think>x</think>post", "Pre post", False),
+        ("reasoning</think>\n\nFinal", "Final", False),
+        ("<think>only thinking", "only thinking", False),
+        ("Assistant: Hi \x1b[31mred\x1b[0m", "Hi red", False),
+        ("Answer\nUser: next question", "Answer", True),
+        ("User: quoted first line", "User: quoted first line", False),
+    ],
+)
+def test_output_filter_matches_across_token_boundaries(text, expected, stopped) -> None:
+    results = {size: _filtered(text, size) for size in (1, 2, 3, len(text))}
+    assert {r[1] for r in results.values()} == {expected}
+    assert {r[2] for r in results.values()} == {stopped}
+    assert "<think>" not in results[1][0] and "\x1b" not in results[1][0]
+
+
+@pytest.mark.anyio
+async def test_filter_output_stops_upstream_at_role_marker() -> None:
+    pulled = []
+    closed = []
+
+    async def upstream():
+        try:
+            for token in ["Sure", ".\nUs", "er: and", " more", " text"]:
+                pulled.append(token)
+                yield token
+        finally:
+            closed.append(True)
+
+    output_filter = model_gateway.OutputFilter()
+    out = [t async for t in model_gateway.filter_output(upstream(), output_filter)]
+    assert "".join(out) == "Sure."
+    assert pulled == ["Sure", ".\nUs", "er: and"]
+    assert closed == [True]
+    assert output_filter.raw == "Sure.\nUser: and"
+
+
+def test_repetition_detector_flags_loops_only() -> None:
+    detector = model_gateway.RepetitionDetector(ngram=4, max_repeats=3, window=64)
+    prose = "the quick brown fox jumps over the lazy dog and then the fox naps".split()
+    assert not any(detector.feed(token) for token in prose)
+
+    detector = model_gateway.RepetitionDetector(ngram=4, max_repeats=3, window=64)
+    loop = ["I", " am", " a", " loop", "."] * 5
+    fed = next(i for i, token in enumerate(loop) if detector.feed(token))
+    assert fed == 4 + 5 * 2 - 1  # third occurrence of the first 4-gram
+    assert detector.tripped
+
+    # Repeats spread further apart than the window are not a loop.
+    detector = model_gateway.RepetitionDetector(ngram=2, max_repeats=2, window=8)
+    spaced = ["a", "b"] + [str(i) for i in range(10)] + ["a", "b"]
+    assert not any(detector.feed(token) for token in spaced)
+
+
+@pytest.mark.anyio
+# The echo fallback paces itself with asyncio.sleep.
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+async def test_generate_raises_on_mid_stream_failure_and_ejects_only_server_errors(
+    monkeypatch,
+) -> None:
+    from contextlib import asynccontextmanager
+
+    import httpx
+
+    async def broken_body():
+        yield b'data: {"content": "Hi"}\n\n'
+        raise httpx.ReadError("connection reset")
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "bad-request":
+            return httpx.Response(400, json={"error": "bad"})
+        return httpx.Response(200, content=broken_body())
+
+    @asynccontextmanager
+    async def fake_model_client():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            yield client
+
+    monkeypatch.setattr(model_gateway, "_model_client", fake_model_client)
+    monkeypatch.setattr(model_gateway, "_ENDPOINT_POOLS", {})
+    monkeypatch.setenv("MYGPT_FALLBACK_STREAM_DELAY_S", "0")
+    messages = [{"role": "user", "content": "hello"}]
+
+    tokens = []
+    with pytest.raises(model_gateway.GenerationInterrupted):
+        async for token in model_gateway.generate(messages, model_url="http://reset:1"):
+            tokens.append(token)
+    assert tokens == ["Hi"]
+    assert model_gateway.endpoint_pool("http://reset:1").metrics()["http://reset:1"]["failures_total"] == 1
+
+    # A 4xx is the request's fault: fall back without ejecting the endpoint.
+    info = model_gateway.GenerationInfo()
+    text = "".join(
+        [t async for t in model_gateway.generate(messages, model_url="http://bad-request:1", info=info)]
+    )
+    assert info.fallback and "Echo: hello" in text
+    assert model_gateway.endpoint_pool("http://bad-request:1").metrics()["http://bad-request:1"] == {
+        "outstanding": 0,
+        "requests_total": 1,
+        "failures_total": 0,
+        "ejected_for_s": 0.0,
+    }
@@ -0,0 +1,39 @@
+import sqlite3
+
+from src.backend import migrations
+from src.backend.preference_cache import PreferenceSnapshots, preferences_version
+
+
+def test_snapshot_reloads_only_when_preferences_change(tmp_path) -> None:
+    path = tmp_path / "chat.db"
+    conn = sqlite3.connect(path)
+    migrations.migrate(conn)
+    loads = []
+
+    def load(c: sqlite3.Connection, scope: str) -> dict[str, str]:
+        loads.append(scope)
+        return {k: v for k, v in c.execute("SELECT key, value FROM preferences WHERE scope = ?", (scope,))}
+
+    snapshots = PreferenceSnapshots(load)
+    version, prefs = snapshots.get(conn)
+    assert (version, prefs) == (0, {})
+    prefs["mutated"] = "by caller"
+    assert snapshots.get(conn) == (0, {})
+    assert loads == ["global"]
+
+    # Another process appends a preference: the version moves without any
+    # invalidate() call here.
+    other = sqlite3.connect(path)
+    other.execute("INSERT INTO preferences (key, value) VALUES ('verbosity', 'concise')")
+    other.commit()
+    version, prefs = snapshots.get(conn)
+    assert version == 1 and prefs == {"verbosity": "concise"}
+
+    other.execute("INSERT INTO preference_resets (scope) VALUES ('global')")
+    other.commit()
+    assert preferences_version(conn) == 2
+
+    snapshots.invalidate()
+    snapshots.get(conn)
+    assert loads == ["global", "global", "global"]
+    assert snapshots.metrics()["hits"] == 1
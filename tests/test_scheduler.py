@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from src.backend.scheduler import GenerationScheduler, QueueTimeout
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+def test_round_robin_across_conversations_and_priorities() -> None:
+    scheduler = GenerationScheduler(max_concurrent=1)
+    running = scheduler.submit(1)
+    assert running.granted
+
+    a1 = scheduler.submit(1)
+    a2 = scheduler.submit(1)
+    b1 = scheduler.submit(2)
+    regen = scheduler.submit(3, priority="regenerate")
+    urgent = scheduler.submit(4)
+
+    assert [scheduler.position(t) for t in (a1, b1, urgent, a2, regen)] == [1, 2, 3, 4, 5]
+
+    order = []
+    for _ in range(5):
+        current = next(t for t in (running, a1, a2, b1, regen, urgent) if t.granted and not t.released)
+        current.release()
+        order.append(next(t for t in (a1, a2, b1, regen, urgent) if t.granted and not t.released))
+    assert order[:4] == [a1, b1, urgent, a2]
+    assert scheduler.metrics()["granted_total"] == 6
+
+
+@pytest.mark.anyio
+async def test_positions_stream_and_timeout() -> None:
+    scheduler = GenerationScheduler(max_concurrent=1, queue_timeout_s=5)
+    holder = scheduler.submit(1)
+    waiter = scheduler.submit(2)
+
+    seen = []
+
+    async def wait() -> None:
+        async for position in waiter.positions():
+            seen.append(position)
+
+    task = asyncio.ensure_future(wait())
+    await asyncio.sleep(0.01)
+    holder.release()
+    await asyncio.wait_for(task, 1)
+    assert seen == [1]
+    assert waiter.granted
+
+    late = scheduler.submit(3)
+    with pytest.raises(QueueTimeout):
+        async for _ in late.positions(timeout_s=0.05):
+            pass
+    metrics = scheduler.metrics()
+    assert metrics["timeouts_total"] == 1
+    assert metrics["queue_depth"]["interactive"] == 0
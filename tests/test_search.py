@@ -0,0 +1,50 @@
+import sqlite3
+from pathlib import Path
+
+from src.backend import search
+
+SCHEMA = (Path(search.__file__).with_name("schema.sql")).read_text(encoding="utf-8")
+
+
+def _connect(path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def test_fts_terms_quotes_user_input() -> None:
+    assert search.fts_terms('C++ "quoted" AND') == '"C++" """quoted""" "AND"'
+    assert search.fts_terms("   ") == ""
+
+
+def test_existing_rows_are_backfilled_and_paginated(tmp_path) -> None:
+    conn = _connect(tmp_path / "chat.db")
+    # A database from before the FTS tables existed.
+    start = SCHEMA.index("-- Full-text indexes")
+    end = SCHEMA.index("CREATE TRIGGER IF NOT EXISTS prevent_update_messages")
+    conn.executescript(SCHEMA[:start] + SCHEMA[end:])
+    conn.executemany(
+        "INSERT INTO messages (content, role) VALUES (?, 'user')",
+        [(f"garlic {'garlic ' * i}bread",) for i in range(5)],
+    )
+    conn.commit()
+
+    existing = {r["name"] for r in conn.execute("SELECT name FROM sqlite_master")}
+    conn.executescript(SCHEMA)
+    search.rebuild_missing_indexes(conn, {"messages_fts", "events_fts"} - existing)
+    conn.execute("INSERT INTO messages (content, role) VALUES ('fresh garlic', 'assistant')")
+
+    seen = []
+    cursor = None
+    while True:
+        page, cursor = search.search_messages(conn, "garlic", limit=2, cursor=cursor)
+        seen.extend(r["id"] for r in page)
+        if cursor is None:
+            break
+    assert sorted(seen) == [1, 2, 3, 4, 5, 6]
+    assert len(seen) == len(set(seen))
+
+    hits, _ = search.search_messages(conn, "bread", role="user", limit=10)
+    assert len(hits) == 5
+    assert "<mark>bread</mark>" in hits[0]["snippet"]
+    conn.close()
@@ -0,0 +1,26 @@
+from src.backend.semantic_cache import SemanticCache
+
+
+def test_semantic_cache_partitions_and_evicts():
+    cache = SemanticCache(max_entries=2, threshold=0.95)
+    cache.add("m1", "q1", [1.0, 0.0], "a1")
+    cache.add("m1", "q2", [0.0, 1.0], "a2")
+    assert cache.lookup("m2", [1.0, 0.0]) is None
+    entry, score = cache.lookup("m1", [2.0, 0.01])
+    assert entry.answer == "a1" and score > 0.99
+    cache.add("m1", "q3", [1.0, 1.0], "a3")
+    # q1 was used more recently than q2, so q2 is evicted.
+    assert cache.lookup("m1", [0.0, 1.0]) is None
+    assert cache.lookup("m1", [1.0, 0.0])[0].answer == "a1"
+    assert cache.metrics()["evictions"] == 1
+
+
+def test_semantic_cache_reuses_rows_and_ignores_other_dimensions():
+    cache = SemanticCache(max_entries=3, threshold=0.9)
+    for i in range(10):
+        cache.add("m1", f"q{i}", [float(i), 1.0, 0.0], f"a{i}")
+    assert cache.metrics()["entries"] == {"m1": 3}
+    assert cache.metrics()["evictions"] == 7
+    assert cache.lookup("m1", [9.0, 1.0, 0.0])[0].answer == "a9"
+    assert cache.lookup("m1", [0.0, 1.0, 0.0]) is None  # a0 was evicted
+    assert cache.lookup("m1", [1.0, 0.0]) is None  # wrong dimension is a miss
@@ -0,0 +1,48 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+
+# Measured at ~150 ms on a dev laptop; most of it is FastAPI route and
+# pydantic model registration. Override on slow CI machines.
+IMPORT_BUDGET_MS = float(os.getenv("MYGPT_IMPORT_BUDGET_MS", "400"))
+
+_PROBE = """
+import json, sys, time
+import fastapi
+started = time.perf_counter()
+import src.backend.app
+print(json.dumps({
+    "ms": (time.perf_counter() - started) * 1000.0,
+    "httpx": "httpx" in sys.modules,
+    "tools": "src.backend.tools" in sys.modules,
+}))
+"""
+
+
+def test_import_does_no_io_and_stays_within_budget(tmp_path) -> None:
+    data_dir = tmp_path / "data"
+    env = {
+        **os.environ,
+        "MYGPT_DATA_DIR": str(data_dir),
+        "MYGPT_DB_PATH": str(data_dir / "chat.db"),
+        "MYGPT_LOG_DIR": str(data_dir / "logs"),
+        "MYGPT_STARTUP_LOG": str(data_dir / "perf" / "backend_startup.log"),
+    }
+    out = subprocess.run(
+        [sys.executable, "-c", _PROBE],
+        cwd=REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+
+    assert not data_dir.exists()  # no database, log dir or startup log yet
+    assert not result["httpx"]
+    assert not result["tools"]
+    assert result["ms"] < IMPORT_BUDGET_MS, result
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+from src.backend.token_stream import (
+    DisconnectWatcher,
+    FlushPolicy,
+    StreamStats,
+    coalesce_tokens,
+)
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+async def _tokens(items, delay_s: float = 0.0, closed: list | None = None):
+    try:
+        for item in items:
+            if delay_s:
+                await asyncio.sleep(delay_s)
+            yield item
+    finally:
+        if closed is not None:
+            closed.append(True)
+
+
+async def _collect(frames) -> list[str]:
+    return [frame async for frame in frames]
+
+
+@pytest.mark.anyio
+async def test_first_token_is_immediate_and_burst_is_coalesced() -> None:
+    stats = StreamStats()
+    frames = await _collect(
+        coalesce_tokens(_tokens(["a", "b", "c", "d"]), FlushPolicy(window_ms=50), stats)
+    )
+    assert frames == ["a", "bcd"]
+    assert stats.metrics()["tokens_total"] == 4
+    assert stats.metrics()["frames_total"] == 2
+
+    # Per-token policy passes tokens straight through.
+    assert await _collect(coalesce_tokens(_tokens(["a", "b"]), FlushPolicy())) == ["a", "b"]
+
+
+@pytest.mark.anyio
+async def test_window_and_byte_limits() -> None:
+    # The window flushes buffered text while the next token is still pending.
+    tokens = _tokens(["a", "b", "c"], delay_s=0.03)
+    frames = coalesce_tokens(tokens, FlushPolicy(window_ms=1000))
+    assert await frames.__anext__() == "a"
+    started = asyncio.get_running_loop().time()
+    assert await frames.__anext__() == "bc"
+    assert asyncio.get_running_loop().time() - started < 0.5  # flushed at end, not window
+
+    frames = await _collect(
+        coalesce_tokens(_tokens(["x", "yy", "zz", "w"]), FlushPolicy(window_ms=1000, max_bytes=4))
+    )
+    assert frames == ["x", "yyzz", "w"]
+
+    # Slow streams are not delayed at all.
+    frames = await _collect(coalesce_tokens(_tokens(["a", "b"], delay_s=0.03), FlushPolicy(window_ms=10)))
+    assert frames == ["a", "b"]
+
+
+@pytest.mark.anyio
+async def test_close_cancels_pending_token_and_closes_source() -> None:
+    closed: list = []
+    frames = coalesce_tokens(_tokens(["a", "b"], delay_s=10, closed=closed), FlushPolicy(window_ms=20))
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(frames.__anext__(), timeout=0.05)
+    await frames.aclose()
+    assert closed == [True]
+
+
+@pytest.mark.anyio
+async def test_disconnect_watcher_cancels_stream_and_closes_upstream() -> None:
+    gone = asyncio.Event()
+
+    async def receive() -> dict:
+        await gone.wait()
+        return {"type": "http.disconnect"}
+
+    closed: list = []
+    received: list[str] = []
+
+    async def stream() -> str:
+        watcher = DisconnectWatcher(receive)
+        frames = coalesce_tokens(_tokens(["a", "b"], delay_s=10, closed=closed), FlushPolicy(window_ms=20))
+        watcher.start()
+        try:
+            async for text in frames:
+                received.append(text)
+        except asyncio.CancelledError:
+            if not watcher.absorb_cancel():
+                raise
+        finally:
+            watcher.stop()
+            await frames.aclose()
+        # Cleanup after an absorbed disconnect can still await normally.
+        await asyncio.sleep(0)
+        return "stopped" if watcher.disconnected else "done"
+
+    task = asyncio.ensure_future(stream())
+    await asyncio.sleep(0.05)
+    gone.set()
+    assert await asyncio.wait_for(task, timeout=1) == "stopped"
+    assert closed == [True]
+    assert received == []
+
+
+@pytest.mark.anyio
+async def test_disconnect_watcher_does_not_absorb_outside_cancellation() -> None:
+    async def receive() -> dict:
+        await asyncio.sleep(3600)  # client stays connected
+        return {"type": "http.disconnect"}
+
+    closed: list = []
+    cleaned_up: list = []
+
+    async def stream() -> None:
+        watcher = DisconnectWatcher(receive)
+        frames = coalesce_tokens(_tokens(["a", "b"], delay_s=10, closed=closed), FlushPolicy())
+        watcher.start()
+        try:
+            async for _ in frames:
+                pass
+        except asyncio.CancelledError:
+            if not watcher.absorb_cancel():
+                raise
+        finally:
+            watcher.stop()
+            await frames.aclose()
+            cleaned_up.append(True)
+
+    task = asyncio.ensure_future(stream())
+    await asyncio.sleep(0.05)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert cleaned_up == [True]
+    assert closed == [True]
@@ -0,0 +1,49 @@
+import numpy as np
+
+from src.backend.vector_index import VectorIndex
+
+
+def _vectors(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+
+
+def test_vector_index_flat_and_ivf_search(tmp_path) -> None:
+    base = tmp_path / "chat.vectors"
+    index = VectorIndex(base)
+    data = _vectors(500, 16)
+    ids = list(range(1, 501))
+    convs = [1 + (i % 3) for i in range(500)]
+    index.append(ids[:200], convs[:200], data[:200].tolist(), "m1")
+    index.append(ids[200:], convs[200:], data[200:].tolist(), "m1")
+
+    hits = index.search(data[42].tolist(), k=5)
+    assert hits[0][0] == 43 and abs(hits[0][2] - 1.0) < 1e-5
+    assert len(hits) == 5 and hits[0][2] >= hits[-1][2]
+
+    in_conv = index.search(data[42].tolist(), k=5, conversation_id=2)
+    assert all(conv == 2 for _, conv, _ in in_conv)
+
+    # Reopening maps the same files; IVF keeps exact matches reachable.
+    reopened = VectorIndex(base)
+    assert reopened.count == 500 and reopened.last_message_id == 500
+    assert reopened.build_ivf(nlist=8) == 8
+    assert reopened.search(data[7].tolist(), k=1, nprobe=2)[0][0] == 8
+    reopened.append([501], [None], _vectors(1, 16, seed=1).tolist(), "m1")
+    assert VectorIndex(base).metrics()["mode"] == "ivf"
+    assert reopened.search(_vectors(1, 16, seed=1)[0].tolist(), k=1)[0][:2] == (501, None)
+
+
+def test_vector_index_resets_on_model_change(tmp_path) -> None:
+    index = VectorIndex(tmp_path / "chat.vectors")
+    index.append([1, 2], [1, 1], _vectors(2, 8).tolist(), "m1")
+    index.append([3], [1], _vectors(1, 4).tolist(), "m2")
+    assert index.count == 1 and index.model == "m2" and index.dim == 4
+
+
+def test_vector_index_metrics_do_not_wait_for_writers(tmp_path) -> None:
+    index = VectorIndex(tmp_path / "chat.vectors")
+    index.append([7, 9], [1, None], _vectors(2, 8).tolist(), "m1")
+    with index._lock:  # as if an append or IVF build were running
+        metrics = index.metrics()
+    assert metrics["rows"] == 2 and metrics["last_message_id"] == 9
+    assert metrics["mode"] == "flat" and metrics["model"] == "m1"